@@ -43,8 +43,8 @@ def _calculate_reward(
     DISLIKE -> reward = -1.0, accumulates -1
     CLEAR   -> reward =  0.3, resets accumulated value
     """
-    last_event = crud.get_user_last_book_event(db, user_id, book_id)
-    prev_state = last_event.reward_w if last_event else 0.0
+    current = crud.get_user_book_state(db, user_id, book_id)
+    prev_state = current.reward_w if current else 0.0
     prev_state = float(prev_state) # type: ignore
     reward = float(0.0)
     new_state = float(0.0)
@@ -108,14 +108,21 @@ def register_feedback(
         action=feedback.action_type,
     )
 
-    slate_id = feedback.slate_id != None if feedback.slate_id else ""
+    slate_id = feedback.slate_id if feedback.slate_id else ""
     pos = feedback.pos if feedback.pos != None else -1
 
-    ctx = ContextFeatures().get_context(
-        user_id=feedback.user_id, book_id=feedback.book_id, db=db
-    )
+    # reuse the context the slate scored; recompute only on a miss
+    key = (feedback.user_id, slate_id, feedback.book_id)
+    ctx = rl.served_contexts.get(key) if slate_id else None
+    if ctx is None:
+        features = rl.features if rl.features is not None else ContextFeatures()
+        ctx = features.get_context(
+            user_id=feedback.user_id,
+            book_id=feedback.book_id,
+            db=db,
+            user_preferred_genres=user.get_genre_list,
+        )
     ctx_json = json.dumps(ctx.tolist())
-    arm_index = rl.ARM_INDEX[feedback.book_id]
 
     try:
         event = crud.create_event(
@@ -133,8 +140,11 @@ def register_feedback(
         if rl.trainer is None:
             raise RuntimeError("RL trainer not initialized")
 
-        # modelo aprende com o reward instantâneo
-        rl.trainer.add_feedback(ctx, arm_index, reward)
+        if rl.candidates is not None:
+            rl.candidates.record(feedback.user_id, feedback.book_id, action_type)
+
+        # modelo aprende com o reward instantâneo (arms are keyed by BookID)
+        rl.trainer.add_feedback(ctx, feedback.book_id, reward)
 
         return schemas.FeedbackResponse(
             success=True,
@@ -5,7 +5,7 @@ Route /slate -> returns book recommendations
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.core import rl_runtime as rl
-import numpy as np
+from app.core.book_cards import book_cards
 from app.db import crud, database
 from app.api import schemas
 import random
@@ -43,22 +43,9 @@ def get_recommendations(
         slate_id = str(uuid.uuid4())
 
         # recommended_books= _random_approach(db, user_id, n_items)
-        recommended_books_ids = _rl_approach(db, user_id, n_items)
-        recommended_data = []
-        for b_idx in recommended_books_ids:
-            book = crud.get_book(db, b_idx)
-            if book:
-                data = {
-                    "book_id": b_idx,
-                    "title": book.title,
-                    "description": book.description if str(book.description) != "None" else "No description available.",
-                    "score": book.avg_rating,
-                    "image": book.get_image
-                    or "https://upload.wikimedia.org/wikipedia/commons/6/65/No-Image-Placeholder.svg",
-                }
-                data["authors"] = ",".join(book.get_authors_list) if book.get_authors_list else "N/A"
-                data["categories"] = ",".join(book.get_categories_list) if book.get_categories_list else "N/A"
-                recommended_data.append(data)
+        recommended_books_ids = _rl_approach(db, user_id, n_items, slate_id=slate_id)
+        # one IN query for the cards that are not cached
+        recommended_data = book_cards.get_cards(db, recommended_books_ids)
 
         return {
             "user_id": user_id,
@@ -81,28 +68,46 @@ def _random_approach(db, user_id, n_items):
     return random_books
 
 
-def _rl_approach(db, user_id, n_items):
-    available_books = crud.get_user_available_books(db, user_id)
-
-    if not available_books:
-        return []
+def _rl_approach(db, user_id, n_items, slate_id=None):
+    if (
+        rl.features is None
+        or rl.recommender is None
+        or rl.scorer is None
+        or rl.candidates is None
+        or rl.item_store is None
+    ):
+        raise RuntimeError("RL trainer not initialized")
 
-    candidate_books = random.sample(available_books, k=min(len(available_books), 30))
+    rl.add_pending_books(db)  # books created since the last slate
 
-    contexts = []
-    arms = []
+    # every available book is scored (factorized UCB, see FactorizedScorer);
+    # candidates come from the user's exclusion bitset, no Book rows loaded.
+    # Their arm-index rows are also the item store and scorer rows, so the
+    # whole slate is computed on row arrays, without per-book lookups
+    rows = rl.candidates.candidate_rows(db, user_id)
 
-    if rl.features is None or rl.recommender is None:
-        raise RuntimeError("RL trainer not initialized")
-
-    for book in candidate_books:
-        ctx = rl.features.get_context(user_id, book.id, db=db) # type: ignore
-        contexts.append(ctx)
-        arms.append(book.id)
+    if rows.shape[0] == 0:
+        return []
 
-    contexts = np.array(contexts)
+    # the scorer only needs the user features (once per slate) and
+    # genre_match, from the user's (cached) preferred genres and the
+    # catalog's category bitmasks
+    preferred_genres = rl.features.get_user_genres(user_id, db=db)
+    user_feat = rl.features.get_user_features(user_id, db=db)
+    genre_match = rl.item_store.genre_match_rows(rows, preferred_genres)[:, None]
 
-    chosen_books_ids = rl.recommender.recommend(
-        candidate_arms=arms, contexts=contexts, n_recommendations=n_items
+    chosen = rl.scorer.recommend_rows(
+        rows, user_feat, n_recommendations=n_items, dynamic_item=genre_match
     )
+    chosen_books_ids = rl.scorer.arm_ids(chosen)
+
+    # keep the served contexts for /feedback/register (chosen arms only)
+    if slate_id is not None and chosen_books_ids:
+        contexts = rl.item_store.contexts(chosen_books_ids)
+        contexts[:, : rl.features.user_dim] = user_feat
+        contexts[:, rl.features.genre_match_col] = rl.item_store.genre_match_rows(
+            chosen, preferred_genres
+        )
+        for book_id, ctx in zip(chosen_books_ids, contexts):
+            rl.served_contexts.put((user_id, slate_id, book_id), ctx)
     return chosen_books_ids
@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 
 from app.db import crud, database
 from app.api import schemas
+from app.core import rl_runtime as rl
 import bcrypt
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -156,6 +157,8 @@ def update_profile(
             crud.update_user_genres(
                 db, user_id, ",".join(profile_data.preferred_genres)
             )
+            if rl.features is not None:
+                rl.features.invalidate_user_genres(user_id)
 
         return schemas.FeedbackResponse(
             success=True,
@@ -0,0 +1,117 @@
+"""
+Slate hydration: pre-rendered book cards with an in-process LRU/TTL cache
+"""
+
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.db import crud, models
+from app.utils.config import RECOMMENDER_CONFIG
+from app.utils.ttl_cache import TTLCache
+
+NO_IMAGE = "https://upload.wikimedia.org/wikipedia/commons/6/65/No-Image-Placeholder.svg"
+
+
+def render_card(book: models.Book) -> dict:
+    """Builds the slate card of a book (BookRecommendation fields)."""
+    authors = book.get_authors_list
+    categories = book.get_categories_list
+    return {
+        "book_id": book.id,
+        "title": book.title,
+        "description": book.description if str(book.description) != "None" else "No description available.",
+        "score": book.avg_rating,
+        "image": book.get_image or NO_IMAGE,
+        "authors": ",".join(authors) if authors else "N/A",
+        "categories": ",".join(categories) if categories else "N/A",
+    }
+
+
+class BookCardCache:
+    """
+    LRU cache (with TTL) of rendered book cards keyed by book id.
+
+    `get_cards` hydrates a whole slate: cached cards are served from memory
+    and the misses are loaded with a single IN query. Entries are dropped
+    when a transaction that updated or deleted the book through the ORM
+    commits (see the session listeners below) or when their TTL expires.
+    """
+
+    def __init__(self, max_size: int = 5000, ttl: Optional[float] = 600.0) -> None:
+        """
+        Args:
+            max_size: Maximum number of cards kept.
+            ttl: Seconds a card stays valid (None: no expiry).
+        """
+        self._cards = TTLCache(max_size, ttl)
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def get_cards(self, db: Session, book_ids: List[int]) -> List[dict]:
+        """
+        Returns the cards of `book_ids`, in order (unknown books skipped).
+        Each card is a copy, safe to modify.
+        """
+        found: Dict[int, dict] = {}
+        for bid in book_ids:
+            card = self._cards.get(int(bid))
+            if card is not None:
+                found[int(bid)] = card
+
+        missing = [int(b) for b in dict.fromkeys(book_ids) if int(b) not in found]
+        if missing:
+            for book in crud.get_books(db, missing):
+                card = render_card(book)
+                self._cards.put(int(book.id), card)  # type: ignore
+                found[int(book.id)] = card  # type: ignore
+
+        return [dict(found[int(b)]) for b in book_ids if int(b) in found]
+
+    def invalidate(self, book_id: Optional[int] = None) -> None:
+        """Drops the card of a book (all cards if None)."""
+        if book_id is None:
+            self._cards.clear()
+        else:
+            self._cards.pop(int(book_id))
+
+
+book_cards = BookCardCache(
+    max_size=RECOMMENDER_CONFIG.get("book_card_cache_size", 5000),
+    ttl=RECOMMENDER_CONFIG.get("book_card_ttl", 600.0),
+)
+
+
+# key of the book ids flushed as changed in Session.info, until the commit
+_STALE_KEY = "book_cards_stale"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_stale_cards(session: Session, flush_context) -> None:
+    """Collects the books updated or deleted by a flush (dirty/deleted are still pre-flush)."""
+    changed = [
+        obj.id
+        for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, models.Book)
+    ]
+    if changed:
+        session.info.setdefault(_STALE_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_book_cards(session: Session) -> None:
+    """
+    Drops the cards of the books changed in the committed transaction.
+    Invalidating at flush time would let a concurrent request re-cache the
+    old row before the commit (or clear the cache for a rollback).
+    """
+    for book_id in session.info.pop(_STALE_KEY, ()):
+        book_cards.invalidate(book_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stale_cards(session: Session) -> None:
+    """The changes were rolled back: the cached cards are still current."""
+    session.info.pop(_STALE_KEY, None)
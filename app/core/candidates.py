@@ -0,0 +1,173 @@
+"""
+Candidate generation over the dense arm index (per-user exclusion bitsets)
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.db import crud, models
+
+# feedback states that remove a book from the user's candidates
+EXCLUDED_STATES = [models.ActionType.LIKE, models.ActionType.DISLIKE]
+
+
+class CandidateIndex:
+    """
+    Keeps, for recently active users, a bitset over the arm index (same
+    order as rl_runtime.BOOK_IDS / ARM_INDEX) with the books they currently
+    like or dislike.
+
+    Candidates are enumerated (or sampled) with NumPy from the bitset, so
+    slates never load Book rows for the whole catalog. Bitsets are loaded
+    from user_book_state on first use, kept in an LRU of `max_users`
+    entries and updated in place by `record` on feedback. A load that
+    overlaps a `record` (or `invalidate`) of the same user may have read
+    user_book_state before that event, so it is discarded and redone.
+    """
+
+    def __init__(self, book_ids: Iterable[int], max_users: int = 10000) -> None:
+        """
+        Args:
+            book_ids: Arm ids in arm-index order.
+            max_users: Number of user bitsets kept in memory.
+        """
+        self.arm_ids = np.asarray(list(book_ids), dtype=np.int64)
+        self.index = {int(b): i for i, b in enumerate(self.arm_ids.tolist())}
+        self.max_users = max(int(max_users), 1)
+        self._bits: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # user_id -> [loads in flight, records seen meanwhile]
+        self._loading: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return self.arm_ids.shape[0]
+
+    def add_arms(self, book_ids: Iterable[int]) -> None:
+        """Appends new arms (cached bitsets grow on their next use)."""
+        with self._lock:
+            new = [int(b) for b in book_ids if int(b) not in self.index]
+            start = self.arm_ids.shape[0]
+            self.index.update({b: start + i for i, b in enumerate(new)})
+            self.arm_ids = np.concatenate([self.arm_ids, np.array(new, dtype=np.int64)])
+
+    # ==================== Bitsets ====================
+
+    def _load(self, db: Session, user_id: int) -> np.ndarray:
+        """Builds the packed bitset of a user from user_book_state."""
+        excluded = np.zeros(len(self), dtype=bool)
+        book_ids = crud.get_user_book_ids_by_state(db, user_id, EXCLUDED_STATES)
+        rows = [self.index[b] for b in book_ids if b in self.index]
+        excluded[rows] = True
+        return np.packbits(excluded)
+
+    def _load_cached(self, db: Session, user_id: int) -> np.ndarray:
+        """Loads a user's bitset into the LRU, redoing loads made stale by `record`."""
+        while True:
+            with self._lock:
+                loading = self._loading.setdefault(user_id, [0, 0])
+                loading[0] += 1
+                seen = loading[1]
+
+            bits = None
+            try:
+                bits = self._load(db, user_id)
+            finally:
+                with self._lock:
+                    loading[0] -= 1
+                    if loading[0] == 0:
+                        self._loading.pop(user_id, None)
+                    stale = loading[1] != seen
+                    if bits is not None and not stale:
+                        # a concurrent load may have won: keep that one
+                        bits = self._bits.setdefault(user_id, bits)
+                        self._bits.move_to_end(user_id)
+                        while len(self._bits) > self.max_users:
+                            self._bits.popitem(last=False)
+            if not stale:
+                return bits
+
+    def excluded(self, db: Session, user_id: int, n: Optional[int] = None) -> np.ndarray:
+        """Boolean mask (n,) of the arms excluded for the user (n: all arms)."""
+        with self._lock:
+            bits = self._bits.get(user_id)
+            if bits is not None:
+                self._bits.move_to_end(user_id)
+
+        if bits is None:
+            bits = self._load_cached(db, user_id)
+
+        n = len(self) if n is None else n
+        mask = np.unpackbits(bits, count=min(n, bits.shape[0] * 8)).astype(bool)
+        if mask.shape[0] < n:
+            # arms added after the bitset was built: never excluded yet
+            mask = np.concatenate([mask, np.zeros(n - mask.shape[0], dtype=bool)])
+        return mask
+
+    def record(self, user_id: int, book_id: int, action: models.ActionType) -> None:
+        """Applies a feedback event to the user's cached bitset (if cached)."""
+        with self._lock:
+            self._mark_loading(user_id)
+            bits = self._bits.get(user_id)
+            row = self.index.get(int(book_id))
+            if bits is None or row is None:
+                return
+            byte, bit = row >> 3, np.uint8(0x80 >> (row & 7))
+            if byte >= bits.shape[0]:
+                bits = np.concatenate([bits, np.zeros(byte + 1 - bits.shape[0], dtype=np.uint8)])
+                self._bits[user_id] = bits
+            if action in EXCLUDED_STATES:
+                bits[byte] |= bit
+            else:
+                bits[byte] &= ~bit
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drops the cached bitset of a user (all users if None)."""
+        with self._lock:
+            if user_id is None:
+                self._bits.clear()
+                for loading in self._loading.values():
+                    loading[1] += 1
+            else:
+                self._bits.pop(user_id, None)
+                self._mark_loading(user_id)
+
+    def _mark_loading(self, user_id: int) -> None:
+        """Makes the in-flight loads of a user stale (caller holds the lock)."""
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    # ==================== Candidates ====================
+
+    def candidates(
+        self,
+        db: Session,
+        user_id: int,
+        sample: Optional[int] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """
+        Arm ids available to the user (not currently liked/disliked), in
+        arm-index order, or a random sample of `sample` of them.
+        """
+        rows = self.candidate_rows(db, user_id, sample, rng)
+        return self.arm_ids[rows]  # rows only grow: any snapshot covers them
+
+    def candidate_rows(
+        self,
+        db: Session,
+        user_id: int,
+        sample: Optional[int] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """Arm-index rows of `candidates` (ascending unless sampled)."""
+        n = self.arm_ids.shape[0]  # snapshot: add_arms replaces the array
+        available = np.flatnonzero(~self.excluded(db, user_id, n=n))
+        if sample is not None and sample < available.shape[0]:
+            rng = rng or np.random.default_rng()
+            available = rng.choice(available, size=sample, replace=False)
+        return available
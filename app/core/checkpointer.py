@@ -0,0 +1,137 @@
+"""
+Coalescing background writer for model checkpoints
+"""
+
+import threading
+import time
+from typing import Optional
+
+from app.core.recommender.wal import FeedbackLog
+from app.utils.config import RECOMMENDER_CONFIG
+
+
+class Checkpointer:
+    """
+    Saves the model from one long-lived thread.
+
+    `request` only marks a save as pending: requests made while a save is in
+    flight (or during the `min_interval` that follows one) are merged into a
+    single next save, which checkpoints whatever model snapshot is current
+    when it starts, so the latest state always wins and at most one write to
+    the checkpoint files runs at a time. The writes themselves are atomic
+    (see LinUCBRecommender.save_state / checkpoint). After each save, the
+    feedback log drops the records the saved state includes.
+    """
+
+    def __init__(
+        self,
+        recommender,
+        min_interval: Optional[float] = None,
+        wal: Optional[FeedbackLog] = None,
+    ) -> None:
+        """
+        Args:
+            recommender: Model with a `checkpoint(path)` method (returning
+                         the wal_seq it saved).
+            min_interval: Minimum seconds between the start of two saves
+                          (default RECOMMENDER_CONFIG["checkpoint_min_interval"]).
+            wal: Feedback log truncated after each successful save.
+        """
+        self.recommender = recommender
+        self.wal = wal
+        if min_interval is None:
+            min_interval = RECOMMENDER_CONFIG.get("checkpoint_min_interval", 0.0)
+        self.min_interval = float(min_interval)
+
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Optional[str] = None  # path of the next save
+        self._in_flight = False
+        self._stopping = False
+        self._last_start = float("-inf")  # monotonic
+
+        # metrics (see `stats`)
+        self.requests = 0
+        self.saves = 0
+        self.failures = 0
+        self.last_save_at: Optional[float] = None  # unix time of the last successful save
+        self.last_save_seconds: Optional[float] = None
+
+    def request(self, path: str) -> None:
+        """Asks for a save of the current model to `path` (non-blocking)."""
+        with self._cond:
+            if self._stopping:
+                return
+            self._pending = str(path)
+            self.requests += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="model-checkpointer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until no save is pending or in flight. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._pending is None and not self._in_flight, timeout
+            )
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Writes the pending save (ignoring min_interval) and stops the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                self._cond.wait_for(lambda: self._pending is not None or self._stopping)
+                if self._pending is None:
+                    return  # stopping, nothing left to save
+
+                delay = self._last_start + self.min_interval - time.monotonic()
+                if delay > 0 and not self._stopping:
+                    self._cond.wait(delay)  # more requests merge meanwhile
+                    continue
+
+                path, self._pending = self._pending, None
+                self._in_flight = True
+                self._last_start = time.monotonic()
+
+                self._cond.release()
+                try:
+                    self._save(path)
+                finally:
+                    self._cond.acquire()
+                    self._in_flight = False
+                    self._cond.notify_all()
+
+    def _save(self, path: str) -> None:
+        start = time.perf_counter()
+        try:
+            wal_seq = self.recommender.checkpoint(path)
+            if self.wal is not None and wal_seq:
+                self.wal.truncate(wal_seq)
+        except Exception as e:
+            self.failures += 1
+            print(f"[WARN] Falha ao salvar estado LinUCB em background: {e}")
+            return
+        self.saves += 1
+        self.last_save_seconds = time.perf_counter() - start
+        self.last_save_at = time.time()
+        print(f"[INFO] Estado do modelo salvo em {path}")
+
+    def stats(self) -> dict:
+        """Save counters and the time/duration of the last successful save."""
+        return {
+            "checkpoint_requests": self.requests,
+            "checkpoint_saves": self.saves,
+            "checkpoint_failures": self.failures,
+            "last_save_at": self.last_save_at,
+            "last_save_seconds": self.last_save_seconds,
+        }
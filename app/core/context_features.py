@@ -2,16 +2,19 @@
 Generation of context features (user + item)
 """
 
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import numpy as np
 from sqlalchemy.orm import Session
 from app.utils.config import RECOMMENDER_CONFIG
 from app.db import crud, models
-from app.api import schemas
+from app.utils.ttl_cache import TTLCache
 import math
 import json
 import os
 
+if TYPE_CHECKING:
+    from app.core.item_features import ItemFeatureStore
+
 
 def _load_item_config(path: str = RECOMMENDER_CONFIG["item_config"]):
     """
@@ -73,6 +76,13 @@ class ContextFeatures:
 
         self.user_dim = 3  # like_rate, activity, bias
 
+        # optional precomputed item matrix (set by rl_runtime.init_runtime)
+        self.item_store: Optional["ItemFeatureStore"] = None
+
+        # user_id -> preferred genres (LRU, shared by the request threads),
+        # invalidated by PUT /users/profile
+        self._user_genres = TTLCache(max_size=10000)
+
         cfg = _load_item_config()
 
         self.top_category_ids: List[int] = cfg["top_categories_ids"]
@@ -96,6 +106,11 @@ class ContextFeatures:
         # total context size
         self.feature_dim = self.user_dim + self.item_dim
 
+        # columns that depend on the user (user features + genre_match);
+        # every other column only depends on the book
+        self.genre_match_col = self.user_dim + 2
+        self.dynamic_cols = list(range(self.user_dim)) + [self.genre_match_col]
+
     def get_user_features(
         self,
         user_id: int,
@@ -114,18 +129,16 @@ class ContextFeatures:
         if db is None:
             return np.array([0.5, 0.0, 1.0], dtype=float)
 
-        like_events = crud.get_user_events(db, user_id, schemas.ActionType.LIKE)
-        dislike_events = crud.get_user_events(db, user_id, schemas.ActionType.DISLIKE)
-        all_events = crud.get_user_events(db, user_id)
-
-        total_events = len(all_events)
+        # incrementally maintained counters (O(1), see crud.create_event)
+        stats = crud.get_user_stats(db, user_id)
+        total_events = int(stats.total_events) if stats else 0  # type: ignore
 
         if total_events == 0:
             like_rate = 0.5
             activity = 0.0
         else:
-            likes = len(like_events)
-            dislikes = len(dislike_events)
+            likes = int(stats.likes)  # type: ignore
+            dislikes = int(stats.dislikes)  # type: ignore
             engagement = likes + dislikes
 
             if engagement == 0:
@@ -139,6 +152,23 @@ class ContextFeatures:
 
         return np.array([like_rate, activity, bias], dtype=float)
 
+    def get_user_genres(self, user_id: int, db: Optional[Session] = None) -> List[str]:
+        """Preferred genres of a user (cached per user, [] if none)."""
+        genres = self._user_genres.get(user_id)
+        if genres is not None:
+            return genres
+        if db is None:
+            return []
+
+        user = crud.get_user(db, user_id)
+        genres = user.get_genre_list if user else []
+        self._user_genres.put(user_id, genres)
+        return genres
+
+    def invalidate_user_genres(self, user_id: int) -> None:
+        """Drops the cached preferences of a user (after a profile update)."""
+        self._user_genres.pop(user_id)
+
     def get_item_features(
         self,
         book_id: int,
@@ -158,6 +188,12 @@ class ContextFeatures:
                             0.0 if not, 0.5 if preferences are empty/null
         - categories/authors/publishers: multi-hot based on JSON top_* lists
         """
+        if self.item_store is not None and book_id in self.item_store:
+            # precomputed row (genre_match depends on the user, filled below)
+            item_vec = self.item_store.get(book_id)
+            item_vec[2] = self.item_store.genre_match([book_id], user_preferred_genres)[0]
+            return item_vec
+
         if db is None:
             return np.zeros(self.item_dim, dtype=float)
 
@@ -165,6 +201,31 @@ class ContextFeatures:
         if not book:
             return np.zeros(self.item_dim, dtype=float)
 
+        return self.book_item_features(book, user_preferred_genres)
+
+    @staticmethod
+    def _genre_match(
+        book_categories: List[str], user_preferred_genres: Optional[List[str]]
+    ) -> float:
+        """genre_match feature (see get_item_features)."""
+        genre_match = 0.5
+        if user_preferred_genres is not None:
+            book_cats = [g.lower().strip() for g in book_categories]
+            prefs = [g.lower().strip() for g in user_preferred_genres]
+            if prefs:
+                has_intersection = any(c in prefs for c in book_cats)
+                genre_match = 1.0 if has_intersection else 0.0
+        return genre_match
+
+    def book_item_features(
+        self,
+        book: models.Book,
+        user_preferred_genres: Optional[List[str]] = None,
+    ) -> np.ndarray:
+        """
+        Builds the item vector of an already loaded book (see get_item_features).
+        Used directly by ItemFeatureStore to build the catalog in bulk.
+        """
         # numerical features: rating and popularity
         avg_rating = book.avg_rating if book.avg_rating is not None else 0.0
         norm_rating = max(min(avg_rating / 5.0, 1.0), 0.0)
@@ -175,13 +236,7 @@ class ContextFeatures:
         norm_popularity = max(min(norm_popularity, 1.0), 0.0)
 
         # genre_match with user preferences
-        genre_match = 0.5
-        if user_preferred_genres is not None:
-            book_cats = [g.lower().strip() for g in book.get_categories_list]
-            prefs = [g.lower().strip() for g in user_preferred_genres]
-            if prefs:
-                has_intersection = any(c in prefs for c in book_cats)
-                genre_match = 1.0 if has_intersection else 0.0
+        genre_match = self._genre_match(book.get_categories_list, user_preferred_genres)
 
         num_feats = np.array([norm_rating, norm_popularity, genre_match], dtype=float)
 
@@ -260,3 +315,59 @@ class ContextFeatures:
             user_preferred_genres=user_preferred_genres,
         )
         return self._combine_features(user_feat, item_feat)
+
+    def get_items_features(
+        self,
+        book_ids: List[int],
+        db: Optional[Session] = None,
+        user_preferred_genres: Optional[List[str]] = None,
+    ) -> np.ndarray:
+        """
+        Batched version of get_item_features: returns a (n, item_dim) matrix.
+
+        Books in the item store are gathered with one fancy-index; the others
+        are loaded from the database in a single query (zeros if not found).
+        """
+        book_ids = [int(b) for b in book_ids]
+        items = np.zeros((len(book_ids), self.item_dim), dtype=float)
+
+        store = self.item_store
+        in_store = [i for i, b in enumerate(book_ids) if store is not None and b in store]
+        if in_store:
+            stored_ids = [book_ids[i] for i in in_store]
+            items[in_store] = store.get_many(stored_ids)  # type: ignore
+            # one AND/any over the category bitmasks
+            items[in_store, 2] = store.genre_match(stored_ids, user_preferred_genres)  # type: ignore
+
+        if db is not None and len(in_store) < len(book_ids):
+            stored = set(in_store)
+            positions = {b: i for i, b in enumerate(book_ids) if i not in stored}
+            for book in crud.get_books_with_relations(db, list(positions)):
+                items[positions[int(book.id)]] = self.book_item_features(  # type: ignore
+                    book, user_preferred_genres
+                )
+
+        return items
+
+    def get_contexts(
+        self,
+        user_id: int,
+        book_ids: List[int],
+        db: Optional[Session] = None,
+        user_preferred_genres: Optional[List[str]] = None,
+    ) -> np.ndarray:
+        """
+        Batched version of get_context for one user and several books.
+
+        The user features are computed once and broadcast against the stacked
+        item features.
+
+        Returns:
+            Context matrix (len(book_ids), feature_dim)
+        """
+        contexts = np.empty((len(book_ids), self.feature_dim), dtype=float)
+        contexts[:, : self.user_dim] = self.get_user_features(user_id, db=db)
+        contexts[:, self.user_dim :] = self.get_items_features(
+            book_ids, db=db, user_preferred_genres=user_preferred_genres
+        )
+        return contexts
@@ -0,0 +1,390 @@
+"""
+Precomputed item feature matrix (ItemFeatureStore)
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from pathlib import Path
+import copy
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.context_features import ContextFeatures
+from app.db import crud
+
+# books loaded per query when building rows (SQLite caps IN parameters)
+_CHUNK = 500
+
+
+class _Catalog:
+    """
+    One version of the ItemFeatureStore rows. Published versions are never
+    modified: writers `copy` the current one, fill the copy and swap it in.
+    Copies share the matrix and mask buffers and only append rows past the
+    `n` rows the older versions see.
+    """
+
+    def __init__(self, item_dim: int) -> None:
+        self.n = 0  # rows in use
+        self.index: Dict[int, int] = {}  # book_id -> row
+        self.book_ids: List[int] = []
+        self.categories: List[List[str]] = []
+        self.hashes: List[str] = []  # content hash of each row (persisted stores)
+        self.matrix = np.zeros((0, item_dim))  # rows past n: spare capacity
+
+        # category bitmasks (genre_match)
+        self.genre_vocab: Dict[str, int] = {}  # normalized category -> bit
+        self.genre_masks = np.zeros((0, 1), dtype=np.uint64)
+        self.compiled: Dict[Tuple[str, ...], np.ndarray] = {}  # preference masks
+
+    def copy(self) -> "_Catalog":
+        new = copy.copy(self)
+        new.index = dict(self.index)
+        new.book_ids = list(self.book_ids)
+        new.categories = list(self.categories)
+        new.hashes = list(self.hashes)
+        new.genre_vocab = dict(self.genre_vocab)
+        new.compiled = {}  # compiled against this version's vocabulary
+        return new
+
+    def append(self, book_ids: List[int]) -> None:
+        """Adds empty rows for `book_ids`, growing the matrix geometrically."""
+        n, end = self.n, self.n + len(book_ids)
+        if end > self.matrix.shape[0]:
+            grown = np.zeros((max(end, 2 * n), self.matrix.shape[1]))
+            grown[:n] = self.matrix[:n]
+            self.matrix = grown
+        else:
+            self.matrix[n:end] = 0.0  # rows older versions never read
+        self.index.update({b: n + i for i, b in enumerate(book_ids)})
+        self.book_ids.extend(book_ids)
+        self.categories.extend([] for _ in book_ids)
+        self.hashes.extend("" for _ in book_ids)
+        self.n = end
+
+
+class ItemFeatureStore:
+    """
+    Keeps the item features of the whole catalog in one (n_books, item_dim)
+    matrix, so a slate gathers its candidates with a single fancy-index
+    instead of one ORM round-trip (plus lazy loads) per book.
+
+    Rows follow the order given to `build` (BOOK_IDS), so after
+    `init_runtime` a book's row is its ARM_INDEX entry; books added later
+    are appended. genre_match depends on the user and is stored as 0.5 (no
+    preferences); each row also keeps the book's category names so
+    ContextFeatures can fill it in.
+
+    genre_match is computed with bitmasks: every normalized category name
+    gets a bit, each book a (words,) uint64 mask of its categories and each
+    preference list the same kind of mask, so a whole slate is one AND/any.
+
+    The rows are kept in a snapshot (like FactorizedScorer's cache):
+    `build` and `add_books` prepare a new version off to the side and
+    publish it with one attribute swap, so request threads never see an
+    index entry before its row or mask. Writers are serialized by a lock.
+
+    The matrix can be persisted as `<path>.npy` (plus a `<path>.json` with
+    the book ids, categories, a hash of each book's source columns and a
+    signature of the item config), so only new or changed books are
+    computed on the next start.
+    """
+
+    def __init__(self, features: ContextFeatures, path: Optional[str] = None) -> None:
+        """
+        Args:
+            features: Feature extractor (defines item_dim and the top_* lists).
+            path: Base path (without extension) of the persisted matrix; None
+                  keeps it in memory only.
+        """
+        self.features = features
+        self.path = str(path) if path else None
+        self._items = _Catalog(features.item_dim)
+        self._lock = threading.Lock()
+        self._db_url = ""  # database the rows were computed from
+
+    def __contains__(self, book_id) -> bool:
+        return book_id in self._items.index
+
+    def __len__(self) -> int:
+        return self._items.n
+
+    @property
+    def index(self) -> Dict[int, int]:
+        """book_id -> row (do not modify)."""
+        return self._items.index
+
+    @property
+    def book_ids(self) -> List[int]:
+        """Book of each row (do not modify)."""
+        items = self._items
+        return items.book_ids[: items.n]
+
+    @property
+    def genre_vocab(self) -> Dict[str, int]:
+        """Normalized category -> bit of the genre masks."""
+        return self._items.genre_vocab
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Item features (n_books, item_dim), row i for book_ids[i]."""
+        items = self._items
+        return items.matrix[: items.n]
+
+    @property
+    def signature(self) -> str:
+        """
+        Fingerprint of the item config and database: persisted rows computed
+        for another config (or another database) are discarded.
+        """
+        f = self.features
+        cfg = [f.item_dim, f.top_category_ids, f.top_author_ids, f.top_publishers, self._db_url]
+        return hashlib.sha1(json.dumps(cfg).encode("utf-8")).hexdigest()
+
+    # ==================== Lookup ====================
+
+    def rows(self, book_ids: Iterable[int]) -> np.ndarray:
+        """Rows of the given books (KeyError for unknown books)."""
+        return self._rows(self._items, book_ids)
+
+    @staticmethod
+    def _rows(items: _Catalog, book_ids: Iterable[int]) -> np.ndarray:
+        index = items.index
+        book_ids = list(book_ids)
+        return np.fromiter(
+            (index[int(b)] for b in book_ids), dtype=np.int64, count=len(book_ids)
+        )
+
+    def get(self, book_id: int) -> np.ndarray:
+        """Item vector of a book (a copy, safe to modify)."""
+        items = self._items
+        return items.matrix[items.index[book_id]].copy()
+
+    def get_many(self, book_ids: Iterable[int]) -> np.ndarray:
+        """Item vectors (n, item_dim) of several books, in one fancy-index."""
+        items = self._items
+        return items.matrix[self._rows(items, book_ids)]
+
+    def categories(self, book_id: int) -> List[str]:
+        """Category names of a book (for genre_match)."""
+        items = self._items
+        return items.categories[items.index[book_id]]
+
+    # ==================== Genre bitmasks ====================
+
+    @staticmethod
+    def _normalize(genres: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(sorted({g.lower().strip() for g in genres}))
+
+    def _index_genres(self, items: _Catalog, start: int) -> None:
+        """Sets the category bitmasks of the (unpublished) rows from `start` on."""
+        rows = range(start, items.n)
+        names = [self._normalize(items.categories[row]) for row in rows]
+        for cats in names:
+            for c in cats:
+                items.genre_vocab.setdefault(c, len(items.genre_vocab))
+
+        words = max((len(items.genre_vocab) + 63) // 64, 1)
+        capacity = items.matrix.shape[0]
+        if items.genre_masks.shape != (capacity, words):
+            grown = np.zeros((capacity, words), dtype=np.uint64)
+            old = items.genre_masks[:start]
+            grown[:start, : old.shape[1]] = old
+            items.genre_masks = grown
+
+        for row, cats in zip(rows, names):
+            items.genre_masks[row] = self._to_mask(items, cats, words)
+
+    @staticmethod
+    def _to_mask(items: _Catalog, genres: Iterable[str], words: int) -> np.ndarray:
+        mask = np.zeros(words, dtype=np.uint64)
+        for g in genres:
+            bit = items.genre_vocab.get(g)
+            if bit is not None:
+                mask[bit >> 6] |= np.uint64(1) << np.uint64(bit & 63)
+        return mask
+
+    def genre_mask(self, genres: List[str]) -> np.ndarray:
+        """Compiles a preference list into a category bitmask (memoized)."""
+        return self._genre_mask(self._items, genres)
+
+    def _genre_mask(self, items: _Catalog, genres: List[str]) -> np.ndarray:
+        key = self._normalize(genres)
+        mask = items.compiled.get(key)
+        if mask is None:
+            mask = self._to_mask(items, key, items.genre_masks.shape[1])
+            if len(items.compiled) >= 4096:
+                items.compiled.clear()
+            items.compiled[key] = mask
+        return mask
+
+    def genre_match(
+        self, book_ids: Iterable[int], user_preferred_genres: Optional[List[str]]
+    ) -> np.ndarray:
+        """
+        Vectorized genre_match (see ContextFeatures.get_item_features):
+        1.0 if the book shares a category with the preferences, 0.0 if not,
+        0.5 without preferences.
+        """
+        return self.genre_match_rows(self.rows(book_ids), user_preferred_genres)
+
+    def genre_match_rows(
+        self, rows: np.ndarray, user_preferred_genres: Optional[List[str]]
+    ) -> np.ndarray:
+        """`genre_match` of books given by row (their ARM_INDEX entries)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not user_preferred_genres:
+            return np.full(rows.shape[0], 0.5)
+        items = self._items
+        mask = self._genre_mask(items, user_preferred_genres)
+        hits = (items.genre_masks[rows] & mask).any(axis=1)
+        return hits.astype(float)
+
+    def contexts(self, book_ids: Iterable[int]) -> np.ndarray:
+        """Full-size contexts (n, feature_dim) with the user features zeroed."""
+        items = self.get_many(book_ids)
+        out = np.zeros((items.shape[0], self.features.feature_dim))
+        out[:, self.features.user_dim :] = items
+        return out
+
+    # ==================== Build ====================
+
+    def build(self, db: Session, book_ids: List[int]) -> Dict[str, int]:
+        """
+        (Re)builds the store for the catalog `book_ids`, in that order.
+        Rows of a persisted matrix are reused when the book's source columns
+        still hash the same; only unknown or changed books are loaded.
+
+        Returns:
+            Counters: reused and computed rows.
+        """
+        with self._lock:
+            self._db_url = str(db.get_bind().url)
+            known = self._load() if self.path else {}
+
+            book_ids = [int(b) for b in book_ids]
+            known_rows = known.get("rows", {})
+            current = self._content_hashes(db, [b for b in book_ids if b in known_rows])
+            reused = [
+                b
+                for b in book_ids
+                if b in known_rows and known["hashes"][known_rows[b]] == current.get(b)
+            ]
+            items = _Catalog(self.features.item_dim)
+            items.append(book_ids)
+            if reused:
+                rows = self._rows(items, reused)
+                items.matrix[rows] = known["matrix"][[known_rows[b] for b in reused]]
+                for b, row in zip(reused, rows.tolist()):
+                    items.categories[row] = known["categories"][known_rows[b]]
+                    items.hashes[row] = current[b]
+
+            kept = set(reused)
+            missing = [b for b in book_ids if b not in kept]
+            self._compute(db, items, missing)
+            self._index_genres(items, 0)
+            self._items = items
+
+            if self.path and missing:
+                self.save()
+        return {"reused": len(reused), "computed": len(missing)}
+
+    def add_books(self, db: Session, book_ids: Iterable[int]) -> List[int]:
+        """
+        Appends the books that are not in the store yet (incremental
+        rebuild after books are added). Returns the new book ids.
+        """
+        with self._lock:
+            new = [b for b in dict.fromkeys(int(b) for b in book_ids) if b not in self._items.index]
+            if not new:
+                return []
+
+            items = self._items.copy()
+            start = items.n
+            items.append(new)
+            self._compute(db, items, new)
+            self._index_genres(items, start)
+            self._items = items
+            if self.path:
+                self.save()
+        return new
+
+    def _compute(self, db: Session, items: _Catalog, book_ids: List[int]) -> None:
+        """Fills the rows of `book_ids` in the (unpublished) `items`, in bulk."""
+        features = self.features
+        for start in range(0, len(book_ids), _CHUNK):
+            books = crud.get_books_with_relations(db, book_ids[start : start + _CHUNK])
+            for book in books:
+                row = items.index[int(book.id)]  # type: ignore
+                items.matrix[row] = features.book_item_features(book)
+                items.categories[row] = list(book.get_categories_list)
+        if self.path:
+            for b, digest in self._content_hashes(db, book_ids).items():
+                items.hashes[items.index[b]] = digest
+
+    @staticmethod
+    def _content_hashes(db: Session, book_ids: List[int]) -> Dict[int, str]:
+        """Hash of the columns each book's item row is computed from."""
+        hashes = {}
+        for start in range(0, len(book_ids), _CHUNK):
+            sources = crud.get_book_feature_sources(db, book_ids[start : start + _CHUNK])
+            for b, source in sources.items():
+                raw = json.dumps(source, default=str).encode("utf-8")
+                hashes[b] = hashlib.sha1(raw).hexdigest()
+        return hashes
+
+    # ==================== Persistence ====================
+
+    def save(self) -> None:
+        """Writes the matrix (.npy) and its metadata (.json), atomically."""
+        if not self.path:
+            return
+        items = self._items
+        meta = {
+            "signature": self.signature,
+            "book_ids": items.book_ids[: items.n],
+            "categories": items.categories[: items.n],
+            "hashes": items.hashes[: items.n],
+        }
+        # np.save appends .npy to names without it
+        tmp_npy = f"{self.path}.tmp.npy"
+        np.save(tmp_npy, items.matrix[: items.n])
+        os.replace(tmp_npy, f"{self.path}.npy")
+
+        tmp_json = f"{self.path}.json.tmp"
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_json, f"{self.path}.json")
+
+    def _load(self) -> dict:
+        """Reads the persisted rows, or {} if missing/stale."""
+        npy_path, json_path = Path(f"{self.path}.npy"), Path(f"{self.path}.json")
+        if not npy_path.exists() or not json_path.exists():
+            return {}
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            matrix = np.load(npy_path)
+        except Exception as e:
+            print(f"[WARN] Falha ao carregar matriz de itens em '{npy_path}': {e}")
+            return {}
+
+        n = len(meta["book_ids"])
+        if (
+            meta.get("signature") != self.signature
+            or matrix.shape != (n, self.features.item_dim)
+            or len(meta.get("hashes", [])) != n
+        ):
+            # item config changed: every row must be recomputed
+            return {}
+
+        return {
+            "matrix": matrix,
+            "rows": {int(b): i for i, b in enumerate(meta["book_ids"])},
+            "categories": meta["categories"],
+            "hashes": meta["hashes"],
+        }
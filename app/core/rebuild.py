@@ -0,0 +1,306 @@
+"""
+Bulk LinUCB rebuild from the events table
+
+Every event stores the context it was trained on (ctx_features) and its
+reward, so the model can be recomputed from scratch: LinUCB's state per arm
+is just A = I + sum x x^T and b = sum r x, which do not depend on the order
+of the updates. Events are streamed in id order, decoded into NumPy blocks
+and accumulated per arm; arms can be split across processes (book_id modulo
+the number of workers) and the disjoint partitions merged at the end.
+
+Uso:
+    python -m app.core.rebuild [--workers 4] [--output data/models/linucb_model.bin]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import json
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.context_features import ContextFeatures
+from app.core.item_features import ItemFeatureStore
+from app.core.recommender.arm_store import grow
+from app.core.recommender.linucb import LinUCBRecommender
+from app.core.recommender import wal
+from app.db import crud
+from app.utils.config import RECOMMENDER_CONFIG
+
+# events read per query
+CHUNK = 20000
+
+
+class ArmAccumulator:
+    """
+    Sufficient statistics of the arms: S = sum x x^T (so A = I + S) and
+    b = sum r x, in arrays addressed through an arm_id -> row map. The
+    arrays grow geometrically (see arm_store.grow).
+    """
+
+    def __init__(self, d: int) -> None:
+        self.d = d
+        self.index: Dict[int, int] = {}  # arm_id -> row
+        self.S = np.zeros((0, d, d))
+        self.b = np.zeros((0, d))
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _rows(self, arms: np.ndarray) -> np.ndarray:
+        new = [a for a in dict.fromkeys(arms.tolist()) if a not in self.index]
+        if new:
+            n = len(self.index)
+            self.index.update({a: n + i for i, a in enumerate(new)})
+            self.S = grow(self.S, len(self.index), n)
+            self.b = grow(self.b, len(self.index), n)
+            self.count = grow(self.count, len(self.index), n)
+        index = self.index
+        return np.fromiter((index[a] for a in arms.tolist()), dtype=np.int64, count=arms.shape[0])
+
+    def add(self, arms: np.ndarray, X: np.ndarray, rewards: np.ndarray) -> None:
+        """Accumulates the samples (arms (n,), X (n, d), rewards (n,))."""
+        if arms.shape[0] == 0:
+            return
+        rows = self._rows(np.asarray(arms, dtype=np.int64))
+
+        # sorted by row, each arm's samples are one contiguous segment:
+        # S += X_k^T X_k with one matmul per arm (no per-sample outer products)
+        order = np.argsort(rows, kind="stable")
+        rows, X, rewards = rows[order], X[order], rewards[order]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        ends = np.r_[starts[1:], rows.shape[0]]
+        uniq = rows[starts]
+        self.b[uniq] += np.add.reduceat(rewards[:, None] * X, starts, axis=0)
+        self.count[uniq] += ends - starts
+        S = self.S
+        for row, start, end in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+            X_k = X[start:end]
+            S[row] += X_k.T @ X_k
+
+    def merge(self, other: "ArmAccumulator") -> None:
+        """Adds the statistics of another accumulator (e.g. a partition)."""
+        if len(other) == 0:
+            return
+        arm_ids = np.array(list(other.index), dtype=np.int64)
+        rows = self._rows(arm_ids)
+        src = np.fromiter(other.index.values(), dtype=np.int64, count=len(other))
+        self.S[rows] += other.S[src]
+        self.b[rows] += other.b[src]
+        self.count[rows] += other.count[src]
+
+    def bundle(self) -> Dict[str, np.ndarray]:
+        """ArmStore bundle (dense A_inv = inv(I + S)), see ArmStore.put."""
+        n = len(self.index)
+        arm_ids = np.array(list(self.index), dtype=np.int64)
+        return {
+            "arm_ids": arm_ids,
+            "b": self.b[:n].copy(),
+            "A_inv": np.linalg.inv(np.eye(self.d) + self.S[:n]),
+        }
+
+
+def _decode(ctx_features: Sequence[Optional[str]], d: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes JSON contexts in one parse. Returns (X (n, d), ok (n,)) where ok
+    is False for missing contexts or contexts of another dimension.
+    """
+    n = len(ctx_features)
+    X = np.zeros((n, d))
+    ok = np.zeros(n, dtype=bool)
+    present = [i for i, c in enumerate(ctx_features) if c]
+    if not present:
+        return X, ok
+
+    try:
+        parsed = json.loads("[" + ",".join(ctx_features[i] for i in present) + "]")  # type: ignore
+    except ValueError:
+        # a malformed row: parse them one by one, dropping the bad ones
+        parsed = []
+        for i in present:
+            try:
+                parsed.append(json.loads(ctx_features[i]))  # type: ignore
+            except ValueError:
+                parsed.append([])
+
+    valid = [isinstance(ctx, list) and len(ctx) == d for ctx in parsed]
+    sized = [i for i, v in zip(present, valid) if v]
+    if sized:
+        X[sized] = np.array([ctx for ctx, v in zip(parsed, valid) if v], dtype=float)
+        ok[sized] = True
+    return X, ok
+
+
+def _recompute(
+    features: ContextFeatures, db: Session, user_ids: np.ndarray, book_ids: np.ndarray
+) -> np.ndarray:
+    """Current contexts of (user, book) pairs, batched per user."""
+    X = np.zeros((user_ids.shape[0], features.feature_dim))
+    for user_id in np.unique(user_ids).tolist():
+        pos = np.flatnonzero(user_ids == user_id)
+        X[pos] = features.get_contexts(
+            user_id,
+            book_ids[pos].tolist(),
+            db=db,
+            user_preferred_genres=features.get_user_genres(user_id, db=db),
+        )
+    return X
+
+
+def _context_features(db: Session) -> ContextFeatures:
+    """ContextFeatures backed by the (persisted) item feature matrix."""
+    features = ContextFeatures()
+    store = ItemFeatureStore(features, RECOMMENDER_CONFIG.get("item_features_path"))
+    store.build(db, crud.get_all_book_ids(db))
+    features.item_store = store
+    return features
+
+
+def accumulate_events(
+    db: Session,
+    d: int,
+    partition: int = 0,
+    n_partitions: int = 1,
+    chunk: int = CHUNK,
+    recompute: bool = False,
+) -> Tuple[ArmAccumulator, Dict[str, int]]:
+    """
+    Streams the events of one arm partition in id order and accumulates them.
+
+    Events without a stored context of dimension d are skipped, or, with
+    `recompute`, get their context recomputed from the current features
+    (user features reflect the current user stats, not the event time).
+    """
+    acc = ArmAccumulator(d)
+    stats = {"events": 0, "used": 0, "recomputed": 0, "skipped": 0}
+    features = _context_features(db) if recompute else None
+
+    last_id = 0
+    while True:
+        rows = crud.get_event_feedback_chunk(db, last_id, chunk, partition, n_partitions)
+        if not rows:
+            break
+        last_id = int(rows[-1][0])
+        _, user_ids, book_ids, rewards, ctx = zip(*rows)
+        book_ids = np.array(book_ids, dtype=np.int64)
+        rewards = np.array([r or 0.0 for r in rewards], dtype=float)
+
+        X, ok = _decode(ctx, d)
+        if features is not None and not ok.all():
+            redo = np.flatnonzero(~ok)
+            user_redo = np.array(user_ids, dtype=np.int64)[redo]
+            X[redo] = _recompute(features, db, user_redo, book_ids[redo])
+            stats["recomputed"] += redo.shape[0]
+            ok[:] = True
+
+        acc.add(book_ids[ok], X[ok], rewards[ok])
+        stats["events"] += len(rows)
+        stats["used"] += int(ok.sum())
+        stats["skipped"] += int((~ok).sum())
+    return acc, stats
+
+
+def _partition_worker(args) -> Tuple[ArmAccumulator, Dict[str, int]]:
+    """Process-pool entry point: accumulates one partition on its own engine."""
+    db_url, d, partition, n_partitions, chunk, recompute = args
+    engine = create_engine(db_url)
+    db = sessionmaker(bind=engine)()
+    try:
+        return accumulate_events(db, d, partition, n_partitions, chunk, recompute)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def rebuild_model(
+    db: Session,
+    output: Optional[str] = None,
+    workers: int = 1,
+    chunk: int = CHUNK,
+    recompute: bool = False,
+) -> Dict[str, int]:
+    """
+    Rebuilds the LinUCB model from every event and writes it as a fresh
+    checkpoint at `output` (default RECOMMENDER_CONFIG["model_path"]).
+
+    The model uses the current feature_dim, so it also recovers the learning
+    after the features change (old contexts need `recompute`). The feedback
+    log is marked as included (its events are already in the table), so it
+    is not replayed on top of the rebuilt model.
+
+    Args:
+        db: Session of the database with the events.
+        output: Checkpoint path (.json or binary).
+        workers: Processes; each one accumulates the arms with
+                 book_id % workers == its partition (1: in this process).
+        chunk: Events read per query.
+        recompute: Recomputes contexts that are missing or of another dimension.
+
+    Returns:
+        Counters: events, used, recomputed, skipped, arms, seconds.
+    """
+    start = time.perf_counter()
+    d = ContextFeatures().feature_dim
+    output = str(output or RECOMMENDER_CONFIG["model_path"])
+
+    if workers > 1:
+        if recompute:
+            _context_features(db)  # persists the item matrix once for every worker
+        db_url = db.get_bind().url.render_as_string(hide_password=False)
+        jobs = [(db_url, d, p, workers, chunk, recompute) for p in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results: List[Tuple[ArmAccumulator, Dict[str, int]]] = list(
+                pool.map(_partition_worker, jobs)
+            )
+    else:
+        results = [accumulate_events(db, d, chunk=chunk, recompute=recompute)]
+
+    acc = ArmAccumulator(d)
+    stats = {"events": 0, "used": 0, "recomputed": 0, "skipped": 0}
+    for part, part_stats in results:
+        acc.merge(part)
+        for key in stats:
+            stats[key] += part_stats[key]
+
+    recommender = LinUCBRecommender(n_arms=len(acc), d=d, alpha=RECOMMENDER_CONFIG["alpha"])
+    store = recommender.new_store(len(acc))
+    store.put(acc.bundle())
+    wal_path = RECOMMENDER_CONFIG.get("wal_path")
+    if wal_path:
+        logged = wal.read_records(str(wal_path), d)
+        store.wal_seq = int(logged["seq"][-1]) if logged.shape[0] else 0
+    recommender.store = store
+    recommender.save_state(output)
+
+    stats["arms"] = len(acc)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """CLI: rebuilds the model from the application database."""
+    parser = argparse.ArgumentParser(description="Rebuild the LinUCB model from the events table")
+    parser.add_argument("--output", default=None, help="checkpoint path (default: model_path)")
+    parser.add_argument("--workers", type=int, default=1, help="processes (arm partitions)")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="events read per query")
+    parser.add_argument(
+        "--recompute", action="store_true", help="recompute contexts of another feature_dim"
+    )
+    args = parser.parse_args(argv)
+
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        stats = rebuild_model(db, args.output, args.workers, args.chunk, args.recompute)
+    finally:
+        db.close()
+    print(f"[INFO] Modelo reconstruído: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 from .base import BaseRecommender
 from .linucb import LinUCBRecommender
+from .factorized import FactorizedScorer
 
 __all__ = [
     "BaseRecommender",
     "LinUCBRecommender",
+    "FactorizedScorer",
 ]
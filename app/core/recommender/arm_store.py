@@ -0,0 +1,905 @@
+"""
+Block storage for the per-arm LinUCB parameters
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+import copy
+import itertools
+import sys
+import numpy as np
+
+# max |A_inv A - I| tolerated before a reduced-precision A_inv is rebuilt
+DRIFT_TOL = 1e-4
+
+# rows per block of the store arrays (a power of two, see RowBlocks)
+BLOCK_ROWS = 1024
+
+# per-row arrays of ArmStore (the rest are pools addressed through `slot`)
+ROW_ARRAYS = (
+    "arm_ids", "b", "theta", "version", "theta_norm", "lam_max", "rank", "slot", "_since_check"
+)
+
+# ids shared by a store and its copies (see ArmStore.lineage)
+_lineages = itertools.count()
+
+
+def grow(arr: np.ndarray, capacity: int, used: int) -> np.ndarray:
+    """Returns `arr`, or a copy of its first `used` entries with room for `capacity`."""
+    if capacity <= arr.shape[0]:
+        return arr
+    new = np.zeros((max(capacity, 2 * arr.shape[0]),) + arr.shape[1:], dtype=arr.dtype)
+    new[:used] = arr[:used]
+    return new
+
+
+class RowBlocks:
+    """
+    Array of rows kept in fixed-size blocks that copies share.
+
+    Supports the ndarray indexing ArmStore needs: reads and writes of an
+    int, a slice or an integer array of rows (`arr[rows] += v` included);
+    reads return copies. `copy` only copies the block list: a write to a
+    block the copy does not own first replaces that block with a private
+    copy, so readers of the source never see it. Rows at or past the
+    `used` count given to `copy` are not read through the source, so the
+    copy may fill them in place even in a shared block (appends are free).
+
+    Blocks may be views of a memory-mapped checkpoint (`wrap`): they are
+    read in place and a block is only read into memory when written.
+    """
+
+    def __init__(self, shape, dtype, fill=0, block_rows: int = BLOCK_ROWS) -> None:
+        """
+        Args:
+            shape: (rows, ...) shape; rows are allocated in whole blocks.
+            dtype: Element dtype.
+            fill: Initial value of the rows.
+            block_rows: Rows per block (a power of two).
+        """
+        self.tail = tuple(shape[1:])
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self.block_rows = int(block_rows)
+        self._shift = self.block_rows.bit_length() - 1
+        self.blocks: List[np.ndarray] = []
+        self.owned: List[bool] = []
+        self._append_from = 0  # rows >= this may be written in shared blocks
+        self.reserve(shape[0])
+
+    @classmethod
+    def wrap(cls, arr: np.ndarray, block_rows: int = BLOCK_ROWS) -> "RowBlocks":
+        """Adopts `arr` (e.g. a np.memmap) as blocks of views, without copying it."""
+        new = cls((0,) + arr.shape[1:], arr.dtype, block_rows=block_rows)
+        new.blocks = [arr[i : i + block_rows] for i in range(0, arr.shape[0], block_rows)]
+        new.owned = [False] * len(new.blocks)
+        new._append_from = arr.shape[0]
+        return new
+
+    @property
+    def shape(self) -> tuple:
+        if not self.blocks:
+            return (0,) + self.tail
+        return ((len(self.blocks) - 1) * self.block_rows + self.blocks[-1].shape[0],) + self.tail
+
+    @property
+    def ndim(self) -> int:
+        return 1 + len(self.tail)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = np.concatenate(self.blocks) if self.blocks else np.zeros(self.shape, self.dtype)
+        return out if dtype is None else out.astype(dtype)
+
+    def reserve(self, capacity: int) -> None:
+        """Ensures room for `capacity` rows; existing blocks are kept."""
+        if self.blocks and self.blocks[-1].shape[0] < self.block_rows and capacity > len(self):
+            self._own(len(self.blocks) - 1, grow=True)  # a short (wrapped) last block
+        while len(self) < capacity:
+            self.blocks.append(self._new_block())
+            self.owned.append(True)
+
+    def copy(self, used: int) -> "RowBlocks":
+        """
+        Returns a copy sharing every block. Rows below `used` stay shared
+        until written; only the copy may append past them, so the source
+        copies any block it writes from now on.
+        """
+        new = copy.copy(self)
+        new.blocks = list(self.blocks)
+        new.owned = [False] * len(self.blocks)
+        new._append_from = max(int(used), self._append_from)
+        self.owned = [False] * len(self.blocks)
+        self._append_from = sys.maxsize
+        return new
+
+    def truncated(self, length: int) -> "RowBlocks":
+        """Returns a copy of the first `length` rows, sharing the blocks they fill."""
+        new = copy.copy(self)
+        n_blocks = -(-int(length) // self.block_rows)
+        new.blocks = self.blocks[:n_blocks]
+        new.owned = [False] * n_blocks
+        new._append_from = int(length)
+        if length % self.block_rows:
+            new._own(n_blocks - 1)  # its rows past `length` are live in the source
+        return new
+
+    def _new_block(self) -> np.ndarray:
+        shape = (self.block_rows,) + self.tail
+        if self.fill == 0:
+            return np.zeros(shape, dtype=self.dtype)  # pages are only touched when written
+        return np.full(shape, self.fill, dtype=self.dtype)
+
+    def _own(self, b: int, grow: bool = False) -> None:
+        """Replaces block `b` with a private copy (`grow`: a full-size one)."""
+        block = self.blocks[b]
+        new = self._new_block() if grow else np.empty(block.shape, dtype=self.dtype)
+        new[: block.shape[0]] = block
+        self.blocks[b] = new
+        self.owned[b] = True
+
+    def _index(self, key) -> Tuple[np.ndarray, Optional[np.ndarray], List[Tuple[int, int, int]]]:
+        """
+        Resolves `key` to rows grouped by block: returns (rows, order,
+        [(block, start, end)]) where rows[order][start:end] are the rows in
+        that block, in their original order. `order` is None when the rows
+        already come grouped (e.g. sorted, or all in one block).
+        """
+        if isinstance(key, slice):
+            rows = np.arange(*key.indices(len(self)))
+        else:
+            rows = np.asarray(key, dtype=np.int64).reshape(-1)
+        if rows.shape[0] == 0:
+            return rows, None, []
+
+        lo, hi = int(rows.min()), int(rows.max())
+        if lo < 0 or hi >= len(self):
+            if lo < -len(self) or hi >= len(self):
+                raise IndexError(f"row out of range for {len(self)} rows")
+            rows = np.where(rows < 0, rows + len(self), rows)
+            lo, hi = int(rows.min()), int(rows.max())
+        lo, hi = lo >> self._shift, hi >> self._shift
+        if lo == hi:
+            return rows, None, [(lo, 0, rows.shape[0])]
+
+        blk = rows >> self._shift
+        if (blk[1:] >= blk[:-1]).all():
+            bounds = [0] + (np.flatnonzero(np.diff(blk)) + 1).tolist() + [rows.shape[0]]
+            spans = [(int(blk[start]), start, end) for start, end in zip(bounds, bounds[1:])]
+            return rows, None, spans
+
+        blk -= lo
+        if hi - lo <= np.iinfo(np.uint16).max:
+            blk = blk.astype(np.uint16)  # stable sort of small ints is a radix sort
+        order = np.argsort(blk, kind="stable")
+        spans, start = [], 0
+        for b, end in enumerate(np.cumsum(np.bincount(blk)).tolist(), lo):
+            if end > start:
+                spans.append((b, start, end))
+            start = end
+        return rows, order, spans
+
+    def __getitem__(self, key) -> np.ndarray:
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError(f"row {key} out of range for {len(self)} rows")
+            key = int(key) % len(self)
+            return self.blocks[key >> self._shift][key & (self.block_rows - 1)].copy()
+
+        rows, order, spans = self._index(key)
+        offsets = rows & (self.block_rows - 1)
+        if len(spans) <= 1:
+            if not spans:
+                return np.empty((0,) + self.tail, dtype=self.dtype)
+            return self.blocks[spans[0][0]][offsets]
+
+        # gather block by block straight into the output (`_index` checked
+        # the rows: "clip" only skips the per-element bounds checks)
+        if order is not None:
+            offsets = offsets[order]
+        grouped = np.empty((rows.shape[0],) + self.tail, dtype=self.dtype)
+        for b, start, end in spans:
+            self.blocks[b].take(offsets[start:end], axis=0, out=grouped[start:end], mode="clip")
+        if order is None:
+            return grouped
+        out = np.empty_like(grouped)
+        out[order] = grouped
+        return out
+
+    def __setitem__(self, key, value) -> None:
+        rows, order, spans = self._index(key)
+        if not spans:
+            return
+        value = np.broadcast_to(np.asarray(value), (rows.shape[0],) + self.tail)
+        if order is not None:
+            rows, value = rows[order], value[order]
+        offsets = rows & (self.block_rows - 1)
+        for b, start, end in spans:
+            if not self.owned[b] and (
+                self.blocks[b].shape[0] < self.block_rows
+                or rows[start:end].min() < self._append_from
+            ):
+                self._own(b)
+            self.blocks[b][offsets[start:end]] = value[start:end]
+
+
+class ArmStore:
+    """
+    Keeps the parameters of every arm in row-addressed arrays.
+
+    Per-arm vectors (b and a cached theta = A_inv @ b) live in (capacity, d)
+    matrices addressed through a dense arm_id -> row map (the same scheme as
+    rl_runtime.ARM_INDEX). Every array is a RowBlocks: rows are gathered
+    with one fancy-index per block and the arrays grow by whole blocks,
+    without moving the existing rows.
+
+    A_inv uses one of two representations, chosen per arm:
+
+    - low-rank: while an arm has received k <= max_rank updates,
+      A = I + U^T U with its k contexts stacked in U (max_rank, d), so
+      A_inv = I - U^T M U with M = (I + U U^T)^-1 (Woodbury). Unused rows of
+      U are zero, which keeps M block-identity and lets all arms share one
+      padded layout.
+    - dense: past max_rank updates the arm switches to a full (d, d) A_inv.
+
+    `rank[row]` holds k for low-rank arms and -1 for dense ones, and
+    `slot[row]` points into the matching pool (U/M or A_inv).
+
+    The pools (U, M, A_inv) may be kept in float32 and the dense A_inv in
+    packed upper-triangular form (d (d + 1) / 2 entries per arm, A_inv is
+    symmetric). Arithmetic always runs in float64; only the storage is
+    reduced. Rank-1 updates on a float32 A_inv accumulate rounding error, so
+    in that mode the store also keeps A itself (exact up to float32, updated
+    additively) and every `check_every` updates of an arm checks
+    |A_inv A - I|, rebuilding A_inv = inv(A) when it drifted.
+
+    A published store is treated as an immutable snapshot: writers update a
+    `copy` and swap it in (see LinUCBRecommender.batch_update). Copies share
+    the blocks and only copy the blocks of the rows they write. Pool slots
+    are never rewritten: an updated arm gets new slots appended to the pools
+    (shared tail blocks included, see RowBlocks.copy) and its old ones are
+    left to the snapshots still reading them. Once the stale slots outnumber
+    the live ones the pools are compacted; slots adopted from a checkpoint
+    (`from_arrays`) stay where they are, so its memory map is never read
+    into memory as a whole. Copies keep the row layout, `version` and
+    `lineage`, so caches keyed by row/version stay valid across snapshots.
+    """
+
+    def __init__(
+        self,
+        d: int,
+        capacity: int = 0,
+        max_rank: int = 0,
+        dtype="float64",
+        packed: bool = False,
+        check_every: int = 0,
+    ) -> None:
+        """
+        Args:
+            d: Dimension of the context feature vector.
+            capacity: Number of rows to preallocate.
+            max_rank: Number of updates an arm keeps in low-rank form
+                      (0 stores every arm densely).
+            dtype: Storage dtype of the matrix pools (float64 or float32).
+            packed: Stores the dense A_inv as its upper triangle.
+            check_every: Updates of a dense arm between accuracy checks of a
+                         reduced-precision A_inv (0 disables them).
+        """
+        self.d = d
+        self.max_rank = max(int(max_rank), 0)
+        self.dtype = np.dtype(dtype)
+        self.packed = bool(packed)
+        # float64 inverses do not drift in practice: no reference A needed
+        self.check_every = int(check_every) if self.dtype != np.float64 else 0
+        self._iu = np.triu_indices(d)
+        # x^T A_inv x over the upper triangle counts off-diagonal terms twice
+        self._quad_weights = np.where(self._iu[0] == self._iu[1], 1.0, 2.0)
+        self.n = 0  # number of rows in use
+        self.lineage = next(_lineages)  # same for every copy of this store
+        self.wal_seq = 0  # last feedback-log record applied (see wal.py)
+        self.index: Dict[int, int] = {}  # arm_id -> row
+        self.dirty: Set[int] = set()  # arm_ids updated since the last checkpoint
+
+        capacity = max(int(capacity), 1)
+        self.arm_ids = RowBlocks((capacity,), np.int64)  # row -> arm_id
+        self.b = RowBlocks((capacity, d), np.float64)
+        self.theta = RowBlocks((capacity, d), np.float64)  # cached A_inv @ b
+        self.version = RowBlocks((capacity,), np.int64)  # bumped on every change
+        # score bounds: ||theta|| and the largest eigenvalue of A_inv
+        self.theta_norm = RowBlocks((capacity,), np.float64)
+        self.lam_max = RowBlocks((capacity,), np.float64, fill=1.0)
+        self.rank = RowBlocks((capacity,), np.int64, fill=-1)
+        self.slot = RowBlocks((capacity,), np.int64)
+        # updates of each dense arm since its last accuracy check
+        self._since_check: Optional[RowBlocks] = None
+        if self.check_every:
+            self._since_check = RowBlocks((capacity,), np.int64)
+
+        # dense pool (A only with accuracy checks)
+        self.A_inv = RowBlocks((1,) + self._dense_shape, self.dtype)
+        self.A: Optional[RowBlocks] = None
+        if self.check_every:
+            self.A = RowBlocks((1,) + self._dense_shape, self.dtype)
+        self.n_dense = 0
+
+        # low-rank pool
+        r = self.max_rank
+        self.U = RowBlocks((1, r, d), self.dtype)
+        self.M = RowBlocks((1, r, r), self.dtype)
+        self.n_lowrank = 0
+
+        # slots adopted from a bundle (kept by `_compact`) and stale slots past them
+        self._base_dense = self._base_lowrank = 0
+        self._stale_dense = self._stale_lowrank = 0
+
+    @classmethod
+    def from_arrays(
+        cls,
+        d: int,
+        arrays: Mapping[str, np.ndarray],
+        dtype=None,
+        packed: Optional[bool] = None,
+        check_every: int = 0,
+    ) -> "ArmStore":
+        """
+        Adopts an exported bundle (e.g. memory-mapped from a checkpoint) as
+        the store rows and pools, without copying it.
+
+        Bundles without low-rank factors (older checkpoints) are all dense.
+        The pools keep the bundle's dtype/packing unless `dtype` or `packed`
+        ask for another format, in which case they are converted (copied).
+        """
+        arm_ids = arrays["arm_ids"]
+        n = int(arm_ids.shape[0])
+        U = arrays.get("U")
+        A_inv = arrays["A_inv"]
+
+        store = cls(
+            d,
+            max_rank=int(U.shape[1]) if U is not None else 0,
+            dtype=A_inv.dtype if dtype is None else dtype,
+            packed=A_inv.ndim == 2 if packed is None else packed,
+            check_every=check_every,
+        )
+        store.arm_ids = RowBlocks.wrap(arm_ids)
+        store.b = RowBlocks.wrap(arrays["b"])
+        store.A_inv = RowBlocks.wrap(store._as_dense_pool(A_inv))
+        store.n_dense = store._base_dense = int(A_inv.shape[0])
+        if store.check_every:
+            if "A" in arrays:
+                store.A = RowBlocks.wrap(store._as_dense_pool(arrays["A"]))
+            else:
+                store.A = RowBlocks.wrap(
+                    store._as_dense_pool(
+                        np.linalg.inv(store._read_dense(store.A_inv, np.arange(store.n_dense)))
+                    )
+                )
+            store._since_check = RowBlocks((n,), np.int64)
+        if U is not None:
+            store.U = RowBlocks.wrap(U.astype(store.dtype, copy=False))
+            store.M = RowBlocks.wrap(arrays["M"].astype(store.dtype, copy=False))
+            store.n_lowrank = store._base_lowrank = int(U.shape[0])
+            store.rank = RowBlocks.wrap(arrays["rank"])
+            store.slot = RowBlocks.wrap(arrays["slot"])
+        else:
+            store.rank = RowBlocks((n,), np.int64, fill=-1)
+            store.slot = RowBlocks((n,), np.int64)
+            store.slot[:n] = np.arange(n)
+
+        store.n = n
+        store.index = {int(a): row for row, a in enumerate(arm_ids.tolist())}
+        store.theta = RowBlocks((n, d), np.float64)
+        store.version = RowBlocks((n,), np.int64)
+        store.theta_norm = RowBlocks((n,), np.float64)
+        store.lam_max = RowBlocks((n,), np.float64, fill=1.0)
+        # like __init__, keep at least one row: lookups of cold arms (row -1)
+        # gather a row before masking it out
+        store.reserve(1)
+        store.refresh_theta()
+        return store
+
+    def copy(self) -> "ArmStore":
+        """
+        Returns a writable copy of the store that shares the blocks of its
+        arrays until they are written (memory-mapped ones included), so a
+        copy costs O(blocks). Rows, versions and lineage are kept.
+        """
+        new = copy.copy(self)
+        for name, used in self._arrays():
+            setattr(new, name, getattr(self, name).copy(used))
+        new.dirty = set(self.dirty)
+        return new
+
+    def _arrays(self) -> Iterator[Tuple[str, int]]:
+        """Yields (name, rows in use) for every array of the store."""
+        for name in ROW_ARRAYS:
+            if getattr(self, name) is not None:
+                yield name, self.n
+        for name in ("A_inv", "A"):
+            if getattr(self, name) is not None:
+                yield name, self.n_dense
+        yield "U", self.n_lowrank
+        yield "M", self.n_lowrank
+
+    @property
+    def _dense_shape(self) -> tuple:
+        """Shape of one entry of the dense pool."""
+        return (self._iu[0].shape[0],) if self.packed else (self.d, self.d)
+
+    @property
+    def capacity(self) -> int:
+        return self.arm_ids.shape[0]
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __contains__(self, arm_id) -> bool:
+        return arm_id in self.index
+
+    def row(self, arm_id: int) -> int:
+        """Returns the row of an arm, or -1 if it has no parameters yet."""
+        return self.index.get(arm_id, -1)
+
+    def rows(self, arm_ids: Iterable[int]) -> np.ndarray:
+        """Vectorized version of `row`: -1 marks arms without parameters."""
+        index = self.index
+        arm_ids = list(arm_ids)
+        return np.fromiter(
+            (index.get(int(a), -1) for a in arm_ids), dtype=np.int64, count=len(arm_ids)
+        )
+
+    def reserve(self, capacity: int) -> None:
+        """
+        Ensures room for at least `capacity` rows, adding whole blocks.
+        """
+        for name in ROW_ARRAYS:
+            if getattr(self, name) is not None:
+                getattr(self, name).reserve(capacity)
+
+    def add(self, arm_id: int) -> int:
+        """
+        Returns the row of an arm, creating it with A_inv = I and b = 0
+        if the arm was never seen before.
+        """
+        return int(self.add_many([arm_id])[0])
+
+    def add_many(self, arm_ids: Iterable[int]) -> np.ndarray:
+        """
+        Vectorized version of `add`: returns the rows of all given arms,
+        creating the missing ones in a single block.
+        """
+        arm_ids = [int(a) for a in arm_ids]
+        missing = list(dict.fromkeys(a for a in arm_ids if a not in self.index))
+
+        if missing:
+            k = len(missing)
+            self.reserve(self.n + k)
+            start, end = self.n, self.n + k
+            # the index is shared with the other snapshots: replace it
+            self.index = {**self.index, **{a: start + i for i, a in enumerate(missing)}}
+            self.arm_ids[start:end] = missing
+            self.b[start:end] = 0.0
+            self.theta[start:end] = 0.0
+            self.theta_norm[start:end] = 0.0
+            self.lam_max[start:end] = 1.0
+            self.n = end
+
+            # A_inv = I: a low-rank arm without factors, or a dense identity
+            new_rows = np.arange(start, end)
+            if self.max_rank > 0:
+                self._set_lowrank(new_rows, np.zeros((k, self.max_rank, self.d)))
+            else:
+                self._set_dense(new_rows, np.eye(self.d))
+
+        return np.fromiter(
+            (self.index[a] for a in arm_ids), dtype=np.int64, count=len(arm_ids)
+        )
+
+    # ==================== Pools ====================
+
+    def _alloc(self, lowrank: bool, count: int) -> np.ndarray:
+        """Appends `count` new slots to the low-rank or dense pool."""
+        if lowrank:
+            used = self.n_lowrank
+            self.U.reserve(used + count)
+            self.M.reserve(used + count)
+            self.n_lowrank += count
+        else:
+            used = self.n_dense
+            self.A_inv.reserve(used + count)
+            if self.check_every:
+                self.A.reserve(used + count)
+            self.n_dense += count
+        return np.arange(used, used + count, dtype=np.int64)
+
+    def _release(self, rows: np.ndarray) -> None:
+        """
+        Marks the pool slots of `rows` as stale. They are not reused (other
+        snapshots may still read them) until `_compact` drops them.
+        """
+        lowrank = self.rank[rows] >= 0
+        slots = self.slot[rows]
+        self._stale_lowrank += int((slots[lowrank] >= self._base_lowrank).sum())
+        self._stale_dense += int((slots[~lowrank] >= self._base_dense).sum())
+
+    def _compact(self) -> None:
+        """
+        Moves the live slots past the adopted ones to the front of a new
+        pool once the stale slots outnumber them (amortized O(1) per update).
+        """
+        for lowrank, names in ((False, ("A_inv", "A")), (True, ("U", "M"))):
+            base = self._base_lowrank if lowrank else self._base_dense
+            used = self.n_lowrank if lowrank else self.n_dense
+            stale = self._stale_lowrank if lowrank else self._stale_dense
+            if stale <= max(used - base - stale, BLOCK_ROWS):
+                continue
+
+            rows = np.arange(self.n)
+            slots = self.slot[rows]
+            live = ((self.rank[rows] >= 0) == lowrank) & (slots >= base)
+            rows, slots = rows[live], slots[live]
+            new_slots = np.arange(base, base + rows.shape[0], dtype=np.int64)
+            for name in names:
+                pool = getattr(self, name)
+                if pool is None:
+                    continue
+                new = pool.truncated(base)
+                new.reserve(base + rows.shape[0])
+                new[new_slots] = pool[slots]
+                setattr(self, name, new)
+            self.slot[rows] = new_slots
+
+            if lowrank:
+                self.n_lowrank, self._stale_lowrank = base + rows.shape[0], 0
+            else:
+                self.n_dense, self._stale_dense = base + rows.shape[0], 0
+
+    def _read_dense(self, pool, slots: np.ndarray) -> np.ndarray:
+        """Returns entries of a dense pool as full float64 (n, d, d) matrices."""
+        stored = pool[slots].astype(np.float64)
+        if not self.packed:
+            return stored
+        full = np.empty((slots.shape[0], self.d, self.d))
+        full[:, self._iu[0], self._iu[1]] = stored
+        full[:, self._iu[1], self._iu[0]] = stored
+        return full
+
+    def _write_dense(self, pool, slots: np.ndarray, full: np.ndarray) -> None:
+        """Stores full (n, d, d) matrices into a dense pool (cast/packed)."""
+        pool[slots] = full[:, self._iu[0], self._iu[1]] if self.packed else full
+
+    def _as_dense_pool(self, arr: np.ndarray) -> np.ndarray:
+        """Converts a bundle's dense matrices (full or packed) to the pool format."""
+        if arr.dtype == self.dtype and (arr.ndim == 2) == self.packed:
+            return arr
+        if arr.ndim == 2:
+            full = np.empty((arr.shape[0], self.d, self.d))
+            full[:, self._iu[0], self._iu[1]] = arr
+            full[:, self._iu[1], self._iu[0]] = arr
+        else:
+            full = arr
+        pool = np.empty((arr.shape[0],) + self._dense_shape, dtype=self.dtype)
+        self._write_dense(pool, np.arange(arr.shape[0]), full)
+        return pool
+
+    def _set_dense(
+        self, rows: np.ndarray, A_inv: np.ndarray, A: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Stores `rows` as dense arms with the given A_inv (n, d, d).
+        With accuracy checks, A defaults to inv(A_inv).
+        """
+        self._move_dense(rows, A_inv, A)
+        if self.check_every:
+            self._since_check[rows] = 0
+        self.rank[rows] = -1
+
+    def _move_dense(
+        self, rows: np.ndarray, A_inv: np.ndarray, A: Optional[np.ndarray] = None
+    ) -> None:
+        """Writes a new A_inv (and A) of `rows` to new dense slots."""
+        slots = self._alloc(False, rows.shape[0])
+        A_inv = np.broadcast_to(A_inv, (rows.shape[0], self.d, self.d))
+        self._write_dense(self.A_inv, slots, A_inv)
+        if self.check_every:
+            self._write_dense(self.A, slots, np.linalg.inv(A_inv) if A is None else A)
+        self.slot[rows] = slots
+
+    def _set_lowrank(self, rows: np.ndarray, U: np.ndarray, rank=0) -> None:
+        """Stores `rows` as low-rank arms with factors U (n, max_rank, d)."""
+        slots = self._alloc(True, rows.shape[0])
+        U = np.asarray(U, dtype=np.float64)
+        self.U[slots] = U
+        self.M[slots] = np.linalg.inv(np.eye(self.max_rank) + U @ U.transpose(0, 2, 1))
+        self.rank[rows] = rank
+        self.slot[rows] = slots
+
+    def _densify(self, rows: np.ndarray) -> None:
+        """Switches low-rank arms to a dense A_inv."""
+        A_inv = self.get_A_inv(rows)
+        A = None
+        if self.check_every:
+            U = self.U[self.slot[rows]].astype(np.float64)
+            A = np.eye(self.d) + U.transpose(0, 2, 1) @ U  # exact A = I + U^T U
+        self._release(rows)
+        self._set_dense(rows, A_inv, A)
+
+    # ==================== Linear algebra ====================
+
+    def get_A_inv(self, rows: np.ndarray) -> np.ndarray:
+        """Materializes the dense A_inv (n, d, d) of the given rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((rows.shape[0], self.d, self.d))
+        lowrank = self.rank[rows] >= 0
+
+        out[~lowrank] = self._read_dense(self.A_inv, self.slot[rows[~lowrank]])
+
+        if lowrank.any():
+            slots = self.slot[rows[lowrank]]
+            U, M = self.U[slots].astype(np.float64), self.M[slots]
+            out[lowrank] = np.eye(self.d) - np.einsum("nri,nrs,nsj->nij", U, M, U)
+        return out
+
+    def mat_vec(self, rows: np.ndarray, V: np.ndarray) -> np.ndarray:
+        """Computes A_inv @ v for each row and its vector in V (n, d)."""
+        out = np.empty((rows.shape[0], self.d))
+        lowrank = self.rank[rows] >= 0
+
+        dense = ~lowrank
+        if dense.any():
+            A_inv = self._read_dense(self.A_inv, self.slot[rows[dense]])
+            out[dense] = np.einsum("nij,nj->ni", A_inv, V[dense])
+
+        if lowrank.any():
+            slots = self.slot[rows[lowrank]]
+            U, v = self.U[slots].astype(np.float64), V[lowrank]
+            MUv = np.einsum("nrs,ns->nr", self.M[slots], np.einsum("nsd,nd->ns", U, v))
+            out[lowrank] = v - np.einsum("nrd,nr->nd", U, MUv)
+        return out
+
+    def quad_form(self, rows: np.ndarray, X: np.ndarray) -> np.ndarray:
+        """Computes x^T A_inv x for each row and its context in X (n, d)."""
+        out = np.empty(rows.shape[0])
+        lowrank = self.rank[rows] >= 0
+
+        # the pools are read in slot order: one copy per block, see RowBlocks
+        dense = np.flatnonzero(~lowrank)
+        if dense.shape[0]:
+            slots = self.slot[rows[dense]]
+            order = np.argsort(slots)
+            dense, slots = dense[order], slots[order]
+            A_inv = self.A_inv[slots]
+            x = X[dense]
+            if self.packed:
+                # sum over i <= j of w_ij * A_inv[i, j] * x_i * x_j
+                xx = x[:, self._iu[0]] * x[:, self._iu[1]] * self._quad_weights
+                out[dense] = np.einsum("nk,nk->n", A_inv, xx)
+            else:
+                out[dense] = np.einsum("ni,nij,nj->n", x, A_inv, x)
+
+        lowrank = np.flatnonzero(lowrank)
+        if lowrank.shape[0]:
+            slots = self.slot[rows[lowrank]]
+            order = np.argsort(slots)
+            lowrank, slots = lowrank[order], slots[order]
+            x = X[lowrank]
+            Ux = np.einsum("nrd,nd->nr", self.U[slots].astype(np.float64), x)
+            out[lowrank] = np.einsum("nd,nd->n", x, x) - np.einsum(
+                "nr,nrs,ns->n", Ux, self.M[slots], Ux
+            )
+        return out
+
+    def refresh_theta(self, rows: Optional[np.ndarray] = None) -> None:
+        """
+        Recomputes theta = A_inv @ b for the given rows (all rows if None).
+        Must be called after A_inv or b of those rows change; it also bumps
+        their `version`, which caches derived from the arm parameters (e.g.
+        FactorizedScorer) use to detect stale entries, and the score bounds.
+        """
+        if rows is None:
+            rows = np.arange(self.n)
+        rows = np.asarray(rows, dtype=np.int64)
+        self.theta[rows] = self.mat_vec(rows, self.b[rows])
+        self.version[rows] += 1
+
+        # A >= I, so lam_max(A_inv) <= 1, with equality while an arm is
+        # low-rank (any direction orthogonal to U keeps eigenvalue 1)
+        self.theta_norm[rows] = np.linalg.norm(self.theta[rows], axis=1)
+        dense = rows[self.rank[rows] < 0]
+        self.lam_max[rows] = 1.0
+        if dense.shape[0]:
+            self.lam_max[dense] = np.linalg.eigvalsh(self.get_A_inv(dense))[:, -1]
+
+    def absorb(self, rows: np.ndarray, X: np.ndarray) -> None:
+        """
+        Adds x x^T to A for every sample, i.e. updates the inverse
+        representation of `rows[i]` with the context `X[i]`. Rows may repeat.
+
+        Low-rank arms append the contexts to U while they fit in max_rank and
+        become dense otherwise. Dense arms with a single sample get a
+        vectorized Sherman-Morrison update; dense arms with k > 1 samples get
+        one rank-k Woodbury update:
+
+            A_inv' = A_inv - A_inv X^T (I_k + X A_inv X^T)^-1 X A_inv
+        """
+        order = np.argsort(rows, kind="stable")
+        rows, X = rows[order], X[order]
+        unique_rows, starts, counts = np.unique(
+            rows, return_index=True, return_counts=True
+        )
+        group = np.repeat(np.arange(unique_rows.shape[0]), counts)
+
+        ranks = self.rank[unique_rows]
+        fits = (ranks >= 0) & (ranks + counts <= self.max_rank)
+
+        # low-rank arms that still fit: append the contexts as new factors
+        if fits.any():
+            fit_rows = unique_rows[fits]
+            U = self.U[self.slot[fit_rows]].astype(np.float64)
+            sample = fits[group]
+            pos = ranks[group] + np.arange(rows.shape[0]) - starts[group]
+            at = (np.cumsum(fits) - 1)[group]  # sample -> its arm among fit_rows
+            U[at[sample], pos[sample]] = X[sample]
+            self._release(fit_rows)
+            self._set_lowrank(fit_rows, U, ranks[fits] + counts[fits])
+
+        overflow = (ranks >= 0) & ~fits
+        if overflow.any():
+            self._densify(unique_rows[overflow])
+
+        # dense arms: rank-1 updates, vectorized across the single-sample arms
+        single = ~fits & (counts == 1)
+        if single.any():
+            single_rows = unique_rows[single]
+            slots = self.slot[single_rows]
+            x = X[starts[single]]
+            A_inv = self._read_dense(self.A_inv, slots)
+            A_x = np.einsum("nij,nj->ni", A_inv, x)
+            denominator = 1.0 + np.einsum("ni,ni->n", x, A_x)
+            A_inv -= np.einsum("ni,nj->nij", A_x, A_x) / denominator[:, None, None]
+            A = None
+            if self.check_every:
+                A = self._read_dense(self.A, slots) + np.einsum("ni,nj->nij", x, x)
+            self._release(single_rows)
+            self._move_dense(single_rows, A_inv, A)
+
+        # one rank-k Woodbury update per dense arm with several samples
+        multi = np.flatnonzero(~fits & (counts > 1))
+        if multi.shape[0]:
+            multi_rows = unique_rows[multi]
+            slots = self.slot[multi_rows]
+            A_inv = self._read_dense(self.A_inv, slots)
+            A = self._read_dense(self.A, slots) if self.check_every else None
+            for i, u in enumerate(multi.tolist()):
+                X_k = X[starts[u] : starts[u] + counts[u]]  # (k, d)
+                A_Xt = A_inv[i] @ X_k.T  # (d, k)
+                S = np.eye(X_k.shape[0]) + X_k @ A_Xt  # (k, k)
+                A_inv[i] -= A_Xt @ np.linalg.solve(S, A_Xt.T)
+                if A is not None:
+                    A[i] += X_k.T @ X_k
+            self._release(multi_rows)
+            self._move_dense(multi_rows, A_inv, A)
+
+        if self.check_every:
+            dense = ~fits
+            self._check_drift(unique_rows[dense], counts[dense])
+        self._compact()
+
+    def _check_drift(self, rows: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Counts `counts` updates on the given dense rows and, for the ones due
+        for a check, rebuilds A_inv = inv(A) where |A_inv A - I| > DRIFT_TOL.
+        Their slots were just written by `absorb`, so they are updated in place.
+        """
+        self._since_check[rows] += counts
+        due = rows[self._since_check[rows] >= self.check_every]
+        if due.shape[0] == 0:
+            return
+        self._since_check[due] = 0
+
+        slots = self.slot[due]
+        A = self._read_dense(self.A, slots)
+        residual = np.abs(self._read_dense(self.A_inv, slots) @ A - np.eye(self.d))
+        drifted = residual.max(axis=(1, 2)) > DRIFT_TOL
+        if drifted.any():
+            self._write_dense(self.A_inv, slots[drifted], np.linalg.inv(A[drifted]))
+
+    # ==================== Export / import ====================
+
+    def export(self, rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Returns the parameters of `rows` (all rows if None) as a bundle of
+        compact arrays, used by checkpoints, `from_arrays` and `put`.
+        """
+        if rows is None:
+            rows = np.arange(self.n)
+        rows = np.asarray(rows, dtype=np.int64)
+
+        rank = self.rank[rows]
+        lowrank = rank >= 0
+        slot = np.empty(rows.shape[0], dtype=np.int64)
+        slot[~lowrank] = np.arange(int((~lowrank).sum()))
+        slot[lowrank] = np.arange(int(lowrank.sum()))
+
+        lowrank_slots = self.slot[rows[lowrank]]
+        dense_slots = self.slot[rows[~lowrank]]
+        arrays = {
+            "arm_ids": self.arm_ids[rows],
+            "b": self.b[rows],
+            "rank": rank,
+            "slot": slot,
+            "A_inv": self.A_inv[dense_slots],
+            "U": self.U[lowrank_slots],
+            "M": self.M[lowrank_slots],
+        }
+        if self.check_every:
+            arrays["A"] = self.A[dense_slots]
+        return arrays
+
+    def put(self, arrays: Mapping[str, np.ndarray]) -> np.ndarray:
+        """
+        Overwrites (or creates) the arms of an exported bundle.
+        Returns their rows.
+        """
+        rows = self.add_many(arrays["arm_ids"].tolist())
+        self._release(rows)
+
+        if "rank" in arrays:
+            rank, slot = arrays["rank"], arrays["slot"]
+        else:
+            rank = np.full(rows.shape[0], -1, dtype=np.int64)
+            slot = np.arange(rows.shape[0])
+
+        lowrank = rank >= 0
+        if lowrank.any() and arrays["U"].shape[1] != self.max_rank:
+            raise ValueError("Low-rank factors do not match the store max_rank")
+
+        # bundles may come in another dtype/packing than the store pools
+        dense_slots = slot[~lowrank]
+        A_inv = self._as_dense_pool(arrays["A_inv"])
+        A = self._as_dense_pool(arrays["A"]) if "A" in arrays and self.check_every else None
+        self._set_dense(
+            rows[~lowrank],
+            self._read_dense(A_inv, dense_slots),
+            None if A is None else self._read_dense(A, dense_slots),
+        )
+        if lowrank.any():
+            self._set_lowrank(rows[lowrank], arrays["U"][slot[lowrank]], rank[lowrank])
+        self.b[rows] = arrays["b"]
+        self.refresh_theta(rows)
+        self._compact()
+        return rows
+
+    def take_dirty(self) -> List[int]:
+        """Returns and clears the arms updated since the last checkpoint."""
+        dirty, self.dirty = self.dirty, set()
+        return sorted(dirty)
+
+
+class ArmView(Mapping):
+    """
+    Read-only arm_id -> parameter mapping over an ArmStore.
+
+    Keeps the dict-like access (`arm in rec.A_inv`, `rec.b[arm]`) of the
+    original implementation without storing per-arm arrays.
+    """
+
+    def __init__(self, store: ArmStore, getter: Callable[[int], np.ndarray]) -> None:
+        self._store = store
+        self._getter = getter
+
+    def __getitem__(self, arm_id: int) -> np.ndarray:
+        row = self._store.row(arm_id)
+        if row < 0:
+            raise KeyError(arm_id)
+        return self._getter(row)
+
+    def __contains__(self, arm_id) -> bool:
+        return arm_id in self._store
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._store.index))
+
+    def __len__(self) -> int:
+        return len(self._store)
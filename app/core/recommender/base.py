@@ -64,6 +64,13 @@ class BaseRecommender:
     def save_state(self, path: str):
         raise NotImplementedError
 
+    def checkpoint(self, path: str):
+        """
+        Persists the state, incrementally when the model supports it.
+        By default, it just saves the full state.
+        """
+        self.save_state(path)
+
     def load_state(self, path: str, valid_arms: list[int], d_expected: int) -> None:
         """
         Loads the state of a file, reconciling it with the current branches.
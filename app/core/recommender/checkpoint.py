@@ -0,0 +1,296 @@
+"""
+Binary checkpoint format for the LinUCB model
+
+A checkpoint stores a bundle of named arrays (see ArmStore.export). Layout
+(little-endian):
+
+    MAGIC (8 bytes) | header length (uint32) | JSON header | padding | data
+
+The JSON header stores d, alpha, a generation counter, the sequence number of
+the last feedback-log record the model includes (`wal_seq`, see wal.py) and,
+for each array, its dtype, shape and offset relative to the data section,
+which starts right after the header. Every offset is 64-byte aligned so the arrays can be
+memory-mapped directly.
+
+Incremental checkpoints go to an append-only segment next to the base file
+(`<path>.delta`). Each record holds the full parameters of the arms updated
+since the previous save:
+
+    RECORD_MAGIC | generation | header length | payload length | crc32
+    JSON header (array specs, wal_seq) | payload (raw arrays)
+
+Records are tagged with the generation of the base they apply to, so deltas
+left behind by an interrupted compaction are ignored on replay. A record torn
+by a crash is cut off (`repair_deltas`) before anything is appended after it.
+"""
+
+import json
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
+
+import numpy as np
+
+MAGIC = b"LINUCB\x00\x01"
+VERSION = 2
+ALIGN = 64
+
+RECORD_MAGIC = b"LUC2"
+
+_LEN = struct.Struct("<I")
+_RECORD = struct.Struct("<4sIIQI")
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _layout(
+    arrays: Mapping[str, np.ndarray],
+) -> Tuple[Dict[str, Any], List[Tuple[int, np.ndarray]], int]:
+    """
+    Computes the aligned layout of a bundle.
+    Returns (array specs, [(offset, contiguous array)], total size).
+    """
+    specs: Dict[str, Any] = {}
+    chunks = []
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arr = arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+        specs[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        chunks.append((offset, arr))
+        offset = _align(offset + arr.nbytes)
+    return specs, chunks, offset
+
+
+def is_checkpoint(path: str) -> bool:
+    """Returns True if the file starts with the binary checkpoint magic."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_checkpoint(
+    path: str,
+    d: int,
+    alpha: float,
+    arrays: Mapping[str, np.ndarray],
+    generation: int = 0,
+    wal_seq: int = 0,
+) -> None:
+    """
+    Writes a checkpoint atomically (temp file + rename), so a reader that
+    memory-mapped the previous file keeps a consistent view.
+    """
+    specs, chunks, _ = _layout(arrays)
+    raw_header = json.dumps(
+        {
+            "version": VERSION,
+            "d": int(d),
+            "alpha": float(alpha),
+            "generation": int(generation),
+            "wal_seq": int(wal_seq),
+            "arrays": specs,
+        }
+    ).encode("utf-8")
+    data_start = _align(len(MAGIC) + _LEN.size + len(raw_header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_LEN.pack(len(raw_header)))
+        f.write(raw_header)
+        for offset, arr in chunks:
+            f.seek(data_start + offset)
+            f.write(arr.tobytes() if arr.size == 0 else memoryview(arr).cast("B"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    """Reads only the JSON header of a checkpoint."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a LinUCB checkpoint")
+        (length,) = _LEN.unpack(f.read(_LEN.size))
+        header = json.loads(f.read(length).decode("utf-8"))
+
+    if header.get("version") != VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {header.get('version')}")
+
+    header["data_start"] = _align(len(MAGIC) + _LEN.size + length)
+    return header
+
+
+def read_checkpoint(path: str) -> Dict[str, Any]:
+    """
+    Memory-maps a checkpoint without copying it.
+
+    Returns the header fields plus the `arrays` bundle. The arrays are
+    copy-on-write maps: the model can update them in memory while the file
+    on disk stays untouched.
+    """
+    header = read_header(path)
+    data_start = header["data_start"]
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=spec["dtype"])
+            continue
+        arrays[name] = np.memmap(
+            path,
+            dtype=spec["dtype"],
+            mode="c",
+            offset=data_start + spec["offset"],
+            shape=shape,
+        )
+
+    return {
+        "d": header["d"],
+        "alpha": header["alpha"],
+        "generation": header["generation"],
+        "wal_seq": header["wal_seq"],
+        "arrays": arrays,
+    }
+
+
+# ==================== Delta segments ====================
+
+
+def delta_path(path: str) -> str:
+    """Path of the append-only delta segment of a base checkpoint."""
+    return f"{path}.delta"
+
+
+def next_generation(path: str) -> int:
+    """Generation to use for a new base checkpoint written to `path`."""
+    if os.path.exists(path) and is_checkpoint(path):
+        return read_header(path)["generation"] + 1
+    return 0
+
+
+def remove_deltas(path: str) -> None:
+    """Drops the delta segment once a new base checkpoint is in place."""
+    try:
+        os.remove(delta_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def append_delta(
+    path: str, generation: int, arrays: Mapping[str, np.ndarray], wal_seq: int = 0
+) -> int:
+    """
+    Appends one record with the given bundle to the delta segment of `path`.
+
+    Returns the segment size after the write.
+    """
+    specs, chunks, size = _layout(arrays)
+    raw_header = json.dumps({"arrays": specs, "wal_seq": int(wal_seq)}).encode("utf-8")
+
+    payload = bytearray(size)
+    for offset, arr in chunks:
+        payload[offset : offset + arr.nbytes] = arr.tobytes()
+
+    record = _RECORD.pack(
+        RECORD_MAGIC,
+        int(generation),
+        len(raw_header),
+        size,
+        zlib.crc32(payload, zlib.crc32(raw_header)),
+    )
+
+    with open(delta_path(path), "ab") as f:
+        start = f.tell()
+        try:
+            f.write(record)
+            f.write(raw_header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        except Exception:
+            # never leave a partial record for the next append to follow
+            f.truncate(start)
+            raise
+        return f.tell()
+
+
+def _records(f) -> Iterator[Tuple[int, int, bytes, bytes]]:
+    """
+    Yields (end offset, generation, raw header, payload) of the valid records
+    of an open segment, stopping at the first torn or corrupt one. Lengths
+    are checked against the bytes left before anything is read.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    f.seek(0)
+    while True:
+        raw = f.read(_RECORD.size)
+        if len(raw) < _RECORD.size:
+            return
+        magic, gen, header_len, size, crc = _RECORD.unpack(raw)
+        if magic != RECORD_MAGIC or header_len + size > file_size - f.tell():
+            return
+
+        raw_header = f.read(header_len)
+        payload = f.read(size)
+        if zlib.crc32(payload, zlib.crc32(raw_header)) != crc:
+            return
+        yield f.tell(), gen, raw_header, payload
+
+
+def repair_deltas(path: str) -> int:
+    """
+    Cuts the delta segment of `path` back to the end of its last valid
+    record (a write interrupted by a crash leaves a torn tail), so later
+    appends stay readable. Returns the number of bytes dropped.
+    """
+    seg_path = delta_path(path)
+    if not os.path.exists(seg_path):
+        return 0
+
+    with open(seg_path, "r+b") as f:
+        end = 0
+        for end, _, _, _ in _records(f):
+            pass
+        f.seek(0, os.SEEK_END)
+        dropped = f.tell() - end
+        if dropped:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+    return dropped
+
+
+def read_deltas(
+    path: str, generation: int
+) -> Iterator[Tuple[Dict[str, np.ndarray], int]]:
+    """
+    Yields (bundle, wal_seq) for each delta record of `generation`, in write
+    order. Reading stops at the first torn or corrupt record (e.g. a write
+    interrupted by a crash).
+    """
+    seg_path = delta_path(path)
+    if not os.path.exists(seg_path):
+        return
+
+    with open(seg_path, "rb") as f:
+        for _, gen, raw_header, payload in _records(f):
+            if gen != generation:
+                continue
+
+            header = json.loads(raw_header.decode("utf-8"))
+            arrays = {
+                name: np.frombuffer(
+                    payload,
+                    dtype=spec["dtype"],
+                    count=int(np.prod(spec["shape"], dtype=np.int64)),
+                    offset=spec["offset"],
+                ).reshape(spec["shape"])
+                for name, spec in header["arrays"].items()
+            }
+            yield arrays, int(header["wal_seq"])
@@ -0,0 +1,334 @@
+"""
+Factorized LinUCB scoring over the whole catalog
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence
+import copy
+import threading
+import numpy as np
+
+from .arm_store import RowBlocks
+from .linucb import LinUCBRecommender, _top_k
+
+
+class _Cache:
+    """
+    One version of the FactorizedScorer cache. Published versions are never
+    modified: writers `copy` one (which shares its blocks, see RowBlocks),
+    update the copy and swap it in (see FactorizedScorer).
+    """
+
+    # per-entry arrays, row i for arm_ids[i]
+    ARRAYS = (
+        "arm_ids", "items", "A_yy", "A_ys_s", "s_A_s", "theta_y", "theta_s", "row", "version",
+        "store_row",
+    )
+
+    def __init__(self, p: int, n_static: int) -> None:
+        self.n = 0  # entries in use
+        self.index: Dict[int, int] = {}  # arm_id -> cache row
+        self.arm_ids = RowBlocks((0,), np.int64)
+        self.items = RowBlocks((0, n_static), np.float64)  # static part s
+
+        # per-arm cached terms
+        self.A_yy = RowBlocks((0, p, p), np.float64)
+        self.A_ys_s = RowBlocks((0, p), np.float64)
+        self.s_A_s = RowBlocks((0,), np.float64)
+        self.theta_y = RowBlocks((0, p), np.float64)
+        self.theta_s = RowBlocks((0,), np.float64)
+
+        # store row / version each entry was computed from (-2: never)
+        self.row = RowBlocks((0,), np.int64, fill=-2)
+        self.version = RowBlocks((0,), np.int64)
+
+        # current store row of each entry's arm (-1: implicit arm), mapped
+        # from the first `store_n` rows of the stores of `lineage`
+        self.store_row = RowBlocks((0,), np.int64, fill=-1)
+        self.store_n = 0
+        self.lineage = None
+
+    def copy(self) -> "_Cache":
+        """Returns a writable copy sharing the blocks of every array."""
+        new = copy.copy(self)
+        for name in self.ARRAYS:
+            setattr(new, name, getattr(self, name).copy(self.n))
+        return new
+
+    def rows(self, arm_ids: Iterable[int]) -> np.ndarray:
+        index = self.index
+        arm_ids = list(arm_ids)
+        return np.fromiter((index[int(a)] for a in arm_ids), dtype=np.int64, count=len(arm_ids))
+
+
+class FactorizedScorer:
+    """
+    Scores every arm for one user by splitting the context into the columns
+    that depend on the user ("dynamic": user features, genre_match) and the
+    static item columns.
+
+    With x = [y | s] (y dynamic, s static) the UCB terms of an arm become
+
+        theta^T x     = theta_y^T y + (theta_s^T s)
+        x^T A_inv x   = y^T A_yy y + 2 y^T (A_ys s) + (s^T A_ss s)
+
+    so each arm only needs a few cached numbers: A_yy (p, p), A_ys s (p,),
+    s^T A_ss s, theta_y (p,) and theta_s^T s, with p = len(dynamic_cols).
+    Scoring n arms then costs O(n * p^2) instead of O(n * d^2).
+
+    Cache rows follow the order of `set_items` (new arms are appended), so
+    after `init_runtime` an arm's cache row is its ARM_INDEX entry and the
+    slate path passes rows (`score_rows`) instead of looking up arm ids.
+    The cache also maps each row to its arm's row in the arm store, synced
+    incrementally from the rows the store appended.
+
+    The cache is refreshed lazily: an entry is recomputed when the arm's row
+    or `ArmStore.version` changed since it was built (i.e. the arm was
+    updated), or when the recommender loaded a new store (another
+    `ArmStore.lineage`; training snapshots keep it). Like the arm store, the
+    cache is a snapshot: refreshes and `set_items` write a copy that shares
+    the untouched blocks and publish it with one attribute swap, so a
+    concurrent `score` never sees half-written entries. Writers are
+    serialized by a lock that readers only take when some entry is stale.
+    """
+
+    def __init__(self, recommender: LinUCBRecommender, dynamic_cols: Sequence[int]) -> None:
+        """
+        Args:
+            recommender: LinUCB model whose arm store is scored.
+            dynamic_cols: Context columns that depend on the user.
+        """
+        d = recommender.d
+        self.recommender = recommender
+        self.dynamic_cols = np.asarray(dynamic_cols, dtype=np.int64)
+        self.static_cols = np.setdiff1d(np.arange(d), self.dynamic_cols)
+        self._cache = _Cache(self.dynamic_cols.shape[0], self.static_cols.shape[0])
+        self._lock = threading.Lock()
+
+    def __contains__(self, arm_id) -> bool:
+        return arm_id in self._cache.index
+
+    def __len__(self) -> int:
+        return self._cache.n
+
+    def missing(self, arm_ids: Iterable[int]) -> List[int]:
+        """Returns the arms whose item features were not given yet."""
+        index = self._cache.index
+        return [int(a) for a in arm_ids if int(a) not in index]
+
+    def rows(self, arm_ids: Iterable[int]) -> np.ndarray:
+        """Cache rows of arms (KeyError for arms without item features)."""
+        return self._cache.rows(arm_ids)
+
+    def set_items(self, arm_ids: Sequence[int], item_contexts: np.ndarray) -> None:
+        """
+        Registers (or replaces) the item features of arms.
+
+        Args:
+            arm_ids: Arms (BookIDs); new ones get the next cache rows, in order.
+            item_contexts: Full contexts (n, d) of those arms; only the static
+                           columns are kept, the dynamic ones may hold anything.
+        """
+        item_contexts = np.asarray(item_contexts, dtype=float).reshape(
+            len(arm_ids), self.recommender.d
+        )
+        static = item_contexts[:, self.static_cols]
+
+        with self._lock:
+            cache = self._cache.copy()
+            new = [a for a in dict.fromkeys(int(a) for a in arm_ids) if a not in cache.index]
+            if new:
+                start, end = cache.n, cache.n + len(new)
+                cache.index = {**cache.index, **{a: start + i for i, a in enumerate(new)}}
+                for name in _Cache.ARRAYS:
+                    getattr(cache, name).reserve(end)
+                cache.arm_ids[start:end] = new
+                for name in ("A_yy", "A_ys_s", "s_A_s", "theta_y", "theta_s", "version"):
+                    getattr(cache, name)[start:end] = 0
+                cache.row[start:end] = -2
+                cache.store_row[start:end] = -1
+                cache.n = end
+                cache.store_n = 0  # the new arms may have store rows: remap them
+
+            idx = cache.rows(arm_ids)
+            cache.items[idx] = static
+            cache.row[idx] = -2  # item changed: recompute on next use
+            self._cache = cache
+
+    @staticmethod
+    def _sync(cache: _Cache, store) -> None:
+        """Maps the store rows appended since the (unpublished) `cache` last saw `store`."""
+        if store.lineage != cache.lineage:
+            # model reloaded: every entry is stale
+            cache.lineage = store.lineage
+            cache.row = RowBlocks((cache.n,), np.int64, fill=-2)
+            cache.store_n = 0
+        if store.n < cache.store_n:
+            cache.store_n = 0  # an older snapshot of the store
+        start = cache.store_n
+        if start == 0:
+            cache.store_row = RowBlocks((cache.n,), np.int64, fill=-1)
+
+        index = cache.index
+        cached = [
+            (index[a], row)
+            for row, a in enumerate(store.arm_ids[start : store.n].tolist(), start)
+            if a in index
+        ]
+        if cached:
+            idx, rows = zip(*cached)
+            cache.store_row[np.array(idx, dtype=np.int64)] = np.array(rows, dtype=np.int64)
+        cache.store_n = store.n
+
+    @staticmethod
+    def _stale(cache: _Cache, store, idx: np.ndarray):
+        """Rows/versions of `idx` in `store` (synced cache) and the mask of stale entries."""
+        rows = cache.store_row[idx]
+        version = np.where(rows >= 0, store.version[np.maximum(rows, 0)], 0)
+        stale = (cache.row[idx] != rows) | (cache.version[idx] != version)
+        return rows, version, stale
+
+    @classmethod
+    def _current(cls, cache: _Cache, store, idx: np.ndarray) -> bool:
+        """True if the entries `idx` of `cache` are up to date with `store`."""
+        if cache.lineage != store.lineage or cache.store_n != store.n:
+            return False
+        return not cls._stale(cache, store, idx)[2].any()
+
+    def _refresh(self, idx: np.ndarray) -> _Cache:
+        """
+        Returns a cache version whose entries `idx` are current, publishing
+        a refreshed one if some of them were stale.
+        """
+        store = self.recommender.store  # one snapshot for the refresh
+        cache = self._cache
+        if self._current(cache, store, idx):
+            return cache
+
+        with self._lock:
+            cache = self._cache  # may have been refreshed meanwhile
+            if self._current(cache, store, idx):
+                return cache
+            cache = cache.copy()
+            self._sync(cache, store)
+            rows, version, stale = self._stale(cache, store, idx)
+            if stale.any():
+                self._recompute(cache, store, idx[stale], rows[stale], version[stale])
+            self._cache = cache
+        return cache
+
+    def _recompute(
+        self, cache: _Cache, store, idx: np.ndarray, rows: np.ndarray, version: np.ndarray
+    ) -> None:
+        """
+        Fills the cached terms of entries `idx` of the (unpublished) `cache`
+        from `store` rows `rows`; only the blocks of those entries are copied.
+        """
+        idx, first = np.unique(idx, return_index=True)
+        rows, version = rows[first], version[first]
+        s = cache.items[idx]
+        Y, S = self.dynamic_cols, self.static_cols
+
+        # cold arms: A_inv = I, theta = 0
+        n, p = idx.shape[0], Y.shape[0]
+        A_yy = np.broadcast_to(np.eye(p), (n, p, p)).copy()
+        A_ys_s = np.zeros((n, p))
+        s_A_s = np.einsum("ni,ni->n", s, s)
+        theta_y = np.zeros((n, p))
+        theta_s = np.zeros(n)
+
+        warm = rows >= 0
+        if warm.any():
+            s_w = s[warm]
+            A_inv = store.get_A_inv(rows[warm])
+            theta = store.theta[rows[warm]]
+            A_yy[warm] = A_inv[:, Y][:, :, Y]
+            A_ys_s[warm] = np.einsum("nij,nj->ni", A_inv[:, Y][:, :, S], s_w)
+            s_A_s[warm] = np.einsum("ni,nij,nj->n", s_w, A_inv[:, S][:, :, S], s_w)
+            theta_y[warm] = theta[:, Y]
+            theta_s[warm] = np.einsum("ni,ni->n", theta[:, S], s_w)
+
+        cache.A_yy[idx] = A_yy
+        cache.A_ys_s[idx] = A_ys_s
+        cache.s_A_s[idx] = s_A_s
+        cache.theta_y[idx] = theta_y
+        cache.theta_s[idx] = theta_s
+        cache.row[idx] = rows
+        cache.version[idx] = version
+
+    def score(
+        self,
+        arm_ids: Sequence[int],
+        user_features: np.ndarray,
+        dynamic_item: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Computes the UCB score of every given arm for one user.
+
+        Args:
+            arm_ids: Arms to score (their item features must be set).
+            user_features: Dynamic columns shared by all arms (e.g. the user
+                           features), filled in order from the first one.
+            dynamic_item: Remaining dynamic columns per arm (n, p - len(user_features)),
+                          e.g. genre_match; zeros if None.
+
+        Returns:
+            Scores (n,), equal to LinUCBRecommender.recommend's.
+        """
+        return self.score_rows(self.rows(arm_ids), user_features, dynamic_item)
+
+    def score_rows(
+        self,
+        idx: np.ndarray,
+        user_features: np.ndarray,
+        dynamic_item: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """`score` for arms given by cache row (see `rows`), without id lookups."""
+        idx = np.asarray(idx, dtype=np.int64)
+        cache = self._refresh(idx)  # every read below uses this version
+
+        n, p = idx.shape[0], self.dynamic_cols.shape[0]
+        y = np.zeros((n, p))
+        u = np.asarray(user_features, dtype=float).reshape(-1)
+        y[:, : u.shape[0]] = u
+        if dynamic_item is not None:
+            y[:, u.shape[0] :] = np.asarray(dynamic_item, dtype=float).reshape(n, -1)
+
+        mean = np.einsum("ni,ni->n", cache.theta_y[idx], y) + cache.theta_s[idx]
+        var = (
+            np.einsum("ni,nij,nj->n", y, cache.A_yy[idx], y)
+            + 2.0 * np.einsum("ni,ni->n", y, cache.A_ys_s[idx])
+            + cache.s_A_s[idx]
+        )
+        return mean + self.recommender.alpha * np.sqrt(np.maximum(var, 0.0))
+
+    def recommend(
+        self,
+        arm_ids: Sequence[int],
+        user_features: np.ndarray,
+        n_recommendations: int,
+        dynamic_item: Optional[np.ndarray] = None,
+    ) -> List[int]:
+        """Returns the top-n arms by UCB score (see `score`)."""
+        if len(arm_ids) == 0:
+            return []
+        scores = self.score(arm_ids, user_features, dynamic_item)
+        top = _top_k(scores, min(n_recommendations, len(arm_ids)))
+        return [int(arm_ids[i]) for i in top]
+
+    def recommend_rows(
+        self,
+        idx: np.ndarray,
+        user_features: np.ndarray,
+        n_recommendations: int,
+        dynamic_item: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """`recommend` for arms given by cache row: returns the cache rows of the top-n."""
+        idx = np.asarray(idx, dtype=np.int64)
+        if idx.shape[0] == 0:
+            return idx
+        scores = self.score_rows(idx, user_features, dynamic_item)
+        return idx[_top_k(scores, min(n_recommendations, idx.shape[0]))]
+
+    def arm_ids(self, idx: np.ndarray) -> List[int]:
+        """Arms of cache rows."""
+        return self._cache.arm_ids[np.asarray(idx, dtype=np.int64)].tolist()
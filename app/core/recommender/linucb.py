@@ -4,9 +4,28 @@ Contextual Bandit Logic (LinUCB)
 
 import numpy as np
 from .base import BaseRecommender
-from typing import Dict, List
+from .arm_store import ArmStore, ArmView
+from . import checkpoint
+from app.utils.config import RECOMMENDER_CONFIG
+from typing import List, Mapping, Optional
 import json
 import os
+import threading
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores, sorted in descending order.
+
+    Uses argpartition so only the selected k entries are fully sorted.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    if k < scores.shape[0]:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(scores.shape[0])
+    return top[np.argsort(-scores[top], kind="stable")]
 
 
 class LinUCBRecommender(BaseRecommender):
@@ -15,9 +34,16 @@ class LinUCBRecommender(BaseRecommender):
 
     This recommender maintains separate ridge regression estimates for each arm
     to calculate an upper confidence bound for the expected reward.
+
+    Concurrency: `store` is an immutable snapshot. Updates are applied to a
+    copy under a writer lock and published by rebinding `store` (an atomic
+    swap), so readers (recommend, checkpoints) only read the attribute once
+    and never lock or see a half-applied batch.
     """
 
-    def __init__(self, n_arms: int, d: int, alpha: float = 1.0) -> None:
+    def __init__(
+        self, n_arms: int, d: int, alpha: float = 1.0, max_rank: Optional[int] = None
+    ) -> None:
         """
         Initializes the LinUCB recommender with identity matrices.
 
@@ -26,107 +52,243 @@ class LinUCBRecommender(BaseRecommender):
             d: Dimension of the context feature vector.
             alpha: Exploration parameter. Higher values increase the confidence bound width,
                    encouraging more exploration of uncertain arms.
+            max_rank: Number of updates an arm keeps in low-rank form before
+                      switching to a dense A_inv (defaults to
+                      RECOMMENDER_CONFIG["low_rank_max_rank"]). Capped at d // 2,
+                      past which the factors are no smaller than A_inv itself.
         """
         self.d = d  # dimension
         self.alpha = alpha  # exploration factor
 
-        # Key: BookID (int), Value: Matrix/Vector
-        self.A_inv: Dict[int, np.ndarray] = {}  # Inverse of context covariance
-        self.b: Dict[int, np.ndarray] = {}  # context-reward relationship
-
-    def _init_arm(self, arm_id: int) -> None:
-        """
-        Lazy initialization: if we haven't seen this book ID before,
-        create its A_inv and b matrices.
-        """
-        if arm_id not in self.A_inv:
-            # Initialize A_inv as Identity (since A=I, A^-1=I)
-            self.A_inv[arm_id] = np.eye(self.d)
-            self.b[arm_id] = np.zeros((self.d, 1))
+        if max_rank is None:
+            max_rank = RECOMMENDER_CONFIG.get("low_rank_max_rank", 0)
+        self.max_rank = min(int(max_rank), d // 2)
+
+        # storage precision of the arm matrices (see ArmStore)
+        self.state_dtype = RECOMMENDER_CONFIG.get("state_dtype", "float64")
+        self.state_packed = bool(RECOMMENDER_CONFIG.get("state_packed", False))
+        self.precision_check_every = int(RECOMMENDER_CONFIG.get("precision_check_every", 0))
+
+        # Rows addressed by BookID (int): A_inv (inverse of context covariance)
+        # and b (context-reward relationship)
+        self.store = self.new_store(n_arms)
+        self._write_lock = threading.Lock()  # serializes writers only
+
+    def new_store(self, capacity: int) -> ArmStore:
+        """Creates an empty arm store with the configured rank and precision."""
+        return ArmStore(
+            self.d,
+            capacity=capacity,
+            max_rank=min(self.max_rank, self.d // 2),
+            dtype=self.state_dtype,
+            packed=self.state_packed,
+            check_every=self.precision_check_every,
+        )
+
+    def _adopt_store(self, arrays: Mapping[str, np.ndarray]) -> ArmStore:
+        """Adopts an exported bundle, converting it to the configured precision."""
+        return ArmStore.from_arrays(
+            self.d,
+            arrays,
+            dtype=self.state_dtype,
+            packed=self.state_packed,
+            check_every=self.precision_check_every,
+        )
+
+    @property
+    def A_inv(self) -> Mapping[int, np.ndarray]:
+        """Read-only BookID -> A_inv (d, d) view over the arm store."""
+        store = self.store
+        return ArmView(store, lambda row: store.get_A_inv([row])[0])
+
+    @property
+    def b(self) -> Mapping[int, np.ndarray]:
+        """Read-only BookID -> b (d, 1) view over the arm store."""
+        store = self.store
+        return ArmView(store, lambda row: store.b[row].reshape(-1, 1))
 
     def recommend(
-        self, candidate_arms: List[int], contexts: np.ndarray, n_recommendations: int
+        self,
+        candidate_arms: List[int],
+        contexts: np.ndarray,
+        n_recommendations: int,
+        pruned: Optional[bool] = None,
     ) -> List[int]:
         """
         Selects the top-k arms based on their Upper Confidence Bound scores.
 
+        Cold arms (no feedback yet) have theta = 0 and A_inv = I, so their
+        score is alpha * ||x|| and is computed for all of them at once.
+
         Args:
             candidate_arms: List of arm indices that are eligible for recommendation.
             contexts: A numpy array of context vectors corresponding to the candidate_arms.
                       Expected shape: (len(candidate_arms), d).
             n_recommendations: The maximum number of items to return.
+            pruned: Uses branch-and-bound top-k (see `_top_k_pruned`); defaults
+                    to RECOMMENDER_CONFIG["topk_pruning"]. Same result, fewer
+                    exact scores on large candidate sets. The slate endpoint
+                    does not come through here (see FactorizedScorer).
 
         Returns:
             A list of selected arm indices, sorted by their estimated UCB score (descending).
         """
-        scores = []
+        if len(candidate_arms) == 0:
+            return []
+
+        store = self.store  # one snapshot for the whole call
+        rows = store.rows(candidate_arms)
 
-        for arm, x in zip(candidate_arms, contexts):
-            self._init_arm(arm)
-            x = x.reshape(-1, 1)
+        X = np.asarray(contexts, dtype=float).reshape(len(candidate_arms), self.d)
 
-            A_inv = self.A_inv[arm]
+        if pruned is None:
+            pruned = RECOMMENDER_CONFIG.get("topk_pruning", False)
 
-            theta = A_inv @ self.b[arm]  # Coefficient estimates
+        # Map back to Book IDs
+        K = min(n_recommendations, len(candidate_arms))
+        if pruned:
+            ranked_indices = self._top_k_pruned(store, rows, X, K)
+        else:
+            ranked_indices = _top_k(self._scores(store, rows, X), K)
+        chosen_arms = [candidate_arms[i] for i in ranked_indices]
+
+        return chosen_arms
+
+    def _scores(self, store: ArmStore, rows: np.ndarray, X: np.ndarray) -> np.ndarray:
+        """UCB scores of the arms at `rows` (-1: cold) of `store` for the contexts X."""
+        # Cold arms: closed-form score
+        scores = self.alpha * np.linalg.norm(X, axis=1)
+
+        warm = np.flatnonzero(rows >= 0)
+        if warm.shape[0]:
+            X_w = X[warm]
+
+            # Gather the warm candidates' parameters into stacked arrays
+            theta = store.theta[rows[warm]]  # Coefficient estimates (cached)
 
             # UCB Score Calculation
-            mean = theta.T @ x  # Mean prediction (exploitation)
+            mean = np.einsum("ni,ni->n", theta, X_w)  # Mean prediction (exploitation)
 
-            # Variance calculation (exploration term)
-            var = np.sqrt(x.T @ A_inv @ x)
+            # Variance calculation (exploration term), on dense or low-rank A_inv
+            var = store.quad_form(rows[warm], X_w)
+            scores[warm] = mean + self.alpha * np.sqrt(np.maximum(var, 0.0))
+        return scores
 
-            p = (mean + self.alpha * var).item()
-            scores.append(p)
+    def _top_k_pruned(
+        self, store: ArmStore, rows: np.ndarray, X: np.ndarray, k: int
+    ) -> np.ndarray:
+        """
+        Exact top-k by branch and bound.
 
-        scores = np.array(scores)
-        ranked_indices = scores.argsort()[::-1]
+        Every arm's score is bounded by Cauchy-Schwarz and the spectral norm:
 
-        # Map back to Book IDs
-        K = min(n_recommendations, len(candidate_arms))
-        chosen_arms = [candidate_arms[i] for i in ranked_indices[:K]]
+            theta^T x + alpha sqrt(x^T A_inv x)
+                <= ||x|| (||theta|| + alpha sqrt(lam_max(A_inv)))
 
-        return chosen_arms
+        Arms are scored in chunks by decreasing bound, stopping once the k-th
+        best exact score reaches the bound of the next unscored arm.
+        """
+        n = rows.shape[0]
+        if k <= 0:
+            return np.empty(0, dtype=int)
+
+        warm = rows >= 0
+        norms = np.linalg.norm(X, axis=1)
+        theta_norm = np.where(warm, store.theta_norm[rows], 0.0)
+        lam_max = np.where(warm, store.lam_max[rows], 1.0)
+        bound = norms * (theta_norm + self.alpha * np.sqrt(lam_max))
+        bound *= 1.0 + 1e-9  # slack for rounding (cold arms: bound == score)
+
+        order = np.argsort(-bound, kind="stable")
+        scores = np.full(n, -np.inf)
+        chunk = max(k, 64)
+        pos = 0
+        while pos < n:
+            batch = order[pos : pos + chunk]
+            scores[batch] = self._scores(store, rows[batch], X[batch])
+            pos += batch.shape[0]
+            if pos >= n or pos < k:
+                continue
+            kth = np.partition(scores[order[:pos]], pos - k)[pos - k]
+            if kth >= bound[order[pos]]:
+                break
+
+        return _top_k(scores, k)
 
     def update(self, context, arm, reward) -> None:
         """
         Updates the model parameters for a specific arm using the observed feedback.
 
         This performs an online update of the inverse covariance matrix A_inv
-        using the Sherman-Morrison formula and updates vector b.
+        (Sherman-Morrison, or a new low-rank factor) and updates vector b.
 
         Args:
             context: The context vector associated with the chosen arm (shape: [d]).
             arm: The index of the arm that was executed.
             reward: The reward value observing from the environment.
         """
-        self._init_arm(arm)
-        x = context.reshape(-1, 1)
+        self.batch_update(np.reshape(context, (1, -1)), [arm], [reward])
+
+    def batch_update(self, contexts, arms, rewards, wal_seq: Optional[int] = None) -> None:
+        """
+        Updates the model with a mini-batch, grouping the samples by arm.
 
-        self.b[arm] += reward * x
+        Each arm absorbs all of its samples at once (see ArmStore.absorb):
+        low-rank arms append them as factors, dense arms receive one
+        vectorized Sherman-Morrison or rank-k Woodbury update. The result
+        matches applying `update` sample by sample.
 
-        A_inv_old = self.A_inv[arm]
+        The batch is applied to a copy of the store, which then replaces the
+        published snapshot; concurrent readers keep the previous one.
 
-        numerator = (A_inv_old @ x) @ (x.T @ A_inv_old)
+        Args:
+            contexts: Array of contexts (shape: n_samples, d).
+            arms: Array of arms that received feedback (shape: n_samples,).
+            rewards: Array of rewards (shape: n_samples,).
+            wal_seq: Last feedback-log seq in the batch; stored with the new
+                     snapshot so checkpoints know what the log can drop.
+        """
+        arms = np.asarray(arms, dtype=np.int64).reshape(-1)
+        if arms.shape[0] == 0:
+            return
 
-        denominator = 1.0 + (x.T @ A_inv_old @ x).item()
+        X = np.asarray(contexts, dtype=float).reshape(arms.shape[0], self.d)
+        rewards = np.asarray(rewards, dtype=float).reshape(-1)
 
-        self.A_inv[arm] = A_inv_old - (numerator / denominator)
+        unique_arms, inverse = np.unique(arms, return_inverse=True)
 
-    def _to_dict(self) -> dict:
+        # b += sum(r * x) per arm
+        delta_b = np.zeros((unique_arms.shape[0], self.d))
+        np.add.at(delta_b, inverse, rewards[:, None] * X)
+
+        with self._write_lock:
+            store = self.store.copy()
+            rows = store.add_many(unique_arms.tolist())
+            store.dirty.update(unique_arms.tolist())
+            store.b[rows] += delta_b
+            store.absorb(rows[inverse], X)
+            store.refresh_theta(rows)
+            if wal_seq is not None:
+                store.wal_seq = max(store.wal_seq, int(wal_seq))
+            self.store = store  # publish
+
+    def _to_dict(self, store: Optional[ArmStore] = None) -> dict:
         """
         Serializes the internal state into a pure dictionary (JSON-friendly).
         """
+        store = self.store if store is None else store
+        A_inv = store.get_A_inv(np.arange(store.n))
         arms_data = {}
-        for arm_id, Ainv in self.A_inv.items():
-            b = self.b[arm_id]
+        for arm_id, row in store.index.items():
             arms_data[int(arm_id)] = {
-                "A_inv": Ainv.tolist(),
-                "b": b.tolist(),
+                "A_inv": A_inv[row].tolist(),
+                "b": store.b[row].reshape(-1, 1).tolist(),
             }
 
         return {
             "d": self.d,
             "alpha": self.alpha,
+            "wal_seq": int(store.wal_seq),
             "arms": arms_data,
         }
 
@@ -142,57 +304,161 @@ class LinUCBRecommender(BaseRecommender):
 
         arms_data = data.get("arms", {})
 
-        self.A_inv = {}
-        self.b = {}
-
-        for arm_id_str, ab in arms_data.items():
-            arm_id = int(arm_id_str)
-            A_inv = np.array(ab["A_inv"], dtype=float)
-            b = np.array(ab["b"], dtype=float).reshape(-1, 1)
-            self.A_inv[arm_id] = A_inv
-            self.b[arm_id] = b
+        n = len(arms_data)
+        store = self.new_store(n)
+        store.put(
+            {
+                "arm_ids": np.array([int(a) for a in arms_data], dtype=np.int64),
+                "b": np.array([ab["b"] for ab in arms_data.values()], dtype=float).reshape(n, d),
+                "A_inv": np.array(
+                    [ab["A_inv"] for ab in arms_data.values()], dtype=float
+                ).reshape(n, d, d),
+            }
+        )
+        store.wal_seq = int(data.get("wal_seq", 0))
+        self.store = store
 
-    def save_state(self, path: str):
+    def save_state(self, path: str) -> int:
         """
         Saves the current state to a file.
+
+        Paths ending in `.json` use the (slow) JSON format; anything else is
+        written as a binary checkpoint that `load_state` can memory-map.
+        Both are written to a temp file and renamed over `path`.
+
+        Returns the feedback-log seq (`wal_seq`) included in the saved state.
+        """
+        path = str(path)
+        store = self.store  # one snapshot for the whole save
+        if path.endswith(".json"):
+            data = self._to_dict(store)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            return store.wal_seq
+
+        checkpoint.write_checkpoint(
+            path,
+            d=self.d,
+            alpha=self.alpha,
+            arrays=store.export(),
+            generation=checkpoint.next_generation(path),
+            wal_seq=store.wal_seq,
+        )
+        # the new base supersedes every delta written so far
+        checkpoint.remove_deltas(path)
+        return store.wal_seq
+
+    def checkpoint(self, path: str) -> int:
+        """
+        Persists only the arms updated since the last checkpoint, appending
+        them to the delta segment of the binary base checkpoint at `path`.
+
+        The model is compacted into a new full base when there is no base yet
+        or when the delta segment grows past `delta_compaction_ratio` times
+        the base size. JSON paths are always saved in full.
+
+        Returns the feedback-log seq (`wal_seq`) covered by the files on disk.
         """
-        data = self._to_dict()
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f)
+        path = str(path)
+        with self._write_lock:
+            # the dirty set and the snapshot exported must match
+            store = self.store
+            dirty = store.take_dirty()
+
+        try:
+            if path.endswith(".json") or not os.path.exists(path):
+                return self.save_state(path)
+
+            if not dirty:
+                return store.wal_seq
+
+            rows = store.rows(dirty)
+            seg_size = checkpoint.append_delta(
+                path,
+                generation=checkpoint.read_header(path)["generation"],
+                arrays=store.export(rows),
+                wal_seq=store.wal_seq,
+            )
+
+            ratio = RECOMMENDER_CONFIG.get("delta_compaction_ratio", 0.5)
+            if seg_size > ratio * os.path.getsize(path):
+                return self.save_state(path)
+            return store.wal_seq
+        except Exception:
+            # keep the arms pending for the next checkpoint
+            with self._write_lock:
+                self.store.dirty.update(dirty)
+            raise
 
     def load_state(self, path: str, valid_arms: list[int], d_expected: int) -> None:
         """
         Loads the state of a file, reconciling it with the current arms.
 
+        Binary checkpoints are memory-mapped (zero copy) and their delta
+        segment is replayed on top; JSON files written by older versions are
+        still accepted and imported.
+
         - If the file does not exist, does nothing.
         - If d does not match, ignores the file.
-        - For new arms, sets A = I, b = 0.
+        - New arms stay implicit (A = I, b = 0) until their first update.
         - For removed arms, the parameters are discarded.
         """
+        path = str(path)
         if not os.path.exists(path):
             return
 
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        if checkpoint.is_checkpoint(path):
+            data = checkpoint.read_checkpoint(path)
+            if int(data["d"]) != d_expected:
+                # feature_dim changed, ignore previous state
+                return
+
+            self.d = int(data["d"])
+            self.alpha = float(data["alpha"])
+            store = self._adopt_store(data["arrays"])
+            store.wal_seq = int(data["wal_seq"])
+
+            # replay the incremental checkpoints written on top of this base,
+            # first cutting a record torn by a crash so later appends follow
+            # the last valid one
+            if checkpoint.repair_deltas(path):
+                print(f"[WARN] Registro incompleto removido do fim de {checkpoint.delta_path(path)}")
+            for arrays, wal_seq in checkpoint.read_deltas(path, data["generation"]):
+                store.put(arrays)
+                store.wal_seq = max(store.wal_seq, wal_seq)
+            self.max_rank = store.max_rank
+            self.store = store
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            file_d = int(data.get("d", -1))
+            if file_d != d_expected:
+                # feature_dim changed, ignore previous state
+                return
+
+            self._from_dict(data)
+
+        self._reconcile_arms(valid_arms)
+
+    def _reconcile_arms(self, valid_arms: list[int]) -> None:
+        """
+        Discards the stored arms that are no longer in `valid_arms`. Arms
+        without stored parameters are left implicit (A = I, b = 0).
 
-        file_d = int(data.get("d", -1))
-        if file_d != d_expected:
-            # feature_dim changed, ignore previous state
+        If every loaded row is still valid, the (memory-mapped) arrays are kept.
+        """
+        old = self.store
+        keep = np.flatnonzero(
+            np.isin(old.arm_ids[: old.n], np.asarray(valid_arms, dtype=np.int64))
+        )
+        if keep.shape[0] == old.n:
             return
 
-        self._from_dict(data)
-
-        I = np.eye(self.d)
-        zero = np.zeros((self.d, 1))
-
-        # ensures that all valid arms exist
-        for arm_id in valid_arms:
-            if arm_id not in self.A_inv:
-                self.A_inv[arm_id] = I.copy()
-                self.b[arm_id] = zero.copy()
-
-        # remove arms that are no longer valid
-        to_remove = [arm for arm in list(self.A_inv.keys()) if arm not in valid_arms]
-        for arm_id in to_remove:
-            del self.A_inv[arm_id]
-            del self.b[arm_id]
+        store = self._adopt_store(old.export(keep))
+        store.wal_seq = old.wal_seq
+        self.store = store
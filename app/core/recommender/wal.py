@@ -0,0 +1,195 @@
+"""
+Write-ahead log of the feedback applied to the LinUCB model
+
+Every feedback sample is appended to the log before it is buffered for
+training, and the log is truncated once a checkpoint that includes it was
+saved, so a crash loses nothing that was acknowledged. Layout (little-endian):
+
+    MAGIC (8 bytes) | d (uint32) | records
+
+Records have a fixed size for a given d, so the whole log is read back as one
+structured NumPy array:
+
+    seq (uint64) | arm (int64) | reward (float64) | context (d float64) | crc32
+
+`seq` grows by one per record; checkpoints store the last seq they include
+(`wal_seq`) and replay skips everything up to it.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+MAGIC = b"LUCWAL\x00\x01"
+
+_D = struct.Struct("<I")
+_HEADER_SIZE = len(MAGIC) + _D.size
+
+
+def record_dtype(d: int) -> np.dtype:
+    """Packed record layout for contexts of dimension d."""
+    return np.dtype(
+        [
+            ("seq", "<u8"),
+            ("arm", "<i8"),
+            ("reward", "<f8"),
+            ("x", "<f8", (d,)),
+            ("crc", "<u4"),
+        ]
+    )
+
+
+def read_records(path: str, d: int) -> np.ndarray:
+    """
+    Reads the valid records of a log as a structured array.
+
+    Reading stops at a torn tail or at the first record whose crc does not
+    match (e.g. a write interrupted by a crash). Logs written for another d
+    are ignored.
+    """
+    dtype = record_dtype(d)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+
+    with open(path, "rb") as f:
+        head = f.read(_HEADER_SIZE)
+        if len(head) < _HEADER_SIZE or head[: len(MAGIC)] != MAGIC:
+            return np.zeros(0, dtype=dtype)
+        if _D.unpack(head[len(MAGIC) :])[0] != d:
+            print(f"[WARN] Log de feedback '{path}' tem outra dimensão, ignorado")
+            return np.zeros(0, dtype=dtype)
+        raw = f.read()
+
+    count = len(raw) // dtype.itemsize
+    body = dtype.itemsize - 4  # bytes covered by the crc
+    view = memoryview(raw)
+    records = np.frombuffer(raw, dtype=dtype, count=count)
+    for i, crc in enumerate(records["crc"].tolist()):
+        start = i * dtype.itemsize
+        if zlib.crc32(view[start : start + body]) != crc:
+            return records[:i].copy()
+    return records.copy()
+
+
+class FeedbackLog:
+    """
+    Append-only log of (seq, arm, reward, context) records (see module doc).
+
+    Appends are serialized by a lock. Each one is flushed to the OS, so it
+    survives a process crash; `sync=True` also fsyncs it (survives power
+    loss, at the cost of one disk sync per feedback).
+    """
+
+    def __init__(self, path: str, d: int, start_seq: int = 0, sync: bool = False) -> None:
+        """
+        Args:
+            path: Log file; created if missing.
+            d: Dimension of the context vectors.
+            start_seq: Last seq already included in the loaded model; new
+                       records are numbered after it (and after the log's).
+            sync: fsyncs every append.
+        """
+        self.path = str(path)
+        self.d = d
+        self.sync = sync
+        self.dtype = record_dtype(d)
+        self._lock = threading.Lock()
+        self._file = None
+
+        existing = read_records(self.path, d)
+        self.last_seq = max(int(start_seq), int(existing["seq"][-1]) if existing.shape[0] else 0)
+        expected = _HEADER_SIZE + existing.nbytes
+        if os.path.exists(self.path) and os.path.getsize(self.path) == expected:
+            self._file = open(self.path, "ab")
+        else:
+            # missing, written for another d or with a torn tail
+            self._rewrite(existing)
+
+    def _rewrite(self, records: np.ndarray) -> None:
+        """Replaces the log by `records` (temp file + rename) and reopens it."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_D.pack(self.d))
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+
+    def append(self, context: np.ndarray, arm: int, reward: float) -> int:
+        """Appends one sample and returns its seq."""
+        rec = np.zeros(1, dtype=self.dtype)
+        rec["arm"] = arm
+        rec["reward"] = reward
+        rec["x"] = np.asarray(context, dtype=float).reshape(self.d)
+
+        with self._lock:
+            self.last_seq += 1
+            rec["seq"] = self.last_seq
+            raw = bytearray(rec.tobytes())
+            struct.pack_into("<I", raw, len(raw) - 4, zlib.crc32(raw[:-4]))
+            self._file.write(raw)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            return self.last_seq
+
+    def records(self, after: int = 0) -> np.ndarray:
+        """Valid records with seq > after, as a structured array."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            records = read_records(self.path, self.d)
+        return records[records["seq"] > after]
+
+    def truncate(self, upto: int) -> None:
+        """Drops the records with seq <= upto (they are in a saved checkpoint)."""
+        with self._lock:
+            records = read_records(self.path, self.d)
+            if records.shape[0] == 0 or records["seq"][0] > upto:
+                return
+            self._rewrite(records[records["seq"] > upto])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """Last seq written and size of the log file."""
+        return {"wal_last_seq": self.last_seq, "wal_bytes": os.path.getsize(self.path)}
+
+
+def replay_feedback_log(
+    recommender, log: FeedbackLog, valid_arms=None, chunk: int = 100000
+) -> int:
+    """
+    Applies the logged samples the model does not include yet (seq > its
+    wal_seq) with vectorized batch updates, in seq order. Samples of arms
+    outside `valid_arms` (removed books) are skipped.
+
+    Returns the number of samples applied.
+    """
+    records = log.records(after=recommender.store.wal_seq)
+    valid = None if valid_arms is None else np.asarray(list(valid_arms), dtype=np.int64)
+
+    applied = 0
+    for start in range(0, records.shape[0], chunk):
+        batch = records[start : start + chunk]
+        if valid is not None:
+            batch = batch[np.isin(batch["arm"], valid)]
+        if batch.shape[0] == 0:
+            continue
+        recommender.batch_update(
+            batch["x"], batch["arm"], batch["reward"], wal_seq=int(batch["seq"][-1])
+        )
+        applied += batch.shape[0]
+    return applied
@@ -2,26 +2,54 @@
 SINGLETON runtime for the RL Recommendation System.
 """
 
+from pathlib import Path
+import os
+import threading
+
 from app.core.recommender.linucb import LinUCBRecommender
+from app.core.recommender.factorized import FactorizedScorer
+from app.core.recommender.wal import FeedbackLog, replay_feedback_log
 from app.core.training import OnlineTrainer
 from app.core.context_features import ContextFeatures
+from app.core.item_features import ItemFeatureStore
+from app.core.candidates import CandidateIndex
 from app.utils.config import RECOMMENDER_CONFIG
+from app.utils.ttl_cache import TTLCache
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from app.db import crud
+from app.db import crud, models
 
 recommender: LinUCBRecommender | None = None
 trainer: OnlineTrainer | None = None
 features: ContextFeatures | None = None
+item_store: ItemFeatureStore | None = None
+scorer: FactorizedScorer | None = None
+candidates: CandidateIndex | None = None
 ARM_INDEX: dict[int, int] = {}
 BOOK_IDS: list[int] = []
 
+# contexts served by /slate/recommend, keyed by (user_id, slate_id, book_id),
+# so feedback trains on exactly what was scored for that user
+served_contexts = TTLCache(
+    max_size=RECOMMENDER_CONFIG.get("context_cache_size", 50000),
+    ttl=RECOMMENDER_CONFIG.get("context_cache_ttl", 3600.0),
+)
+
+# books committed after init_runtime (see the session listeners below), added
+# to the runtime by the next `add_pending_books`
+_pending_books: list[int] = []
+_books_lock = threading.Lock()  # serializes add_books: arm rows stay aligned
+_NEW_BOOKS_KEY = "rl_new_books"
+
 
 def init_runtime(db: Session):
     """
     Initializes the recommendation system. Should only be called once.
     """
-    global recommender, trainer, features, ARM_INDEX, BOOK_IDS
+    global recommender, trainer, features, item_store, scorer, candidates, ARM_INDEX, BOOK_IDS
 
+    with _books_lock:
+        _pending_books.clear()  # the catalog is read in full below
     BOOK_IDS.clear()
     BOOK_IDS.extend(crud.get_all_book_ids(db))
 
@@ -34,6 +62,11 @@ def init_runtime(db: Session):
     features = ContextFeatures()
     RECOMMENDER_CONFIG["feature_dim"] = features.feature_dim
 
+    # item features of the whole catalog, rows aligned with ARM_INDEX
+    item_store = ItemFeatureStore(features, RECOMMENDER_CONFIG.get("item_features_path"))
+    item_store.build(db, BOOK_IDS)
+    features.item_store = item_store
+
     recommender = LinUCBRecommender(
         n_arms=n_arms,
         d=RECOMMENDER_CONFIG["feature_dim"],
@@ -42,24 +75,122 @@ def init_runtime(db: Session):
 
     model_path = RECOMMENDER_CONFIG.get("model_path")
     if model_path:
+        # deployments from before the binary format: import the JSON checkpoint once
+        legacy_path = Path(model_path).with_suffix(".json")
+        if not os.path.exists(model_path) and legacy_path.exists():
+            load_path = legacy_path
+        else:
+            load_path = Path(model_path)
         try:
             recommender.load_state(
-                path=model_path,
+                path=str(load_path),
                 valid_arms=BOOK_IDS,
                 d_expected=features.feature_dim,
             )
+            if load_path != Path(model_path):
+                recommender.save_state(model_path)
+                print(f"[INFO] Checkpoint JSON {load_path} convertido para {model_path}")
         except Exception as e:
             print(f"[WARN] Falha ao carregar estado LinUCB: {e}")
 
+    # feedback logged since the last checkpoint (lost by a crash otherwise)
+    wal = None
+    wal_path = RECOMMENDER_CONFIG.get("wal_path")
+    if wal_path:
+        wal = FeedbackLog(
+            wal_path,
+            d=recommender.d,
+            start_seq=recommender.store.wal_seq,
+            sync=RECOMMENDER_CONFIG.get("wal_sync", False),
+        )
+
     trainer = OnlineTrainer(
-        recommender=recommender, batch_size=RECOMMENDER_CONFIG["batch_size"]
+        recommender=recommender, batch_size=RECOMMENDER_CONFIG["batch_size"], wal=wal
     )
 
+    if wal is not None:
+        replayed = replay_feedback_log(recommender, wal, valid_arms=BOOK_IDS)
+        if replayed:
+            print(f"[INFO] {replayed} feedbacks reaplicados do log {wal_path}")
+            if model_path:
+                trainer.checkpointer.request(model_path)
+
+    # full-catalog scoring over the precomputed item features
+    scorer = FactorizedScorer(recommender, features.dynamic_cols)
+    scorer.set_items(BOOK_IDS, item_store.contexts(BOOK_IDS))
+
+    # per-user exclusion bitsets over the arm index
+    candidates = CandidateIndex(BOOK_IDS, max_users=RECOMMENDER_CONFIG.get("candidate_cache_users", 10000))
+
+
+def add_books(db: Session, book_ids: list[int]) -> None:
+    """
+    Registers books added to the catalog after init_runtime: new arms
+    (implicit until their first update) and their item features.
+
+    The item store, scorer and candidate index append the new arms in the
+    same order, so their rows stay the ARM_INDEX entries; ARM_INDEX and
+    BOOK_IDS are extended last, once every row exists.
+    """
+    if item_store is None or scorer is None or candidates is None:
+        raise RuntimeError("RL runtime not initialized")
+
+    with _books_lock:
+        new = item_store.add_books(db, book_ids)
+        if not new:
+            return
+        scorer.set_items(new, item_store.contexts(new))
+        candidates.add_arms(new)
+        for bid in new:
+            ARM_INDEX[bid] = len(BOOK_IDS)
+            BOOK_IDS.append(bid)
+        RECOMMENDER_CONFIG["n_arms"] = len(BOOK_IDS)
+
+
+def add_pending_books(db: Session) -> None:
+    """Adds the books committed since the last call (e.g. by crud.create_book)."""
+    if not _pending_books:
+        return
+    with _books_lock:
+        new = list(_pending_books)
+        _pending_books.clear()
+    if new:
+        add_books(db, new)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_new_books(session: Session, flush_context) -> None:
+    """Collects the books inserted by a flush (`new` still holds them, with their ids)."""
+    new = [obj.id for obj in session.new if isinstance(obj, models.Book)]
+    if new:
+        session.info.setdefault(_NEW_BOOKS_KEY, []).extend(new)
+
+
+@event.listens_for(Session, "after_commit")
+def _queue_new_books(session: Session) -> None:
+    """Queues the committed books for `add_pending_books` (no SQL can run here)."""
+    new = session.info.pop(_NEW_BOOKS_KEY, None)
+    if new and item_store is not None:
+        with _books_lock:
+            _pending_books.extend(new)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_new_books(session: Session) -> None:
+    session.info.pop(_NEW_BOOKS_KEY, None)
+
+
 __all__ = [
     "recommender",
     "trainer",
     "features",
+    "item_store",
+    "scorer",
+    "candidates",
     "ARM_INDEX",
     "BOOK_IDS",
+    "served_contexts",
     "init_runtime",
+    "add_books",
+    "add_pending_books",
 ]
@@ -1,72 +1,307 @@
 """
 Online model update (mini-batchs)
 """
+from collections import deque
+import queue
 import threading
+import time
 
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import numpy as np
 
+from app.core.checkpointer import Checkpointer
+from app.core.recommender.wal import FeedbackLog
 from app.utils.config import RECOMMENDER_CONFIG
 
+# worker shutdown marker
+_STOP = object()
+
 
 class OnlineTrainer:
     """
     Manages online model updates with mini-batches.
+
+    By default `add_feedback` buffers the samples and the request that fills
+    the batch runs the update inline. After `start()`, samples go to a
+    bounded queue consumed by a background worker, which updates the model
+    when `batch_size` samples are pending or the oldest one waited
+    `max_latency` seconds, so feedback requests never pay the update cost.
+    Samples that find the queue full wait in an overflow list, which the
+    worker moves into the queue (in order) as it frees up; the producer
+    waits up to `put_timeout` seconds for that (backpressure), without
+    holding the lock, and then returns anyway. No sample is dropped: the
+    ones still waiting are counted as `deferred` and applied later.
+
+    With a FeedbackLog, every sample is logged before it is buffered or
+    queued, and the log is truncated by the checkpointer once a saved
+    checkpoint includes it (see `replay_feedback_log` for the recovery).
     """
 
-    def __init__(self, recommender, batch_size: int = 32):
+    def __init__(
+        self,
+        recommender,
+        batch_size: int = 32,
+        max_latency: Optional[float] = None,
+        queue_size: Optional[int] = None,
+        put_timeout: Optional[float] = None,
+        wal: Optional[FeedbackLog] = None,
+    ):
         """
         Initialize trainer.
 
         Args:
             recommender: ContextualRecommender instance
             batch_size: Mini-batch size for update
+            max_latency: Worker mode: seconds a sample may wait for its batch
+                         (default RECOMMENDER_CONFIG["train_max_latency"])
+            queue_size: Worker mode: max queued samples
+                        (default RECOMMENDER_CONFIG["train_queue_size"])
+            put_timeout: Worker mode: seconds a producer waits on a full queue
+                         (default RECOMMENDER_CONFIG["train_put_timeout"])
+            wal: Write-ahead log of the samples (None: no crash recovery)
         """
         self.recommender = recommender
         self.batch_size = batch_size
-        self.buffer: List[Tuple] = []  # buffer (context, arm, reward)
+        self.wal = wal
+        self.buffer: List[Tuple] = []  # buffer (context, arm, reward, wal seq)
+        self._lock = threading.Lock()  # guards the buffer (handlers run on a thread pool)
+        # worker mode: samples waiting for room in the queue, in seq order
+        self._overflow: deque = deque()
+        self._overflowed = 0  # samples ever put in the overflow list
+        self._moved = 0  # ... and moved from it into the queue
+        self._room = threading.Condition(self._lock)  # notified when they move
+        # inline mode: held from taking a batch to publishing it, so batches
+        # land (and wal_seq advances) in seq order
+        self._flush_lock = threading.Lock()
+
+        self.max_latency = float(
+            RECOMMENDER_CONFIG.get("train_max_latency", 1.0) if max_latency is None else max_latency
+        )
+        self.put_timeout = float(
+            RECOMMENDER_CONFIG.get("train_put_timeout", 0.5) if put_timeout is None else put_timeout
+        )
+        if queue_size is None:
+            queue_size = RECOMMENDER_CONFIG.get("train_queue_size", 10000)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=int(queue_size))
+        self._worker: Optional[threading.Thread] = None
+
+        # single background writer: saves after each batch are coalesced
+        self.checkpointer = Checkpointer(recommender, wal=wal)
+
+        # metrics (see `stats`)
+        self._enqueued = 0
+        self._deferred = 0
+        self._applied = 0
+        self._batches = 0
+        self._max_depth = 0
+        self._last_update_s = 0.0
+
+    @property
+    def running(self) -> bool:
+        """True while the background worker is consuming the queue."""
+        return self._worker is not None and self._worker.is_alive()
 
     def add_feedback(self, context: np.ndarray, arm: int, reward: float):
         """
-        Adds feedback to the buffer.
+        Adds feedback to the buffer (or to the worker queue, after `start`).
 
         Args:
             context: Context vector
             arm: Selected item
             reward: Reward
         """
-        self.buffer.append((context, arm, reward))
+        # logging and buffering under one lock keeps batches in seq order
+        with self._lock:
+            seq = self.wal.append(context, arm, reward) if self.wal is not None else None
+            sample = (context, arm, reward, seq)
+            if self.running:
+                if self._enqueue(sample):
+                    return
+                # backpressure: wait() releases the lock, so the other
+                # producers and the worker keep going meanwhile
+                ticket = self._overflowed
+                if not self._room.wait_for(lambda: self._moved >= ticket, self.put_timeout):
+                    self._deferred += 1
+                return
+            self.buffer.append(sample)
+            full = len(self.buffer) >= self.batch_size
 
-        if len(self.buffer) >= self.batch_size:
+        if full:
             return self.flush()
 
+    def _enqueue(self, sample: Tuple) -> bool:
+        """
+        Hands a sample to the worker without blocking (lock held). Returns
+        False if it went to the overflow list instead (the queue was full).
+        """
+        if not self._overflow:
+            try:
+                self._queue.put_nowait(sample)
+            except queue.Full:
+                pass
+            else:
+                self._enqueued += 1
+                self._max_depth = max(self._max_depth, self._queue.qsize())
+                return True
+        self._overflow.append(sample)
+        self._overflowed += 1
+        return False
+
+    def _refill(self) -> None:
+        """Moves overflow samples into the queue while it has room (lock held)."""
+        moved = 0
+        while self._overflow:
+            try:
+                self._queue.put_nowait(self._overflow[0])
+            except queue.Full:
+                break
+            self._overflow.popleft()
+            moved += 1
+        if moved:
+            self._moved += moved
+            self._enqueued += moved
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+            self._room.notify_all()
+
     def flush(self):
         """
         Processes accumulated buffer and updates template.
+
+        With the worker running, blocks until every queued sample was applied.
         """
-        if not self.buffer:
+        if self.running:
+            self._queue.join()
+            return
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self.buffer = self.buffer, []
+            return self._apply(batch)
+
+    def _apply(self, batch: List[Tuple]) -> None:
+        """Updates the model with a batch and requests a background save."""
+        if not batch:
             return
 
-        contexts = np.array([x[0] for x in self.buffer])
-        arms = np.array([x[1] for x in self.buffer])
-        rewards = np.array([x[2] for x in self.buffer])
+        contexts = np.array([x[0] for x in batch])
+        arms = np.array([x[1] for x in batch])
+        rewards = np.array([x[2] for x in batch])
+        seqs = [x[3] for x in batch if x[3] is not None]
 
-        self.recommender.batch_update(contexts, arms, rewards)
-        self.buffer.clear()
+        # builds and publishes a new model snapshot (see LinUCBRecommender)
+        start = time.perf_counter()
+        if seqs:
+            self.recommender.batch_update(contexts, arms, rewards, wal_seq=max(seqs))
+        else:
+            self.recommender.batch_update(contexts, arms, rewards)
+        self._last_update_s = time.perf_counter() - start
+        self._applied += len(batch)
+        self._batches += 1
 
         model_path = RECOMMENDER_CONFIG["model_path"]
-        if model_path and hasattr(self.recommender, "save_state"):
-            # Performs the save in a separate thread so as not to block
-            save_thread = threading.Thread(
-                target=self._save_state_thread, args=(model_path,)
-            )
-            save_thread.start()
-            return save_thread
-
-    def _save_state_thread(self, path: str):
-        """Target function for the rescue thread, with error handling."""
-        try:
-            self.recommender.save_state(path)
-            print(f"[INFO] Estado do modelo salvo em {path}")
-        except Exception as e:
-            print(f"[WARN] Falha ao salvar estado LinUCB em background: {e}")
+        if model_path and hasattr(self.recommender, "checkpoint"):
+            self.checkpointer.request(model_path)
+
+    # ==================== Background worker ====================
+
+    def start(self) -> None:
+        """Starts the background worker (samples already buffered are queued first)."""
+        # waits for an inline flush in progress; the buffered samples are
+        # queued before any new one (running turns True under the lock)
+        with self._flush_lock, self._lock:
+            if self.running:
+                return
+            pending, self.buffer = self.buffer, []
+            for sample in pending:
+                self._enqueue(sample)
+            self._worker = threading.Thread(target=self._run, name="online-trainer", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Drains the queue (every queued sample is applied) and stops the
+        worker, then applies the samples still buffered. Later feedback is
+        buffered inline again.
+        """
+        worker = self._worker
+        if worker is None:
+            self.flush()
+            return
+        if worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join(timeout)
+        if worker.is_alive():
+            print("[WARN] Worker de treino não terminou dentro do timeout")
+            return
+        self._worker = None
+
+        # samples queued behind the stop marker are applied inline
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if item is not _STOP:
+                leftovers.append(item)
+        with self._lock:
+            self.buffer = leftovers + list(self._overflow) + self.buffer
+            self._moved += len(self._overflow)
+            self._overflow.clear()
+            self._room.notify_all()
+        self.flush()
+
+    def _run(self) -> None:
+        """Worker loop: collects batches by size or max latency and applies them."""
+        batch: List[Tuple] = []
+        deadline = None
+        stop = False
+
+        while not stop:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stop = True
+            elif item is not None:
+                batch.append(item)
+                if self._overflow:
+                    with self._lock:
+                        self._refill()
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_latency
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (stop or due or len(batch) >= self.batch_size):
+                try:
+                    self._apply(batch)
+                except Exception as e:
+                    print(f"[WARN] Falha ao atualizar modelo com {len(batch)} feedbacks: {e}")
+                for _ in batch:
+                    self._queue.task_done()
+                batch, deadline = [], None
+
+            if item is _STOP:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """Queue depth and throughput counters of the trainer."""
+        return {
+            "mode": "worker" if self.running else "inline",
+            "queue_depth": (
+                self._queue.qsize() + len(self._overflow) if self.running else len(self.buffer)
+            ),
+            "queue_capacity": self._queue.maxsize,
+            "max_queue_depth": self._max_depth,
+            "enqueued": self._enqueued,
+            "deferred": self._deferred,
+            "applied": self._applied,
+            "batches": self._batches,
+            "last_update_seconds": self._last_update_s,
+            **self.checkpointer.stats(),
+            **(self.wal.stats() if self.wal is not None else {}),
+        }
@@ -3,9 +3,10 @@ CRUD (Create, Read, Update, Delete) operations in the database
 """
 
 import json
-from sqlalchemy.orm import Session, load_only
-from typing import List, Optional, Tuple
-from sqlalchemy import desc, func
+from sqlalchemy.orm import Session, load_only, selectinload
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, desc, func, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from . import models
 
@@ -43,22 +44,41 @@ def update_user_genres(db: Session, user_id: int, categories: str) -> models.Use
 
 def get_user_book_states(db: Session, user_id: int) -> dict:
     """
-    Rebuilds the current state of all books with which the user has interacted.
+    Returns the current state of all books with which the user has interacted.
     Returns a dictionary: {book_id: ActionType}
     """
+    S = models.UserBookState
+    rows = db.query(S.book_id, S.state).filter(S.user_id == user_id).all()
+    return {book_id: state for book_id, state in rows}
 
-    events = (
-        db.query(models.Event)
-        .filter(models.Event.user_id == user_id)
-        .order_by(models.Event.timestamp.asc())
-        .all()
-    )
 
-    current_state = {}
-    for event in events:
-        current_state[event.book_id] = event.action_type
+def get_user_book_state(
+    db: Session, user_id: int, book_id: int
+) -> Optional[models.UserBookState]:
+    """Current state of a (user, book) pair (None if never interacted)"""
+    S = models.UserBookState
+    return db.query(S).filter(S.user_id == user_id, S.book_id == book_id).first()
 
-    return current_state
+
+def get_user_book_ids_by_state(
+    db: Session, user_id: int, states: List[models.ActionType]
+) -> List[int]:
+    """Ids of the books whose current state for the user is one of `states`"""
+    S = models.UserBookState
+    rows = db.query(S.book_id).filter(S.user_id == user_id, S.state.in_(states)).all()
+    return [book_id for (book_id,) in rows]
+
+
+def _get_user_books_current(
+    db: Session, user_id: int, state: models.ActionType
+) -> List[models.Book]:
+    S = models.UserBookState
+    return (
+        db.query(models.Book)
+        .join(S, S.book_id == models.Book.id)
+        .filter(S.user_id == user_id, S.state == state)
+        .all()
+    )
 
 
 def get_user_liked_books_current(db: Session, user_id: int) -> List[models.Book]:
@@ -66,32 +86,55 @@ def get_user_liked_books_current(db: Session, user_id: int) -> List[models.Book]
     Returns ONLY books that are CURRENTLY liked.
     If the user clicked Like -> Clear, this book will NOT appear here.
     """
-    states = get_user_book_states(db, user_id)
-
-    liked_ids = [
-        bid for bid, action in states.items() if action == models.ActionType.LIKE
-    ]
-
-    if not liked_ids:
-        return []
-
-    return db.query(models.Book).filter(models.Book.id.in_(liked_ids)).all()
+    return _get_user_books_current(db, user_id, models.ActionType.LIKE)
 
 
 def get_user_disliked_books_current(db: Session, user_id: int) -> List[models.Book]:
     """
     Mesma lógica, mas para Dislikes atuais.
     """
-    states = get_user_book_states(db, user_id)
+    return _get_user_books_current(db, user_id, models.ActionType.DISLIKE)
+
+
+def _upsert_user_book_state(db: Session, event: models.Event) -> None:
+    """Makes `event` the current state of its (user, book) pair."""
+    values = {
+        "state": event.action_type,
+        "reward_w": event.reward_w,
+        "last_event_id": event.id,
+    }
+    stmt = sqlite_insert(models.UserBookState).values(
+        user_id=event.user_id, book_id=event.book_id, **values
+    )
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=["user_id", "book_id"], set_=values)
+    )
 
-    disliked_ids = [
-        bid for bid, action in states.items() if action == models.ActionType.DISLIKE
-    ]
 
-    if not disliked_ids:
-        return []
+def backfill_user_book_state(db: Session) -> int:
+    """
+    Rebuilds user_book_state by replaying the events table in order
+    (streamed). Returns the number of (user, book) pairs.
+    """
+    E = models.Event
+    current = {}
+    events = (
+        db.query(E.id, E.user_id, E.book_id, E.action_type, E.reward_w)
+        .order_by(E.timestamp.asc(), E.id.asc())
+        .yield_per(5000)
+    )
+    for event_id, user_id, book_id, action_type, reward_w in events:
+        current[(user_id, book_id)] = (action_type, reward_w, event_id)
 
-    return db.query(models.Book).filter(models.Book.id.in_(disliked_ids)).all()
+    db.query(models.UserBookState).delete()
+    db.add_all(
+        models.UserBookState(
+            user_id=user_id, book_id=book_id, state=state, reward_w=reward_w, last_event_id=event_id
+        )
+        for (user_id, book_id), (state, reward_w, event_id) in current.items()
+    )
+    db.commit()
+    return len(current)
 
 
 # ==================== CATEGORY ====================
@@ -230,8 +273,8 @@ def create_book(
     Args:
         db: Database session
         title: Book title
-        authors: Comma-separated author names
-        categories: Original categories string from CSV
+        authors: Author names (stored as a JSON list)
+        categories: Category names (stored as a JSON list)
         category_names: List of category names to associate with this book
         description: Book description
         image: Image URL
@@ -247,8 +290,8 @@ def create_book(
     """
     book = models.Book(
         title=title,
-        authors=str(authors),
-        categories=str(categories),
+        authors=json.dumps(authors) if authors is not None else None,
+        categories=json.dumps(categories) if categories is not None else None,
         description=description,
         image=image,
         info_link=info_link,
@@ -282,6 +325,58 @@ def get_book(db: Session, book_id: int) -> Optional[models.Book]:
     return db.query(models.Book).filter(models.Book.id == book_id).first()
 
 
+def get_books(db: Session, book_ids: List[int]) -> List[models.Book]:
+    """Retrieves several books by ID in one query (order is not guaranteed)"""
+    if not book_ids:
+        return []
+    return db.query(models.Book).filter(models.Book.id.in_(book_ids)).all()
+
+
+def get_books_with_relations(db: Session, book_ids: List[int]) -> List[models.Book]:
+    """
+    Retrieves several books in one query, with categories and authors
+    eagerly loaded (no lazy load per book). Order is not guaranteed.
+    """
+    if not book_ids:
+        return []
+    return (
+        db.query(models.Book)
+        .options(
+            selectinload(models.Book.categories_rel),
+            selectinload(models.Book.authors_rel),
+        )
+        .filter(models.Book.id.in_(book_ids))
+        .all()
+    )
+
+
+def get_book_feature_sources(db: Session, book_ids: List[int]) -> Dict[int, tuple]:
+    """
+    Columns the item features of each book are computed from (rating,
+    popularity, publisher, categories and the category/author ids), read
+    with three column-only queries (no Book objects). Missing books are
+    left out.
+    """
+    if not book_ids:
+        return {}
+    B = models.Book
+    sources = {
+        int(book_id): [avg_rating, ratings_count, publisher, categories, [], []]
+        for book_id, avg_rating, ratings_count, publisher, categories in db.query(
+            B.id, B.avg_rating, B.ratings_count, B.publisher, B.categories
+        ).filter(B.id.in_(book_ids))
+    }
+    for pos, table, column in (
+        (4, models.book_categories, models.book_categories.c.category_id),
+        (5, models.book_authors, models.book_authors.c.author_id),
+    ):
+        links = db.query(table.c.book_id, column).filter(table.c.book_id.in_(book_ids))
+        for book_id, linked_id in links.order_by(table.c.book_id, column):
+            if int(book_id) in sources:
+                sources[int(book_id)][pos].append(int(linked_id))
+    return {book_id: tuple(values) for book_id, values in sources.items()}
+
+
 def get_all_books(db: Session, skip: int = 0, limit: Optional[int] = None) -> List[models.Book]:
     """List all books"""
     return db.query(models.Book).offset(skip).limit(limit).all()
@@ -338,11 +433,88 @@ def create_event(
         ),
     )
     db.add(event)
+    db.flush()  # assigns event.id
+    _increment_user_stats(db, user_id, action_enum)
+    _upsert_user_book_state(db, event)
     db.commit()
     db.refresh(event)
     return event
 
 
+# ==================== USER STATS ====================
+def _increment_user_stats(db: Session, user_id: int, action: models.ActionType) -> None:
+    """Counts one more event of the user (same transaction as the event)."""
+    S = models.UserStats
+    like = int(action == models.ActionType.LIKE)
+    dislike = int(action == models.ActionType.DISLIKE)
+    stmt = sqlite_insert(S).values(user_id=user_id, total_events=1, likes=like, dislikes=dislike)
+    # one statement, incremented in place (no read-modify-write between requests)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={
+                "total_events": S.total_events + 1,
+                "likes": S.likes + like,
+                "dislikes": S.dislikes + dislike,
+            },
+        )
+    )
+
+
+def get_user_stats(db: Session, user_id: int) -> Optional[models.UserStats]:
+    """Engagement counters of a user (None if the user has no events)"""
+    return db.query(models.UserStats).filter(models.UserStats.user_id == user_id).first()
+
+
+def backfill_user_stats(db: Session) -> int:
+    """
+    Rebuilds every user's counters from the events table (one aggregate
+    query). Returns the number of users with events.
+    """
+    E = models.Event
+    rows = (
+        db.query(
+            E.user_id,
+            func.sum(case((E.action_type == models.ActionType.LIKE, 1), else_=0)),
+            func.sum(case((E.action_type == models.ActionType.DISLIKE, 1), else_=0)),
+            func.count(E.id),
+        )
+        .group_by(E.user_id)
+        .all()
+    )
+
+    db.query(models.UserStats).delete()
+    db.add_all(
+        models.UserStats(user_id=uid, likes=likes, dislikes=dislikes, total_events=total)
+        for uid, likes, dislikes, total in rows
+    )
+    db.commit()
+    return len(rows)
+
+
+def _create_missing_table(db: Session, model) -> bool:
+    """Creates the table of `model` if the database predates it."""
+    bind = db.get_bind()
+    if inspect(bind).has_table(model.__tablename__):
+        return False
+    model.__table__.create(bind=bind)
+    return True
+
+
+def ensure_materialized_tables(db: Session) -> None:
+    """
+    Creates the tables derived from events (user_stats, user_book_state) on
+    databases that predate them, filling them from the existing events
+    (one-off backfill).
+    """
+    if _create_missing_table(db, models.UserStats):
+        n_users = backfill_user_stats(db)
+        print(f"[INFO] Tabela user_stats criada: contadores de {n_users} usuários preenchidos")
+    if _create_missing_table(db, models.UserBookState):
+        n_pairs = backfill_user_book_state(db)
+        print(f"[INFO] Tabela user_book_state criada: {n_pairs} pares usuário-livro preenchidos")
+
+
 def get_user_events(
     db: Session, user_id: int, action_type: Optional[str] = None
 ) -> List[models.Event]:
@@ -353,6 +525,26 @@ def get_user_events(
     return query.all()
 
 
+def get_event_feedback_chunk(
+    db: Session,
+    after_id: int,
+    limit: int,
+    partition: int = 0,
+    n_partitions: int = 1,
+) -> List[tuple]:
+    """
+    Next `limit` events with id > after_id, in id order, as
+    (id, user_id, book_id, reward, ctx_features) rows (keyset pagination).
+    With n_partitions > 1 only books with book_id % n_partitions == partition.
+    """
+    Event = models.Event
+    query = db.query(Event.id, Event.user_id, Event.book_id, Event.reward, Event.ctx_features)
+    query = query.filter(Event.id > after_id)
+    if n_partitions > 1:
+        query = query.filter(Event.book_id % n_partitions == partition)
+    return query.order_by(Event.id).limit(limit).all()
+
+
 def get_events_by_slate(db: Session, slate_id: str) -> List[models.Event]:
     """List all events on a slate (recommendation)"""
     return db.query(models.Event).filter(models.Event.slate_id == slate_id).all()
@@ -410,20 +602,12 @@ def count_user_unique_book_events(db: Session, user_id: int) -> int:
     """
     Counts the user unique books interacted.
     """
-    events = (
-        db.query(models.Event)
-        .filter(
-            models.Event.user_id == user_id,
-        )
-        .all()
+    return (
+        db.query(models.UserBookState)
+        .filter(models.UserBookState.user_id == user_id)
+        .count()
     )
 
-    books = set()
-    for event in events:
-        books.add(event.book_id)  # type: ignore
-
-    return len(books)
-
 
 def get_user_disliked_books(db: Session, user_id: int) -> List[models.Book]:
     """List all books disliked by a user"""
@@ -484,16 +668,15 @@ def get_user_latest_interactions(
 def get_user_available_books(
     db: Session, user_id: int, limit: Optional[int] = None, skip: int = 0
 ):
-    """Get user available books for interaction"""
-    liked_books = get_user_liked_books_current(db, user_id)
-    disliked_books = get_user_disliked_books(db, user_id)
-
-    liked_ids = [book.id for book in liked_books]
-    disliked_ids = [book.id for book in disliked_books]
-    excluded_ids = liked_ids + disliked_ids
+    """Get user available books for interaction (not currently liked/disliked)"""
+    S = models.UserBookState
+    excluded = db.query(S.book_id).filter(
+        S.user_id == user_id,
+        S.state.in_([models.ActionType.LIKE, models.ActionType.DISLIKE]),
+    )
     return (
         db.query(models.Book)
-        .filter(~models.Book.id.in_(excluded_ids))
+        .filter(~models.Book.id.in_(excluded))
         .offset(skip)
         .limit(limit)
         .all()
@@ -1,5 +1,5 @@
 """
-Models SQLAlchemy: User, Book, ActionType, Event
+Models SQLAlchemy: User, UserStats, Book, ActionType, Event, UserBookState
 """
 
 from sqlalchemy import (
@@ -12,13 +12,52 @@ from sqlalchemy import (
     ForeignKey,
     Enum,
     Table,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from datetime import datetime, UTC
 import enum
 import ast
+import json
+from functools import lru_cache
 from .database import Base
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+
+@lru_cache(maxsize=65536)
+def _parse_list(value: str) -> Tuple[str, ...]:
+    """
+    Parses a stored list column once per distinct value (memoized across
+    instances and sessions).
+
+    Lists are stored as JSON (crud.create_book); rows imported by older
+    versions hold Python literals (str(list)) and go through literal_eval.
+    """
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(value)
+        except Exception:
+            return ()
+    if isinstance(parsed, list):
+        return tuple(parsed)
+    return ()
+
+
+def _get_list_field(instance, column_name: str) -> List[str]:
+    """
+    Returns the field value as a list.
+    If it is None, an empty string, or a list string, returns an empty list.
+    """
+    value = getattr(instance, column_name, None)
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return list(_parse_list(value))
+    return []
 
 
 # Association tables for many-to-many relationships
@@ -78,28 +117,32 @@ class User(Base):
     events = relationship("Event", back_populates="user", cascade="all, delete-orphan")
 
     @property
-    def get_genre_list(self):
+    def get_genre_list(self) -> List[str]:
+        """
+        Preferred genres. PUT /users/profile stores them comma-separated;
+        list literals are accepted as well.
+        """
+        value = self.preferred_genres
+        if isinstance(value, str) and value and not value.lstrip().startswith("["):
+            return [g.strip() for g in value.split(",") if g.strip()]
         return self._get_list_field("preferred_genres")
 
     def _get_list_field(self, column_name: str) -> List[str]:
-        """
-        Returns the field value as a list.
-        If it is None, an empty string, or a list string, returns an empty list.
-        """
-        value = getattr(self, column_name, None)
-        if not value:
-            return []
-        if isinstance(value, list):
-            return value
-        if isinstance(value, str):
-            try:
-                parsed = ast.literal_eval(value)
-                if isinstance(parsed, list):
-                    return parsed
-                return []
-            except Exception:
-                return []
-        return []
+        return _get_list_field(self, column_name)
+
+
+class UserStats(Base):
+    """
+    Per-user engagement counters, kept in sync by crud.create_event
+    (backfilled from events by crud.backfill_user_stats).
+    """
+
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    likes = Column(Integer, nullable=False, default=0)
+    dislikes = Column(Integer, nullable=False, default=0)
+    total_events = Column(Integer, nullable=False, default=0)
 
 
 class Book(Base):
@@ -109,8 +152,8 @@ class Book(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False, index=True)
-    authors = Column(Text, nullable=True)  # Comma-separated
-    categories = Column(Text, nullable=True)  # Original CSV categories as string
+    authors = Column(Text, nullable=True)  # JSON list (older rows: str(list))
+    categories = Column(Text, nullable=True)  # JSON list (older rows: str(list))
     description = Column(Text, nullable=True)
     image = Column(Text, nullable=True)
     info_link = Column(Text, nullable=True)
@@ -147,24 +190,7 @@ class Book(Base):
         return self._get_list_field("authors")
 
     def _get_list_field(self, column_name: str) -> List[str]:
-        """
-        Returns the field value as a list.
-        If it is None, an empty string, or a list string, returns an empty list.
-        """
-        value = getattr(self, column_name, None)
-        if not value:
-            return []
-        if isinstance(value, list):
-            return value
-        if isinstance(value, str):
-            try:
-                parsed = ast.literal_eval(value)
-                if isinstance(parsed, list):
-                    return parsed
-                return []
-            except Exception:
-                return []
-        return []
+        return _get_list_field(self, column_name)
 
 
 class ActionType(str, enum.Enum):
@@ -194,3 +220,20 @@ class Event(Base):
     # Relationship
     user = relationship("User", back_populates="events")
     book = relationship("Book", back_populates="events")
+
+
+class UserBookState(Base):
+    """
+    Current feedback state of each (user, book) pair: the last event of the
+    pair, upserted by crud.create_event (materialized view of `events`).
+    """
+
+    __tablename__ = "user_book_state"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    state = Column(Enum(ActionType), nullable=False)
+    reward_w = Column(Float, default=0.0)
+    last_event_id = Column(Integer, ForeignKey("events.id"))
+
+    __table_args__ = (Index("ix_user_book_state_user_state", "user_id", "state"),)
@@ -8,7 +8,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from app.core import rl_runtime as rl
 from .db.database import get_db
-from .utils.config import FASTAPI_CONFIG
+from .db import crud
+from .utils.config import FASTAPI_CONFIG, RECOMMENDER_CONFIG
 from .api import routes_slate, routes_feedback, routes_users
 
 
@@ -18,8 +19,17 @@ async def lifespan(app: FastAPI):
     Função de Lifespan para inicializar o runtime do RL no startup.
     """
     db = next(get_db())
+    crud.ensure_materialized_tables(db)
     rl.init_runtime(db)
+    if rl.trainer is not None and RECOMMENDER_CONFIG.get("train_worker", False):
+        rl.trainer.start()
     yield
+    # apply every queued feedback before exiting
+    if rl.trainer is not None:
+        rl.trainer.stop()
+        rl.trainer.checkpointer.stop()  # writes the last pending save
+        if rl.trainer.wal is not None:
+            rl.trainer.wal.close()
 
 
 # ==================== FastAPI ====================
@@ -51,6 +61,12 @@ def read_root():
     }
 
 
+@app.get("/metrics/training")
+def training_metrics():
+    """Training queue depth and update counters"""
+    return rl.trainer.stats() if rl.trainer is not None else {}
+
+
 if __name__ == "__main__":
     import uvicorn
 
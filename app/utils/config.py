@@ -16,7 +16,7 @@ DATABASE_PATH = DATA_DIR / "database.db"
 
 
 # Create directories if they do not exist
-for directory in [DATA_DIR, RAW_DATA_DIR, PROCESSED_DATA_DIR, EMBEDDINGS_DIR]:
+for directory in [DATA_DIR, RAW_DATA_DIR, PROCESSED_DATA_DIR, EMBEDDINGS_DIR, MODELS_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
 # Template settings
@@ -26,8 +26,29 @@ RECOMMENDER_CONFIG = {
     "model_type": "linucb",
     "alpha": 0.5,  # LinUCB exploration parameter
     "batch_size": 5,  # Mini-batch actions size for update
+    "train_worker": True,  # update the model in a background worker (False: inline)
+    "train_max_latency": 1.0,  # worker: max seconds a feedback waits for its batch
+    "train_queue_size": 10000,  # worker: max queued feedbacks (backpressure past it)
+    "train_put_timeout": 0.5,  # worker: seconds a request waits on a full queue
+    "low_rank_max_rank": 8,  # updates kept as low-rank factors before A_inv turns dense
     "item_config": EMBEDDINGS_DIR / "item_config.json",
-    "model_path": MODELS_DIR / "linucb_model.json",
+    "item_features_path": EMBEDDINGS_DIR / "item_features",  # .npy/.json (None: memory only)
+    "model_path": MODELS_DIR / "linucb_model.bin",  # binary checkpoint (.json also accepted)
+    "wal_path": MODELS_DIR / "linucb_feedback.wal",  # write-ahead feedback log (None: off)
+    "wal_sync": False,  # fsync every logged feedback (True survives power loss)
+    "checkpoint_min_interval": 5.0,  # min seconds between two background saves (coalesced)
+    "delta_compaction_ratio": 0.5,  # rewrite the base when deltas exceed this fraction of it
+    "state_dtype": "float64",  # storage of the arm matrices: "float64" or "float32"
+    "state_packed": False,  # store dense A_inv as its upper triangle (~half the memory)
+    "precision_check_every": 50,  # float32 only: updates between A_inv drift checks
+    "candidate_cache_users": 10000,  # users whose exclusion bitsets stay in memory (LRU)
+    "book_card_cache_size": 5000,  # rendered book cards kept in memory (LRU)
+    "book_card_ttl": 600.0,  # seconds a cached book card stays valid
+    "context_cache_size": 50000,  # served (slate_id, book_id) contexts kept for feedback
+    "context_cache_ttl": 3600.0,  # seconds a served context can be reused by feedback
+    # branch-and-bound top-k in LinUCB.recommend (exact); offline/evaluation use
+    # only: slates are ranked by FactorizedScorer, whose scores cost O(p^2) per arm
+    "topk_pruning": False,
 }
 
 # Streamlit Settings
@@ -11,6 +11,18 @@ from sqlalchemy.pool import StaticPool
 from app.db import crud
 from app.db.database import Base, get_db
 from app.main import app
+from app.utils.config import RECOMMENDER_CONFIG
+
+
+# ==================== Runtime fixtures ====================
+
+
+@pytest.fixture(autouse=True)
+def isolated_artifacts(tmp_path, monkeypatch):
+    """Keeps model checkpoints, the feedback log and the item matrix out of data/."""
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "model_path", str(tmp_path / "linucb_model.bin"))
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "wal_path", str(tmp_path / "linucb_feedback.wal"))
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "item_features_path", None)
 
 
 # ==================== Database fixtures ====================
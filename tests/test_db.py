@@ -133,3 +133,63 @@ def test_create_event_with_ctx_features(db_session):
         ctx_features="[0.1, 0.2]",
     )
     assert evt.ctx_features == "[0.1, 0.2]"
+
+
+def test_user_stats_follow_events_and_backfill(db_session):
+    """Checks user_stats counters are updated on write and match a backfill."""
+    user = crud.create_user(db_session, "stats_user", "pw123")
+    book = crud.create_book(db_session, "Stats Book", authors=["A"], categories=["C"])
+
+    for action in ["like", "dislike", "like", "clear"]:
+        crud.create_event(db_session, user.id, book.id, "slate-s", pos=1, action_type=action)
+
+    stats = crud.get_user_stats(db_session, user.id)
+    assert (stats.likes, stats.dislikes, stats.total_events) == (2, 1, 4)
+
+    crud.backfill_user_stats(db_session)
+    stats = crud.get_user_stats(db_session, user.id)
+    assert (stats.likes, stats.dislikes, stats.total_events) == (2, 1, 4)
+
+
+def test_user_book_state_is_upserted_and_backfilled(db_session):
+    """Checks user_book_state tracks the last event and matches a replay of events."""
+    user = crud.create_user(db_session, "state_user", "pw123")
+    books = [
+        crud.create_book(db_session, f"State {i}", authors=["A"], categories=["C"])
+        for i in range(3)
+    ]
+    actions = [(0, "like", 1.0), (1, "dislike", -1.0), (0, "clear", 0.0), (2, "like", 1.0)]
+    for i, action, reward_w in actions:
+        crud.create_event(
+            db_session, user.id, books[i].id, "slate-u", pos=1,
+            action_type=action, reward_w=reward_w,
+        )
+
+    states = crud.get_user_book_states(db_session, user.id)
+    assert states == {
+        books[0].id: models.ActionType.CLEAR,
+        books[1].id: models.ActionType.DISLIKE,
+        books[2].id: models.ActionType.LIKE,
+    }
+    assert crud.get_user_book_state(db_session, user.id, books[1].id).reward_w == -1.0
+
+    available = {b.id for b in crud.get_user_available_books(db_session, user.id)}
+    assert books[0].id in available
+    assert books[1].id not in available and books[2].id not in available
+
+    crud.backfill_user_book_state(db_session)
+    assert crud.get_user_book_states(db_session, user.id) == states
+
+
+def test_book_list_fields_are_json_and_parse_legacy_literals(db_session):
+    """Checks list columns are stored as JSON and legacy literals still parse."""
+    book = crud.create_book(db_session, "Json Book", authors=["A'1"], categories=["X", "Y"])
+    assert book.authors == '["A\'1"]'
+    assert book.get_authors_list == ["A'1"]
+
+    book.categories = "['Legacy', 'Cats']"  # str(list), as imported by older versions
+    assert book.get_categories_list == ["Legacy", "Cats"]
+    assert models._parse_list("['Legacy', 'Cats']") is models._parse_list("['Legacy', 'Cats']")
+
+    empty = crud.create_book(db_session, "No Lists")
+    assert empty.authors is None and empty.get_authors_list == []
@@ -165,3 +165,47 @@ def test_feedback_likes_dislikes_lists(client, user_and_books):
     likes = client.get(f"/feedback/user/{user.id}/likes").json()
     dislikes = client.get(f"/feedback/user/{user.id}/dislikes").json()
     assert likes["total"] == 1 and dislikes["total"] == 1
+
+
+def test_feedback_reuses_served_context(client, user_and_books, db_session):
+    """Feedback for a served (user_id, slate_id, book_id) stores the slate-time context."""
+    import json
+
+    import numpy as np
+
+    from app.core import rl_runtime as rl
+
+    user, books = user_and_books
+    served = np.full(rl.features.feature_dim, 0.25)  # type: ignore
+    rl.served_contexts.put((user.id, "slate-ctx", books[0].id), served)
+
+    resp = client.post(
+        "/feedback/register",
+        json={
+            "user_id": user.id,
+            "book_id": books[0].id,
+            "action_type": "like",
+            "slate_id": "slate-ctx",
+            "pos": 0,
+        },
+    )
+    assert resp.status_code == 200
+
+    event = next(e for e in crud.get_user_events(db_session, user.id) if e.slate_id == "slate-ctx")
+    assert json.loads(event.ctx_features) == served.tolist()
+
+    # another user sending the same slate id does not get that context
+    other = crud.create_user(db_session, f"other_{user.id}", "secret")
+    resp = client.post(
+        "/feedback/register",
+        json={
+            "user_id": other.id,
+            "book_id": books[0].id,
+            "action_type": "like",
+            "slate_id": "slate-ctx",
+            "pos": 0,
+        },
+    )
+    assert resp.status_code == 200
+    event = next(e for e in crud.get_user_events(db_session, other.id) if e.slate_id == "slate-ctx")
+    assert json.loads(event.ctx_features) != served.tolist()
@@ -1,10 +1,20 @@
 """Tests for the LinUCB model persistence."""
 
 import json
+import threading
+import time
 import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
+from app.core.checkpointer import Checkpointer
+from app.core.context_features import ContextFeatures
+from app.core.rebuild import ArmAccumulator, rebuild_model
 from app.core.recommender.linucb import LinUCBRecommender
+from app.core.recommender.wal import FeedbackLog, replay_feedback_log
 from app.core.training import OnlineTrainer
+from app.db import crud
+from app.db.database import Base
 from app.utils.config import RECOMMENDER_CONFIG
 
 
@@ -98,7 +108,7 @@ def test_online_trainer_flush_saves_model(tmp_path, monkeypatch):
     """Verifies that OnlineTrainer.flush() triggers a model save."""
     model_path = tmp_path / "linucb_state_trainer.json"
 
-    RECOMMENDER_CONFIG["model_path"] = str(model_path)
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "model_path", str(model_path))
 
     d = 3
     rec = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
@@ -109,12 +119,11 @@ def test_online_trainer_flush_saves_model(tmp_path, monkeypatch):
 
     # will automatically flush when adding the second feedback
     trainer.add_feedback(ctx1, arm=10, reward=1.0)
-    save_thread = trainer.add_feedback(ctx2, arm=20, reward=0.0)
+    trainer.add_feedback(ctx2, arm=20, reward=0.0)
+
+    # Wait for the background checkpointer to write it before asserting
+    assert trainer.checkpointer.wait(timeout=10)
 
-    # Wait for the background save thread to finish before asserting
-    if save_thread:
-        save_thread.join()
-        
     assert model_path.exists(), "OnlineTrainer.flush não salvou o estado do modelo."
 
     # sanity check
@@ -124,3 +133,336 @@ def test_online_trainer_flush_saves_model(tmp_path, monkeypatch):
     assert "d" in data and data["d"] == d
     assert "arms" in data and isinstance(data["arms"], dict)
     assert "10" in data["arms"] or 10 in data["arms"]
+
+
+def test_inline_flushes_publish_batches_in_seq_order(tmp_path, monkeypatch):
+    """Concurrent inline flushes apply their batches in feedback-log order."""
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "model_path", None)
+    rec = LinUCBRecommender(n_arms=0, d=3, alpha=1.0)
+    wal = FeedbackLog(str(tmp_path / "feedback.wal"), d=3)
+    trainer = OnlineTrainer(recommender=rec, batch_size=1, wal=wal)
+
+    applying, release = threading.Event(), threading.Event()
+    published = []
+    batch_update = rec.batch_update
+
+    def slow_update(contexts, arms, rewards, wal_seq=None):
+        if wal_seq == 1:
+            applying.set()
+            release.wait(timeout=10)
+        batch_update(contexts, arms, rewards, wal_seq=wal_seq)
+        published.append(rec.store.wal_seq)
+
+    monkeypatch.setattr(rec, "batch_update", slow_update)
+    first = threading.Thread(target=trainer.add_feedback, args=(np.ones(3), 1, 1.0))
+    first.start()
+    assert applying.wait(timeout=10)
+    second = threading.Thread(target=trainer.add_feedback, args=(np.ones(3), 2, 1.0))
+    second.start()
+    time.sleep(0.1)  # the second flush waits for the first one
+    release.set()
+    first.join()
+    second.join()
+    assert published == [1, 2]
+
+
+def test_linucb_binary_checkpoint_is_memory_mapped(tmp_path):
+    """Checks that binary checkpoints round-trip and load without copying."""
+    rec, arms = _build_simple_model(d=3)
+    model_path = tmp_path / "linucb.bin"
+    rec.save_state(str(model_path))
+
+    rec2 = LinUCBRecommender(n_arms=0, d=3, alpha=0.1)
+    rec2.load_state(str(model_path), valid_arms=arms, d_expected=3)
+
+    assert all(isinstance(block, np.memmap) for block in rec2.store.A_inv.blocks)
+    assert rec2.alpha == rec.alpha
+    for arm in arms:
+        assert np.allclose(rec.A_inv[arm], rec2.A_inv[arm])
+        assert np.allclose(rec.b[arm], rec2.b[arm])
+
+    # updates stay in memory (copy-on-write), the file is not modified
+    before = model_path.read_bytes()
+    rec2.update(np.ones(3), arm=arms[0], reward=1.0)
+    assert model_path.read_bytes() == before
+
+
+def test_linucb_update_copies_only_touched_blocks(tmp_path):
+    """Updates after a load read only the written blocks of the map into memory."""
+    rng = np.random.default_rng(0)
+    n, d = 3000, 3
+    rec = LinUCBRecommender(n_arms=n, d=d, alpha=1.0, max_rank=0)
+    rec.batch_update(rng.normal(size=(n, d)), list(range(n)), rng.random(n))
+    model_path = tmp_path / "linucb.bin"
+    rec.save_state(str(model_path))
+
+    rec2 = LinUCBRecommender(n_arms=0, d=d, alpha=1.0, max_rank=0)
+    rec2.load_state(str(model_path), valid_arms=list(range(n)), d_expected=d)
+    before = rec2.store
+    A_inv = before.get_A_inv(np.arange(n))
+    rec2.update(np.ones(d), arm=5, reward=1.0)
+
+    after = rec2.store
+    # the updated arm's rows live in block 0; its new A_inv slot is appended
+    assert after.b.blocks[0] is not before.b.blocks[0]
+    assert all(a is b for a, b in zip(after.b.blocks[1:], before.b.blocks[1:]))
+    assert all(a is b for a, b in zip(after.A_inv.blocks[:2], before.A_inv.blocks[:2]))
+    assert all(isinstance(block, np.memmap) for block in after.A_inv.blocks[:2])
+    # the previous snapshot is untouched
+    np.testing.assert_array_equal(before.get_A_inv(np.arange(n)), A_inv)
+    assert not np.allclose(after.get_A_inv([after.row(5)]), A_inv[5])
+
+
+def test_linucb_imports_legacy_json_checkpoint(tmp_path):
+    """Ensures JSON checkpoints are still imported and can be re-saved as binary."""
+    rec, arms = _build_simple_model(d=3)
+    json_path = tmp_path / "legacy.json"
+    rec.save_state(str(json_path))
+
+    rec2 = LinUCBRecommender(n_arms=0, d=3, alpha=1.0)
+    rec2.load_state(str(json_path), valid_arms=arms + [30], d_expected=3)
+    bin_path = tmp_path / "converted.bin"
+    rec2.save_state(str(bin_path))
+
+    rec3 = LinUCBRecommender(n_arms=0, d=3, alpha=1.0)
+    rec3.load_state(str(bin_path), valid_arms=arms + [30], d_expected=3)
+
+    for arm in arms:
+        assert np.allclose(rec.A_inv[arm], rec3.A_inv[arm])
+        assert np.allclose(rec.b[arm], rec3.b[arm])
+    assert 30 not in rec3.A_inv  # never updated -> kept implicit
+
+
+def test_init_runtime_converts_legacy_json_checkpoint(tmp_path, monkeypatch):
+    """Without a binary checkpoint, init_runtime imports the legacy JSON one and converts it."""
+    from app.core import rl_runtime
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    book_ids = [int(crud.create_book(db, f"Book {i}", categories=["Fiction"]).id) for i in range(3)]
+
+    d = ContextFeatures().feature_dim
+    legacy = LinUCBRecommender(n_arms=0, d=d, alpha=RECOMMENDER_CONFIG["alpha"])
+    legacy.update(np.ones(d), book_ids[1], 1.0)
+    bin_path = tmp_path / "linucb_model.bin"
+    legacy.save_state(str(bin_path.with_suffix(".json")))
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "model_path", str(bin_path))
+
+    rl_runtime.init_runtime(db)
+    db.close()
+    assert bin_path.exists()
+    assert np.allclose(rl_runtime.recommender.A_inv[book_ids[1]], legacy.A_inv[book_ids[1]])
+
+    rec = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec.load_state(str(bin_path), valid_arms=book_ids, d_expected=d)
+    assert np.allclose(rec.b[book_ids[1]], legacy.b[book_ids[1]])
+
+
+def test_linucb_delta_checkpoints_replay_and_compact(tmp_path, monkeypatch):
+    """Checks that incremental checkpoints persist only dirty arms and are replayed."""
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "delta_compaction_ratio", 10.0)
+    d = 4
+    arms = list(range(50))
+    rec = LinUCBRecommender(n_arms=len(arms), d=d, alpha=1.0, max_rank=2)
+    rec.store.add_many(arms)
+
+    model_path = tmp_path / "linucb.bin"
+    rec.checkpoint(str(model_path))  # no base yet -> full snapshot
+    base_size = model_path.stat().st_size
+
+    # arm 3 turns dense, arm 7 stays low-rank
+    for _ in range(3):
+        rec.update(np.array([1.0, 0.0, 0.5, 0.2]), arm=3, reward=1.0)
+    rec.update(np.array([0.0, 1.0, 0.5, 0.1]), arm=7, reward=-1.0)
+    rec.checkpoint(str(model_path))
+
+    delta = tmp_path / "linucb.bin.delta"
+    assert model_path.stat().st_size == base_size
+    assert 0 < delta.stat().st_size < base_size
+
+    rec2 = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec2.load_state(str(model_path), valid_arms=arms, d_expected=d)
+    for arm in (3, 7, 8):
+        assert np.allclose(rec.A_inv[arm], rec2.A_inv[arm])
+        assert np.allclose(rec.b[arm], rec2.b[arm])
+
+    # compaction folds the deltas into a new base and drops the segment
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "delta_compaction_ratio", 0.0)
+    rec.update(np.ones(d), arm=3, reward=0.3)
+    rec.checkpoint(str(model_path))
+    assert not delta.exists()
+
+    rec3 = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec3.load_state(str(model_path), valid_arms=arms, d_expected=d)
+    assert np.allclose(rec.A_inv[3], rec3.A_inv[3])
+    assert np.allclose(rec.b[3], rec3.b[3])
+
+
+def test_linucb_torn_delta_is_cut_before_next_checkpoint(tmp_path, monkeypatch):
+    """Checks that a torn delta record does not hide the records appended after it."""
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "delta_compaction_ratio", 10.0)
+    d = 4
+    arms = list(range(20))
+    rec = LinUCBRecommender(n_arms=len(arms), d=d, alpha=1.0)
+    rec.store.add_many(arms)
+    model_path = tmp_path / "linucb.bin"
+    rec.checkpoint(str(model_path))
+
+    rec.update(np.array([1.0, 0.0, 0.5, 0.2]), arm=3, reward=1.0)
+    rec.checkpoint(str(model_path))
+
+    # crash in the middle of the next append
+    delta = tmp_path / "linucb.bin.delta"
+    with open(delta, "ab") as f:
+        f.write(b"LUC2\x00\x01")
+
+    rec2 = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec2.load_state(str(model_path), valid_arms=arms, d_expected=d)
+    assert np.allclose(rec.A_inv[3], rec2.A_inv[3])
+
+    rec2.update(np.array([0.0, 1.0, 0.5, 0.1]), arm=7, reward=-1.0)
+    rec2.checkpoint(str(model_path))
+
+    rec3 = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec3.load_state(str(model_path), valid_arms=arms, d_expected=d)
+    for arm in (3, 7):
+        assert np.allclose(rec2.A_inv[arm], rec3.A_inv[arm])
+        assert np.allclose(rec2.b[arm], rec3.b[arm])
+
+
+def test_checkpointer_coalesces_requests():
+    """Requests made during a save merge into one write of the latest state."""
+    class SlowModel:
+        def __init__(self):
+            self.version = 0
+            self.saved = []
+            self.active = 0
+            self.overlap = False
+            self.lock = threading.Lock()
+
+        def checkpoint(self, path):
+            with self.lock:
+                self.active += 1
+                self.overlap |= self.active > 1
+            time.sleep(0.05)
+            self.saved.append(self.version)
+            with self.lock:
+                self.active -= 1
+
+    model = SlowModel()
+    checkpointer = Checkpointer(model, min_interval=0.0)
+    for version in range(1, 21):
+        model.version = version
+        checkpointer.request("unused")
+        time.sleep(0.005)
+
+    assert checkpointer.wait(timeout=10)
+    checkpointer.stop()
+    assert not model.overlap
+    assert len(model.saved) < 20
+    assert model.saved[-1] == 20
+    assert checkpointer.stats()["last_save_at"] is not None
+
+
+def test_feedback_log_replays_samples_lost_in_a_crash(tmp_path, monkeypatch):
+    """Logged samples not in the checkpoint are replayed; saved ones are dropped."""
+    model_path = str(tmp_path / "linucb.bin")
+    wal_path = str(tmp_path / "feedback.wal")
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "model_path", model_path)
+
+    d = 3
+    rng = np.random.default_rng(5)
+    samples = [
+        (rng.normal(size=d), int(rng.choice([10, 20, 30])), float(rng.random()))
+        for _ in range(7)
+    ]
+
+    rec = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    wal = FeedbackLog(wal_path, d=d)
+    trainer = OnlineTrainer(recommender=rec, batch_size=4, wal=wal)
+    for x, arm, reward in samples:
+        trainer.add_feedback(x, arm, reward)
+    assert trainer.checkpointer.wait(timeout=10)
+    assert len(trainer.buffer) == 3  # logged but not applied: lost by a crash
+    assert wal.records()["seq"].tolist() == [5, 6, 7]  # 1-4 are in the checkpoint
+    wal.close()
+
+    expected = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    for x, arm, reward in samples:
+        expected.update(x, arm, reward)
+
+    restored = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    restored.load_state(model_path, valid_arms=[10, 20, 30], d_expected=d)
+    assert restored.store.wal_seq == 4
+    wal = FeedbackLog(wal_path, d=d, start_seq=restored.store.wal_seq)
+    assert replay_feedback_log(restored, wal, valid_arms=[10, 20, 30]) == 3
+    assert wal.append(np.zeros(d), 10, 0.0) == 8
+    wal.close()
+
+    for arm in (10, 20, 30):
+        assert np.allclose(restored.A_inv[arm], expected.A_inv[arm])
+        assert np.allclose(restored.b[arm], expected.b[arm])
+
+
+def test_rebuild_model_from_events_matches_online_updates(tmp_path, monkeypatch):
+    """Rebuilding from events (process pool, arm partitions) equals online training."""
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "wal_path", None)
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    d = ContextFeatures().feature_dim
+    user = crud.create_user(db, "rebuild", "pw")
+    books = [crud.create_book(db, f"Book {i}", categories=["Fiction"]) for i in range(5)]
+    book_ids = [int(b.id) for b in books]
+
+    rng = np.random.default_rng(11)
+    expected = LinUCBRecommender(n_arms=0, d=d, alpha=RECOMMENDER_CONFIG["alpha"])
+    for i in range(40):
+        book_id = book_ids[rng.integers(len(book_ids))]
+        x = rng.normal(size=d)
+        reward = float(rng.random())
+        crud.create_event(
+            db, user.id, book_id, "s", i, "like", json.dumps(x.tolist()), reward=reward
+        )
+        expected.update(x, book_id, reward)
+    # no context / a context of another feature_dim: skipped
+    crud.create_event(db, user.id, book_ids[0], "s", 0, "clear", None, reward=1.0)
+    crud.create_event(db, user.id, book_ids[0], "s", 0, "clear", "[1.0, 2.0]", reward=1.0)
+
+    output = tmp_path / "rebuilt.bin"
+    stats = rebuild_model(db, output=str(output), workers=2, chunk=7)
+    db.close()
+
+    assert stats["events"] == 42 and stats["used"] == 40 and stats["skipped"] == 2
+    rec = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    rec.load_state(str(output), valid_arms=book_ids, d_expected=d)
+    for arm in expected.A_inv:
+        assert np.allclose(rec.A_inv[arm], expected.A_inv[arm])
+        assert np.allclose(rec.b[arm], expected.b[arm])
+
+
+def test_arm_accumulator_matches_per_sample_sums():
+    """Checks the grouped per-arm sums (across chunks and merges) against a loop."""
+    rng = np.random.default_rng(7)
+    d = 5
+    parts = [ArmAccumulator(d), ArmAccumulator(d)]
+    S, b = {}, {}
+    for i in range(6):
+        arms = rng.integers(0, 40, size=50)
+        X = rng.normal(size=(50, d))
+        r = rng.normal(size=50)
+        parts[i % 2].add(arms, X, r)
+        for a, x, reward in zip(arms.tolist(), X, r):
+            S[a] = S.get(a, 0) + np.outer(x, x)
+            b[a] = b.get(a, 0) + reward * x
+
+    acc = ArmAccumulator(d)
+    for part in parts:
+        acc.merge(part)
+    bundle = acc.bundle()
+    assert sorted(bundle["arm_ids"].tolist()) == sorted(S)
+    for row, arm in enumerate(bundle["arm_ids"].tolist()):
+        assert np.allclose(bundle["A_inv"][row], np.linalg.inv(np.eye(d) + S[arm]))
+        assert np.allclose(bundle["b"][row], b[arm])
@@ -1,11 +1,18 @@
 """Recommender logic tests using LinUCB and helpers."""
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
 import numpy as np
 
 from app.core.context_features import ContextFeatures
+from app.core.item_features import ItemFeatureStore
+from app.core.candidates import CandidateIndex
 from app.core.recommender.linucb import LinUCBRecommender
+from app.core.recommender.factorized import FactorizedScorer
 from app.core.training import OnlineTrainer
-from app.db import crud
+from app.db import crud, models
 from app.core import rl_runtime
 
 
@@ -26,6 +33,28 @@ def test_linucb_ranks_by_confidence():
     assert chosen == [12, 11]
 
 
+def test_linucb_batched_scores_match_per_arm_loop():
+    """Checks the vectorized ranking against a per-arm UCB computation."""
+    rng = np.random.default_rng(0)
+    d = 5
+    recommender = LinUCBRecommender(n_arms=20, d=d, alpha=0.7)
+    arms = list(range(100, 120))
+    for _ in range(60):
+        recommender.update(rng.normal(size=d), int(rng.choice(arms)), rng.normal())
+
+    contexts = rng.normal(size=(len(arms), d))
+    expected = []
+    for arm, x in zip(arms, contexts):
+        A_inv = recommender.A_inv[arm]
+        theta = A_inv @ recommender.b[arm]
+        expected.append((theta.T @ x).item() + 0.7 * np.sqrt(x @ A_inv @ x))
+    expected_order = [arms[i] for i in np.argsort(expected)[::-1][:7]]
+
+    chosen = recommender.recommend(arms, contexts, n_recommendations=7)
+
+    assert chosen == expected_order
+
+
 def test_linucb_update_adjusts_parameters():
     """Tests if the update method correctly adjusts the A and b matrices."""
     recommender = LinUCBRecommender(n_arms=1, d=3, alpha=0.5)
@@ -43,6 +72,268 @@ def test_linucb_update_adjusts_parameters():
     assert np.allclose(recommender.b[5], expected_b)
 
 
+def test_arm_store_grows_in_place_with_dense_rows():
+    """Ensures the arm store assigns dense rows and keeps parameters on growth."""
+    recommender = LinUCBRecommender(n_arms=2, d=2, alpha=0.5)
+    recommender.update(np.array([1.0, 0.0]), arm=42, reward=1.0)
+    rows = recommender.store.add_many([42, 7, 9, 7])
+
+    assert rows.tolist() == [0, 1, 2, 1]
+    assert recommender.store.capacity >= 3
+    assert np.allclose(recommender.b[42], np.array([[1.0], [0.0]]))
+    assert np.allclose(recommender.A_inv[7], np.eye(2))
+    assert set(recommender.A_inv) == {42, 7, 9}
+
+
+def test_linucb_batch_update_matches_sequential_updates():
+    """Ensures grouped Woodbury batch updates match sample-by-sample updates."""
+    rng = np.random.default_rng(1)
+    d = 6
+    # repeated arms (rank-k path) mixed with arms seen once (rank-1 path)
+    arms = rng.permutation(np.concatenate([rng.choice(6, size=30), np.arange(100, 110)]))
+    contexts = rng.normal(size=(40, d))
+    rewards = rng.choice([1.0, -1.0, 0.3], size=40)
+
+    sequential = LinUCBRecommender(n_arms=6, d=d, alpha=0.5)
+    batched = LinUCBRecommender(n_arms=6, d=d, alpha=0.5)
+    for x, a, r in zip(contexts[:10], arms[:10], rewards[:10]):
+        sequential.update(x, int(a), float(r))
+        batched.update(x, int(a), float(r))
+
+    for x, a, r in zip(contexts[10:], arms[10:], rewards[10:]):
+        sequential.update(x, int(a), float(r))
+    batched.batch_update(contexts[10:], arms[10:], rewards[10:])
+
+    assert set(sequential.A_inv) == set(batched.A_inv)
+    for arm in sequential.A_inv:
+        assert np.allclose(sequential.A_inv[arm], batched.A_inv[arm])
+        assert np.allclose(sequential.b[arm], batched.b[arm])
+
+
+def test_linucb_theta_cache_tracks_updates():
+    """Checks the cached theta matches A_inv @ b after single and batch updates."""
+    rng = np.random.default_rng(2)
+    recommender = LinUCBRecommender(n_arms=4, d=3, alpha=0.5)
+    recommender.update(rng.normal(size=3), arm=1, reward=1.0)
+    recommender.batch_update(rng.normal(size=(6, 3)), [1, 2, 2, 3, 4, 4], np.ones(6))
+
+    store = recommender.store
+    for arm in (1, 2, 3, 4):
+        row = store.row(arm)
+        expected = recommender.A_inv[arm] @ recommender.b[arm]
+        assert np.allclose(store.theta[row], expected[:, 0])
+
+
+def test_linucb_cold_arms_stay_implicit():
+    """Ensures cold arms are scored in closed form and never materialized."""
+    recommender = LinUCBRecommender(n_arms=100, d=2, alpha=1.0)
+    recommender.update(np.array([1.0, 0.0]), arm=1, reward=-1.0)
+
+    contexts = np.array([[1.0, 0.0], [3.0, 4.0], [0.0, 2.0]])
+    chosen = recommender.recommend([1, 2, 3], contexts, n_recommendations=3)
+
+    # cold scores: alpha * ||x|| = 5 and 2; warm arm 1 is penalized
+    assert chosen == [2, 3, 1]
+    assert set(recommender.A_inv) == {1}
+    assert len(recommender.store) == 1
+
+
+def test_linucb_low_rank_arms_match_dense_arms():
+    """Checks low-rank factored arms behave exactly like dense A_inv arms."""
+    rng = np.random.default_rng(3)
+    d = 12
+    dense = LinUCBRecommender(n_arms=10, d=d, alpha=0.8, max_rank=0)
+    low_rank = LinUCBRecommender(n_arms=10, d=d, alpha=0.8, max_rank=4)
+
+    # arm 0 receives many updates (turns dense), the others only a few
+    arms = np.concatenate([np.zeros(9, dtype=int), rng.integers(1, 10, size=15)])
+    contexts = rng.normal(size=(arms.shape[0], d))
+    rewards = rng.normal(size=arms.shape[0])
+    for i in range(0, arms.shape[0], 6):
+        dense.batch_update(contexts[i : i + 6], arms[i : i + 6], rewards[i : i + 6])
+        low_rank.batch_update(contexts[i : i + 6], arms[i : i + 6], rewards[i : i + 6])
+
+    store = low_rank.store
+    assert store.rank[store.row(0)] == -1
+    assert (store.rank[[store.row(a) for a in range(1, 10) if a in store]] >= 0).all()
+    for arm in dense.A_inv:
+        assert np.allclose(dense.A_inv[arm], low_rank.A_inv[arm])
+        assert np.allclose(dense.b[arm], low_rank.b[arm])
+
+    candidates = list(range(12))
+    X = rng.normal(size=(len(candidates), d))
+    assert dense.recommend(candidates, X, 5) == low_rank.recommend(candidates, X, 5)
+
+
+def test_linucb_float32_packed_state_tracks_float64(tmp_path, monkeypatch):
+    """Checks the float32/packed storage mode stays close to the float64 model."""
+    from app.utils.config import RECOMMENDER_CONFIG
+
+    rng = np.random.default_rng(4)
+    d = 8
+    exact = LinUCBRecommender(n_arms=5, d=d, alpha=0.8, max_rank=2)
+
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "state_dtype", "float32")
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "state_packed", True)
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "precision_check_every", 5)
+    compact = LinUCBRecommender(n_arms=5, d=d, alpha=0.8, max_rank=2)
+
+    for _ in range(40):
+        arms = rng.integers(0, 5, size=4)
+        X = rng.normal(size=(4, d))
+        r = rng.normal(size=4)
+        exact.batch_update(X, arms, r)
+        compact.batch_update(X, arms, r)
+
+    store = compact.store
+    assert store.A_inv.dtype == np.float32
+    assert store.A_inv.shape[1:] == (d * (d + 1) // 2,)
+    for arm in exact.A_inv:
+        assert np.allclose(exact.A_inv[arm], compact.A_inv[arm], atol=1e-4)
+
+    candidates = list(range(8))
+    X = rng.normal(size=(len(candidates), d))
+    assert exact.recommend(candidates, X, 3) == compact.recommend(candidates, X, 3)
+
+    # a float32 checkpoint reloaded in float64 mode is converted on load
+    path = tmp_path / "model.bin"
+    compact.save_state(path)
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "state_dtype", "float64")
+    monkeypatch.setitem(RECOMMENDER_CONFIG, "state_packed", False)
+    reloaded = LinUCBRecommender(n_arms=5, d=d, alpha=0.8)
+    reloaded.load_state(path, valid_arms=list(range(5)), d_expected=d)
+    assert reloaded.store.A_inv.dtype == np.float64
+    for arm in compact.A_inv:
+        assert np.allclose(reloaded.A_inv[arm], compact.A_inv[arm], atol=1e-6)
+
+
+def test_linucb_pruned_top_k_matches_full_scoring():
+    """Checks branch-and-bound top-k returns the same arms as full scoring."""
+    rng = np.random.default_rng(6)
+    d = 6
+    recommender = LinUCBRecommender(n_arms=500, d=d, alpha=0.3, max_rank=2)
+    arms = rng.integers(0, 400, size=1500)
+    X = rng.normal(size=(arms.shape[0], d))
+    rewards = X[:, 0] + 0.1 * rng.normal(size=arms.shape[0])
+    recommender.batch_update(X, arms, rewards)
+
+    candidates = list(range(500))  # arms >= 400 stay cold
+    contexts = rng.normal(size=(len(candidates), d))
+    for k in (1, 10, 100):
+        full = recommender.recommend(candidates, contexts, k, pruned=False)
+        assert recommender.recommend(candidates, contexts, k, pruned=True) == full
+
+
+def test_factorized_scorer_matches_full_contexts():
+    """Checks the factorized scorer ranks like recommend() and tracks updates."""
+    rng = np.random.default_rng(5)
+    d = 9
+    dynamic_cols = [0, 1, 2, 5]
+    recommender = LinUCBRecommender(n_arms=20, d=d, alpha=0.7, max_rank=2)
+    scorer = FactorizedScorer(recommender, dynamic_cols)
+
+    arms = list(range(100, 120))
+    items = rng.normal(size=(len(arms), d))
+    scorer.set_items(arms, items)
+    assert scorer.missing(arms + [999]) == [999]
+
+    def check():
+        user = rng.normal(size=3)
+        genre_match = rng.random((len(arms), 1))
+        X = items.copy()
+        X[:, :3] = user
+        X[:, 5] = genre_match[:, 0]
+        expected = recommender.recommend(arms, X, 6)
+        assert scorer.recommend(arms, user, 6, dynamic_item=genre_match) == expected
+
+    check()  # all arms cold
+    for _ in range(5):
+        chosen = rng.choice(arms, size=4)
+        recommender.batch_update(rng.normal(size=(4, d)), chosen, rng.random(4))
+        check()  # updated arms are refreshed
+
+
+def test_factorized_scorer_rows_track_store_rows():
+    """Row-based scoring maps cache rows to store rows added before and after set_items."""
+    rng = np.random.default_rng(8)
+    d = 5
+    recommender = LinUCBRecommender(n_arms=0, d=d, alpha=0.6, max_rank=1)
+    recommender.batch_update(rng.normal(size=(2, d)), [7, 3], rng.random(2))  # before set_items
+    scorer = FactorizedScorer(recommender, [0, 4])
+
+    arms = [3, 5, 7, 9]
+    items = rng.normal(size=(len(arms), d))
+    scorer.set_items(arms, items)
+    idx = scorer.rows(arms)
+    np.testing.assert_array_equal(idx, np.arange(len(arms)))
+
+    def check():
+        X = items.copy()
+        X[:, 0] = 0.3
+        X[:, 4] = 1.0
+        store = recommender.store
+        expected = recommender._scores(store, store.rows(arms), X)
+        np.testing.assert_allclose(scorer.score_rows(idx, [0.3], np.ones((4, 1))), expected)
+        top = scorer.recommend_rows(idx[::-1], [0.3], 2, dynamic_item=np.ones((4, 1)))
+        assert scorer.arm_ids(top) == [arms[i] for i in np.argsort(-expected)[:2]]
+
+    check()
+    recommender.batch_update(rng.normal(size=(3, d)), [9, 9, 5], rng.random(3))  # new store rows
+    check()
+    scorer.set_items([11], rng.normal(size=(1, d)))  # appended after the others
+    assert scorer.rows([11]).tolist() == [4]
+    check()
+
+
+def test_linucb_empty_checkpoint_scores_cold_arms(tmp_path):
+    """Checks a model loaded from a checkpoint without arms still ranks cold arms."""
+    d = 4
+    path = str(tmp_path / "empty.bin")
+    LinUCBRecommender(n_arms=0, d=d, alpha=1.0).save_state(path)
+
+    recommender = LinUCBRecommender(n_arms=0, d=d, alpha=1.0)
+    recommender.load_state(path, valid_arms=[1, 2, 3], d_expected=d)
+    X = np.array([[1.0, 0.0, 0.0, 0.0], [2.0, 0.0, 0.0, 0.0], [0.5, 0.0, 0.0, 0.0]])
+    assert recommender.recommend([1, 2, 3], X, 2, pruned=True) == [2, 1]
+
+    scorer = FactorizedScorer(recommender, [3])
+    scorer.set_items([1, 2, 3], X)
+    assert scorer.recommend([1, 2, 3], np.ones(1), 1) == [2]
+
+
+def test_linucb_updates_publish_new_snapshots():
+    """Updates swap in a new store; snapshots held by readers never change."""
+    rng = np.random.default_rng(3)
+    d = 4
+    recommender = LinUCBRecommender(n_arms=5, d=d, alpha=0.5, max_rank=0)
+    recommender.update(rng.normal(size=d), arm=1, reward=1.0)
+    items = rng.normal(size=(2, d))
+    items[:, :2] = 0.0  # dynamic columns, filled with zeros when scoring
+    scorer = FactorizedScorer(recommender, [0, 1])
+    scorer.set_items([1, 2], items)
+    scorer.score([1, 2], np.zeros(2))
+
+    before = recommender.store
+    theta = before.theta[before.row(1)].copy()
+    cached = scorer._cache
+    cached_terms = tuple(np.array(a) for a in (cached.A_yy, cached.theta_s, cached.row))
+    recommender.batch_update(rng.normal(size=(3, d)), [1, 2, 2], [1.0, 0.0, 1.0])
+
+    after = recommender.store
+    assert after is not before
+    assert 2 not in before
+    np.testing.assert_array_equal(before.theta[before.row(1)], theta)
+    assert after.lineage == before.lineage  # scorer entries stay keyed by row/version
+    np.testing.assert_allclose(
+        scorer.score([1, 2], np.zeros(2)),
+        recommender._scores(after, after.rows([1, 2]), items),
+    )
+    # the scorer refreshed into a new cache version; the old one is untouched
+    assert scorer._cache is not cached
+    for held, copied in zip((cached.A_yy, cached.theta_s, cached.row), cached_terms):
+        np.testing.assert_array_equal(np.array(held), copied)
+
+
 def test_online_trainer_flushes_batch():
     """Ensures the OnlineTrainer processes the buffer when it hits batch_size."""
     recommender = LinUCBRecommender(n_arms=5, d=2, alpha=0.5)
@@ -60,6 +351,61 @@ def test_online_trainer_flushes_batch():
     assert 1 in recommender.A_inv and 2 in recommender.A_inv
 
 
+def test_online_trainer_background_worker(monkeypatch):
+    """The worker applies batches by size or latency and drains on stop."""
+    monkeypatch.setitem(rl_runtime.RECOMMENDER_CONFIG, "model_path", None)
+    recommender = LinUCBRecommender(n_arms=5, d=2, alpha=0.5)
+    trainer = OnlineTrainer(recommender=recommender, batch_size=2, max_latency=0.05)
+    trainer.start()
+    assert trainer.running
+
+    trainer.add_feedback(np.array([1.0, 0.0]), arm=1, reward=1.0)
+    assert trainer.add_feedback(np.array([0.0, 1.0]), arm=2, reward=0.2) is None
+    trainer.add_feedback(np.array([1.0, 1.0]), arm=3, reward=0.5)  # odd one: latency flush
+    trainer.flush()
+    assert all(arm in recommender.A_inv for arm in (1, 2, 3))
+    assert trainer.stats()["applied"] == 3
+
+    trainer.add_feedback(np.array([1.0, 0.0]), arm=4, reward=1.0)
+    trainer.stop()
+    assert not trainer.running
+    assert 4 in recommender.A_inv
+    assert trainer.stats()["queue_depth"] == 0
+
+
+def test_online_trainer_full_queue_defers_without_serializing(monkeypatch):
+    """Producers on a full queue wait in parallel and their samples are kept."""
+    monkeypatch.setitem(rl_runtime.RECOMMENDER_CONFIG, "model_path", None)
+    recommender = LinUCBRecommender(n_arms=10, d=2, alpha=0.5)
+    trainer = OnlineTrainer(
+        recommender=recommender, batch_size=1, max_latency=0.0, queue_size=1, put_timeout=0.2
+    )
+    release = threading.Event()
+    batch_update = recommender.batch_update
+
+    def slow_update(*args, **kwargs):
+        release.wait()
+        return batch_update(*args, **kwargs)
+
+    monkeypatch.setattr(recommender, "batch_update", slow_update)
+    trainer.start()
+
+    def produce(arm):
+        start = time.perf_counter()
+        trainer.add_feedback(np.array([1.0, 0.0]), arm=arm, reward=1.0)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        latencies = list(pool.map(produce, range(8)))
+    assert max(latencies) < 1.0  # one put_timeout each, not one after another
+    assert trainer.stats()["deferred"] > 0
+
+    release.set()
+    trainer.stop()
+    assert all(arm in recommender.A_inv for arm in range(8))
+    assert trainer.stats()["applied"] == 8
+
+
 def test_context_features_default_shape():
     """Checks the dimensionality of the default context feature vector."""
     features = ContextFeatures()
@@ -82,6 +428,92 @@ def test_context_uses_db_fields(db_session):
     assert not np.allclose(ctx, np.zeros_like(ctx))
 
 
+def test_get_contexts_matches_per_book_contexts(db_session):
+    """Checks the batched context builder stacks the same rows as get_context."""
+    user = crud.create_user(db_session, "ctx_batch", "pw")
+    books = [
+        crud.create_book(
+            db_session, f"CB{i}", authors=["A"], categories=[f"G{i}"], description="d",
+            ratings_count=i, avg_rating=float(i),
+        )
+        for i in range(3)
+    ]
+    ids = [b.id for b in books] + [10**9]  # unknown book -> zero item features
+    features = ContextFeatures()
+
+    expected = np.array(
+        [features.get_context(user.id, b, db=db_session, user_preferred_genres=["g1"]) for b in ids]
+    )
+    X = features.get_contexts(user.id, ids, db=db_session, user_preferred_genres=["g1"])
+    assert X.shape == (len(ids), features.feature_dim)
+    assert np.allclose(X, expected)
+
+
+def test_item_feature_store_matches_db_features(db_session, tmp_path):
+    """Checks precomputed item rows match the per-book DB path and persist."""
+    books = [
+        crud.create_book(
+            db_session, f"IF{i}", authors=["A"], categories=["G1"], description="d",
+            ratings_count=10 * i, avg_rating=float(i % 5),
+        )
+        for i in range(3)
+    ]
+    ids = [b.id for b in books]
+    features = ContextFeatures()
+    path = tmp_path / "item_features"
+
+    store = ItemFeatureStore(features, path)
+    store.build(db_session, ids[:2])
+    assert store.rows(ids[:2]).tolist() == [0, 1]
+    assert store.add_books(db_session, ids) == [ids[2]]
+    for bid in ids:
+        expected = features.get_item_features(bid, db=db_session, user_preferred_genres=["g1"])
+        features.item_store = store
+        got = features.get_item_features(bid, db=db_session, user_preferred_genres=["g1"])
+        features.item_store = None
+        assert np.allclose(got, expected)
+
+    # a rebuild reuses the persisted rows
+    reloaded = ItemFeatureStore(features, path)
+    assert reloaded.build(db_session, ids[::-1]) == {"reused": 3, "computed": 0}
+    assert np.allclose(reloaded.get_many(ids), store.get_many(ids))
+
+    # ... except for books whose source columns changed
+    books[1].avg_rating = 4.5
+    db_session.commit()
+    changed = ItemFeatureStore(features, path)
+    assert changed.build(db_session, ids) == {"reused": 2, "computed": 1}
+    expected = features.get_item_features(ids[1], db=db_session)
+    assert np.allclose(changed.get(ids[1]), expected)
+    assert np.allclose(changed.get_many([ids[0], ids[2]]), store.get_many([ids[0], ids[2]]))
+
+
+def test_genre_bitmasks_match_string_genre_match(db_session):
+    """Checks the vectorized genre_match agrees with the string comparison."""
+    books = [
+        crud.create_book(
+            db_session, f"GM{i}", authors=["A"], categories=[f"Genre {i}", f"Genre {i + 1}"]
+        )
+        for i in range(0, 140, 2)  # > 64 categories: several mask words
+    ]
+    ids = [b.id for b in books]
+    features = ContextFeatures()
+    store = ItemFeatureStore(features)
+    store.build(db_session, ids)
+    assert store._items.genre_masks.shape[1] > 1
+
+    for prefs in (None, [], ["genre 3"], [" GENRE 99", "genre 138"], ["unknown"]):
+        expected = [features._genre_match(b.get_categories_list, prefs) for b in books]
+        assert store.genre_match(ids, prefs).tolist() == expected
+
+    user = crud.create_user(db_session, "gm_user", "pw")
+    crud.update_user_genres(db_session, user.id, "Genre 3,Genre 99")
+    assert features.get_user_genres(user.id, db=db_session) == ["Genre 3", "Genre 99"]
+    crud.update_user_genres(db_session, user.id, "Genre 5")
+    features.invalidate_user_genres(user.id)
+    assert features.get_user_genres(user.id, db=db_session) == ["Genre 5"]
+
+
 def test_arm_index_matches_books(db_session):
     """Ensures the runtime arm index corresponds to books in the database."""
     books = [
@@ -97,3 +529,93 @@ def test_arm_index_matches_books(db_session):
     assert set(rl_runtime.ARM_INDEX.keys()) == book_ids
     # Ensure ARM_INDEX order is aligned with BOOK_IDS length
     assert len(rl_runtime.BOOK_IDS) == len(book_ids)
+
+
+def test_created_books_join_the_runtime_aligned(db_session):
+    """Books created after init_runtime get arm rows in every runtime structure."""
+    crud.create_book(db_session, "Before", authors=["A"], categories=["C1"])
+    rl_runtime.init_runtime(db_session)
+    n = len(rl_runtime.BOOK_IDS)
+
+    book = crud.create_book(db_session, "After", authors=["A"], categories=["New genre"])
+    assert book.id not in rl_runtime.ARM_INDEX  # queued until the next slate
+    rl_runtime.add_pending_books(db_session)
+
+    row = rl_runtime.ARM_INDEX[book.id]
+    assert row == n and rl_runtime.BOOK_IDS[row] == book.id
+    assert rl_runtime.item_store.rows([book.id]).tolist() == [row]
+    assert rl_runtime.scorer.rows([book.id]).tolist() == [row]
+    assert rl_runtime.candidates.arm_ids[row] == book.id
+    assert rl_runtime.item_store.genre_match_rows([row], ["new genre"]).tolist() == [1.0]
+    expected = rl_runtime.features.get_item_features(book.id, db=db_session)
+    assert np.allclose(rl_runtime.item_store.get(book.id), expected)
+
+
+def test_item_feature_store_versions_are_immutable(db_session):
+    """add_books publishes a new version; readers of the old one see no change."""
+    books = [crud.create_book(db_session, f"V{i}", categories=[f"Vg{i}"]) for i in range(3)]
+    ids = [b.id for b in books]
+    store = ItemFeatureStore(ContextFeatures())
+    store.build(db_session, ids[:2])
+    old = store._items
+    old_masks = old.genre_masks[: old.n].copy()
+    assert store.genre_match(ids[:2], ["vg0"]).tolist() == [1.0, 0.0]
+
+    store.add_books(db_session, ids)
+    assert store._items is not old
+    assert ids[2] not in old.index and old.n == 2
+    np.testing.assert_array_equal(old.genre_masks[: old.n], old_masks)
+    assert store.genre_match(ids, ["vg2"]).tolist() == [0.0, 0.0, 1.0]
+
+
+def test_candidate_index_excludes_current_feedback(db_session):
+    """Checks the exclusion bitsets follow user_book_state and feedback updates."""
+    user = crud.create_user(db_session, "cand_user", "pw")
+    books = [
+        crud.create_book(db_session, f"Cand{i}", authors=["A"], categories=["C"])
+        for i in range(10)
+    ]
+    ids = [b.id for b in books]
+    crud.create_event(db_session, user.id, ids[3], "s", pos=1, action_type="like")
+    crud.create_event(db_session, user.id, ids[9], "s", pos=2, action_type="dislike")
+
+    index = CandidateIndex(ids, max_users=1)
+    assert index.candidates(db_session, user.id).tolist() == ids[:3] + ids[4:9]
+
+    index.record(user.id, ids[3], models.ActionType.CLEAR)
+    index.record(user.id, ids[0], models.ActionType.LIKE)
+    assert index.candidates(db_session, user.id).tolist() == ids[1:9]
+
+    sample = index.candidates(db_session, user.id, sample=4, rng=np.random.default_rng(0))
+    assert len(set(sample.tolist())) == 4 and set(sample.tolist()) <= set(ids[1:9])
+
+    # LRU of one user: another user's lookup evicts the cached bitset
+    index.candidates(db_session, user.id + 1000)
+    assert user.id not in index._bits
+
+
+def test_candidate_index_redoes_load_overlapping_feedback(db_session):
+    """Checks a bitset loaded before a concurrent feedback event is not cached stale."""
+    user = crud.create_user(db_session, "race_user", "pw")
+    books = [
+        crud.create_book(db_session, f"Race{i}", authors=["A"], categories=["C"])
+        for i in range(4)
+    ]
+    ids = [b.id for b in books]
+    index = CandidateIndex(ids)
+    load = index._load
+    calls = []
+
+    def racing_load(db, user_id):
+        bits = load(db, user_id)
+        if not calls:
+            # feedback committed and recorded while the first load is in flight
+            crud.create_event(db, user_id, ids[1], "s", pos=0, action_type="like")
+            index.record(user_id, ids[1], models.ActionType.LIKE)
+        calls.append(user_id)
+        return bits
+
+    index._load = racing_load
+    assert index.candidates(db_session, user.id).tolist() == [ids[0]] + ids[2:]
+    assert len(calls) == 2
+    assert index.candidates(db_session, user.id).tolist() == [ids[0]] + ids[2:]
@@ -41,3 +41,52 @@ def test_slate_caps_n_items(client, user_and_books):
         "authors" in item and "categories" in item and "image" in item
         for item in data["recommendations"]
     )
+
+
+def test_book_card_cache_hydrates_and_invalidates(db_session):
+    """Checks cards keep the slate order and are refreshed when a book changes."""
+    from app.core.book_cards import BookCardCache, book_cards
+    from app.db import crud
+
+    books = [
+        crud.create_book(db_session, f"Card{i}", authors=["A"], categories=["C"])
+        for i in range(3)
+    ]
+    ids = [books[2].id, books[0].id, 10**9, books[1].id]
+
+    cache = BookCardCache(max_size=10, ttl=None)
+    cards = cache.get_cards(db_session, ids)
+    assert [c["book_id"] for c in cards] == [books[2].id, books[0].id, books[1].id]
+    assert cards[0]["authors"] == "A" and cards[0]["categories"] == "C"
+    assert len(cache) == 3
+
+    book_cards.get_cards(db_session, [books[0].id])
+    books[0].title = "Card renamed"
+    db_session.flush()
+    assert book_cards._cards.get(books[0].id) is not None  # not committed yet: kept
+    db_session.commit()
+    assert book_cards.get_cards(db_session, [books[0].id])[0]["title"] == "Card renamed"
+
+    book_cards.get_cards(db_session, [books[1].id])
+    books[1].title = "Card rolled back"
+    db_session.flush()
+    db_session.rollback()
+    db_session.commit()
+    # rolled back: nothing to invalidate
+    assert book_cards._cards.get(books[1].id)["title"] == "Card1"
+
+
+def test_slate_keeps_full_contexts_of_served_books(client, user_and_books, db_session):
+    """Checks the contexts kept for /feedback match the full per-book contexts."""
+    import numpy as np
+    from app.core import rl_runtime as rl
+
+    user, books = user_and_books
+    resp = client.post("/slate/recommend", params={"user_id": user.id, "n_items": 2})
+    assert resp.status_code == 200
+    payload = resp.json()
+
+    for item in payload["recommendations"]:
+        served = rl.served_contexts.get((user.id, payload["slate_id"], item["book_id"]))
+        expected = rl.features.get_context(user.id, item["book_id"], db=db_session)
+        assert np.allclose(served, expected)